@@ -0,0 +1,235 @@
+# encoding: utf-8
+"""Pages of vantetider.se for the benchmarks, served by benchmarks.server.
+
+Pages recorded from the site with benchmarks.record are kept in
+benchmarks/fixtures/ and are used where they exist. Other pages are built
+here, in the markup of the three table layouts of the site:
+
+    "regular"          a plain table, eg Overbelaggning
+    "vertical_scroll"  a table with a fixed header, eg PrimarvardTelefon
+    "tabs"             a tab per measure, each with a horizontally
+                       scrolling table with a column per period, eg
+                       VantatKortareAn60Dagar
+
+The built pages are deterministic, so that runs can be compared.
+"""
+import hashlib
+import io
+import os
+
+from vantetider.scraper import get_region_slug
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fixtures")
+
+REGIONS = [
+    ("10", u"Riket"), ("1", u"Stockholm"), ("3", u"Uppsala"),
+    ("4", u"Södermanland"), ("5", u"Östergötland"), ("6", u"Jönköping"),
+    ("7", u"Kronoberg"), ("8", u"Kalmar"), ("9", u"Gotland"),
+    ("27", u"Blekinge"), ("12", u"Skåne"), ("13", u"Halland"),
+    ("14", u"Västra Götaland"), ("17", u"Värmland"), ("18", u"Örebro"),
+    ("19", u"Västmanland"), ("20", u"Dalarna"), ("21", u"Gävleborg"),
+    ("22", u"Västernorrland"), ("23", u"Jämtland Härjedalen"),
+    ("24", u"Västerbotten"), ("25", u"Norrbotten"),
+]
+NATIONAL = "10"
+YEARS = ["2019", "2018", "2017", "2016", "2015"]
+PERIODS = [u"Januari", u"Februari", u"Mars", u"April", u"Maj", u"Juni",
+           u"Juli", u"Augusti", u"September", u"Oktober", u"November",
+           u"December"]
+MEASURES = [u"Antal", u"Andel inom 60 dagar", u"Andel inom 90 dagar"]
+
+# Implemented datasets: (id, label, layout, radio buttons)
+DATASETS = [
+    ("VantatKortareAn60Dagar", u"Väntat kortare än 60 dagar ", "tabs", []),
+    ("Overbelaggning", u"Överbeläggningar", "regular",
+     [("type_of_overbelaggning", [("0", u"Somatik"), ("1", u"Psykiatri")])]),
+    ("PrimarvardTelefon", u"Telefontillgänglighet", "vertical_scroll", []),
+    ("PrimarvardBesok", u"Läkarbesök", "vertical_scroll", []),
+    ("SpecialiseradBesok", u"Förstabesök", "tabs", []),
+    ("SpecialiseradOperation", u"Operation/åtgärd", "regular", []),
+]
+LAYOUTS = ["regular", "vertical_scroll", "tabs"]
+
+# Units per region on regional pages
+DEFAULT_UNITS = 40
+
+LABEL = (u'<span class="clickable" '
+         u'onclick="handle_click_event_landsting(this, {})">{}</span>')
+
+
+def get_dataset(dataset_id):
+    for dataset in DATASETS:
+        if dataset[0] == dataset_id:
+            return dataset
+    raise KeyError(u"No fixtures for {}".format(dataset_id))
+
+
+def get_region_by_slug(slug):
+    """ Get the id of a region by the slug of its url
+    """
+    if slug == "Sveriges":
+        return NATIONAL
+    for region_id, label in REGIONS:
+        if get_region_slug(label) == slug:
+            return region_id
+    raise KeyError(u"Unknown region: {}".format(slug))
+
+
+def get_units(region_id, n_units=DEFAULT_UNITS):
+    return [(u"{}{:03d}".format(region_id, i), u"Vårdcentral {} {}".format(
+        region_id, i)) for i in range(1, n_units + 1)]
+
+
+def get_value(*key):
+    """ A value like those on the site: "12,3 %", or "-" for missing values
+    """
+    h = int(hashlib.md5(u"|".join(key).encode("utf-8")).hexdigest()[:6], 16)
+    if h % 23 == 0:
+        return u"-"
+    return u"{},{} %".format(h % 100, h % 10)
+
+
+def _get_rows(region_id, n_units):
+    """ Regions and units of a result page. The national page lists regions,
+        regional pages the region and its units.
+    """
+    if region_id == NATIONAL:
+        return [x for x in REGIONS if x[0] != NATIONAL]
+    label = dict(REGIONS)[region_id]
+    return [(region_id, label)] + get_units(region_id, n_units)
+
+
+def _options(items, selected):
+    return u"".join(u'<option value="{}"{}>{}</option>'.format(
+        _id, u' selected="selected"' if _id == selected else u"", label)
+        for _id, label in items)
+
+
+def get_form(dataset_id, selection):
+    """ The filter form of a result page
+    """
+    radios = u""
+    for name, options in get_dataset(dataset_id)[3]:
+        checked = selection.get(name, options[0][0])
+        radios += u"".join(
+            u'<input type="radio" name="{}" value="{}" id="{}"{}/>'.format(
+                name, _id, label,
+                u' checked="checked"' if _id == checked else u"")
+            for _id, label in options)
+    gender = u' checked="checked"' if selection.get("checkbox_gender") else u""
+    return (u'<form action="/Kontaktkort/Sveriges/{}/" method="post">'
+            u'<select name="select_region">{}</select>'
+            u'<select name="select_year">{}</select>'
+            u'<select name="select_period">{}</select>{}'
+            u'<input type="checkbox" name="checkbox_gender" value="true"{}/>'
+            u'<label class="checkbox">Kön</label>'
+            u'</form>').format(
+        dataset_id,
+        _options(REGIONS, selection["select_region"]),
+        _options([(x, x) for x in YEARS], selection["select_year"]),
+        _options([(x, x) for x in PERIODS], selection["select_period"]),
+        radios, gender)
+
+
+def get_table(layout, rows, key):
+    """ The data table of a result page
+        :param rows: [(id, label)] of regions and units
+        :param key: selected values, that the values depend on
+    """
+    if layout in ["regular", "vertical_scroll"]:
+        body = u"".join(u"<tr><td>{}</td>{}</tr>".format(
+            LABEL.format(_id, label),
+            u"".join(u"<td>{}</td>".format(get_value(_id, m, *key))
+                     for m in MEASURES))
+            for _id, label in rows)
+        if layout == "regular":
+            head = u"<th>Region</th>" + u"".join(u"<th>{}\n</th>".format(m)
+                                                 for m in MEASURES)
+            return (u'<div class="chart table scrolling"><table><tr><td>'
+                    u'</td></tr></table></div>'
+                    u'<div class="chart table scrolling"><table><thead><tr>{}'
+                    u'</tr></thead><tbody>{}</tbody></table></div>'
+                    ).format(head, body)
+        head = u"<th>Region</th>" + u"".join(u"<th>{}</th>".format(m)
+                                             for m in MEASURES)
+        return (u'<div id="DataTables_Table_0_wrapper">'
+                u'<div class="dataTables_scrollHead"><table><tr>{}</tr>'
+                u'</table></div><div class="dataTables_scrollBody"><table>'
+                u'<tbody>{}</tbody></table></div></div>').format(head, body)
+
+    if layout != "tabs":
+        raise ValueError(u"Unknown layout: {}".format(layout))
+    tabs = u'<ul class="table_switch">{}</ul>'.format(u"".join(
+        u'<li><span class="visible_normal">{}</span><span>{}</span></li>'
+        .format(m, m[:3]) for m in MEASURES))
+    left = u"".join(u"<tr><td>{}</td></tr>".format(LABEL.format(_id, label))
+                    for _id, label in rows)
+    head = u"".join(u"<th>{}</th>".format(p) for p in PERIODS)
+    sub_tables = []
+    for m in MEASURES:
+        values = u"".join(u"<tr>{}</tr>".format(u"".join(
+            u"<td>{}</td>".format(get_value(_id, m, key[0], p, *key[2:]))
+            for p in PERIODS)) for _id, label in rows)
+        sub_tables.append(
+            u'<div class="dataTables_wrapper"><div class="DTFC_ScrollWrapper">'
+            u'<div class="DTFC_LeftBodyWrapper"><table><tbody>{}</tbody>'
+            u'</table></div><div class="dataTables_scrollHead"><table><tr>{}'
+            u'</tr></table></div><div class="dataTables_scrollBody"><table>'
+            u'<tbody>{}</tbody></table></div></div></div>'.format(
+                left, head, values))
+    return tabs + u"".join(sub_tables)
+
+
+def result_page(dataset_id, selection=None, n_units=DEFAULT_UNITS):
+    """ A result page (or landing page) of a dataset
+        :param selection: form data of the query
+    """
+    layout = get_dataset(dataset_id)[2]
+    selection = dict(selection or {})
+    selection.setdefault("select_region", NATIONAL)
+    selection.setdefault("select_year", YEARS[0])
+    selection.setdefault("select_period", PERIODS[0])
+    # Regions are posted by id or by label
+    by_label = dict((label, _id) for _id, label in REGIONS)
+    selection["select_region"] = by_label.get(selection["select_region"],
+                                              selection["select_region"])
+    key = [selection["select_year"], selection["select_period"]] + \
+        [selection.get(name, u"") for name, options
+         in get_dataset(dataset_id)[3]]
+    rows = _get_rows(selection["select_region"], n_units)
+    # Navigation, like the menus and footer of the site
+    nav = u"<a href='#'>Länk</a>" * 200
+    return (u"<html><head><title>{}</title></head><body><div class='nav'>{}"
+            u"</div>{}{}<p>Sidfot</p></body></html>").format(
+        dataset_id, nav, get_form(dataset_id, selection),
+        get_table(layout, rows, key))
+
+
+def layout_page(layout, region_id="27", n_units=DEFAULT_UNITS):
+    """ A result page with a table of a layout, with units
+    """
+    dataset_id = [x[0] for x in DATASETS if x[2] == layout][0]
+    return result_page(dataset_id, {"select_region": region_id},
+                       n_units=n_units)
+
+
+def start_page():
+    links = u"".join(u'<a href="/Kontaktkort/Sveriges/{}/">{}</a>'.format(
+        dataset_id, label) for dataset_id, label, _, _ in DATASETS)
+    return (u'<html><body><ul class="main-nav page-width"><li><a>Hem</a></li>'
+            u'<li><a href="/Kontaktkort/Sveriges/">Om</a>'
+            u'<a href="/Kontaktkort/Sveriges/">Hjälp</a>{}'
+            u'<a href="/Kontaktkort/Sveriges/BUP/">BUP</a></li></ul>'
+            u'</body></html>').format(links)
+
+
+def get_recorded(name):
+    """ Get a recorded page, or None
+        :param name: "start", a dataset id, or "<dataset id>-<region slug>"
+    """
+    path = os.path.join(FIXTURES_DIR, name + ".html")
+    if not os.path.exists(path):
+        return None
+    with io.open(path, encoding="utf-8") as f:
+        return f.read()
@@ -0,0 +1,70 @@
+# encoding: utf-8
+"""Record pages of vantetider.se as benchmark fixtures. Recorded pages are
+served by benchmarks.server instead of the built ones.
+
+    python -m benchmarks.record                 # all implemented datasets
+    python -m benchmarks.record Overbelaggning --region Blekinge
+
+For each dataset the landing page is saved, and the result page of a
+region, with units. The start page is saved as "start".
+"""
+import argparse
+import io
+import os
+
+from vantetider import VantetiderScraper
+from vantetider import scraper as scraper_module
+
+from .fixtures import FIXTURES_DIR
+
+
+def save(name, html, path=FIXTURES_DIR):
+    if not os.path.exists(path):
+        os.makedirs(path)
+    filename = os.path.join(path, name + ".html")
+    if not isinstance(html, bytes):
+        html = html.encode("utf-8")
+    with io.open(filename, "wb") as f:
+        f.write(html)
+    return filename
+
+
+def record(datasets=None, region="Blekinge", path=FIXTURES_DIR):
+    """ Record pages from the site
+        :param datasets: ids of datasets, defaults to all implemented datasets
+        :param region: id or label of the region to record result pages of
+        :returns: paths of the recorded files
+    """
+    scraper = VantetiderScraper(cache=None)
+    files = [save("start", scraper._get_html(
+        scraper_module.BASE_URL + "Sveriges"), path)]
+    if datasets is None:
+        datasets = [x.id for x in scraper.items]
+    for dataset_id in datasets:
+        scraper.move_to_top()
+        dataset = scraper.get(dataset_id)
+        files.append(save(dataset.id, dataset.html, path))
+
+        region_id = dataset._get_region(region).value
+        url = dataset.get_url(region_id)
+        html = scraper._post_html(url, {"select_region": region_id})
+        slug = dataset._get_region_slug(region_id)
+        files.append(save(u"{}-{}".format(dataset.id, slug), html, path))
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Record pages of vantetider.se as benchmark fixtures")
+    parser.add_argument("datasets", nargs="*")
+    parser.add_argument("--region", default="Blekinge",
+                        help="Region to record result pages of")
+    parser.add_argument("--path", default=FIXTURES_DIR)
+    args = parser.parse_args(argv)
+    for filename in record(args.datasets or None, region=args.region,
+                           path=args.path):
+        print(filename)
+
+
+if __name__ == "__main__":
+    main()
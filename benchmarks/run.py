@@ -0,0 +1,279 @@
+# encoding: utf-8
+"""Benchmarks of parsing and fetching, run against a local stand-in for
+vantetider.se (see benchmarks.server), without network access.
+
+    python -m benchmarks.run                # compare with the baseline
+    python -m benchmarks.run --save         # save results as the baseline
+    python -m benchmarks.run --check        # exit 1 on a regression
+
+Each benchmark reports the best time of `repeat` runs, pages and rows per
+second, and fetches also their peak memory (measured in a separate run, as
+tracemalloc slows everything down). Baselines depend on the machine, so
+the machine is saved with them.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from vantetider import VantetiderScraper
+from vantetider.extract import ExtractedPage
+from vantetider.scraper import Datatable, ResultPage
+
+from . import fixtures
+from .server import FixtureServer
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "baseline.json")
+
+# A result is a regression if it is this much slower than the baseline
+DEFAULT_TOLERANCE = 0.25
+
+
+def get_machine():
+    return u"{} {} python {}".format(platform.node(), platform.machine(),
+                                     platform.python_version())
+
+
+def measure(func, repeat=3):
+    """ Time a function
+        :param func: a function returning (pages, rows)
+        :returns: {"seconds", "pages", "rows", "pages_per_s", "rows_per_s"},
+            with the best time of `repeat` runs
+    """
+    times = []
+    for i in range(repeat):
+        gc.collect()
+        start = time.time()
+        pages, rows = func()
+        times.append(time.time() - start)
+    seconds = min(times)
+    return {
+        "seconds": seconds,
+        "pages": pages,
+        "rows": rows,
+        "pages_per_s": pages / seconds if seconds else None,
+        "rows_per_s": rows / seconds if seconds else None,
+    }
+
+
+def measure_memory(func):
+    """ Peak memory allocated by a function, in MB
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / 1024.0 ** 2
+
+
+def bench_datatable(layout, n_units, pages=5):
+    """ Parse result pages of a layout into rows
+    """
+    html = fixtures.layout_page(layout, n_units=n_units)
+
+    def _run():
+        rows = 0
+        for i in range(pages):
+            rows += len(Datatable(html).data)
+        return pages, rows
+    return _run
+
+
+def bench_extract(layout, n_units, pages=5):
+    """ Read result pages of a layout into rows with the stream extractor
+    """
+    html = fixtures.layout_page(layout, n_units=n_units)
+
+    def _run():
+        rows = 0
+        for i in range(pages):
+            rows += len(ExtractedPage(html).data)
+        return pages, rows
+    return _run
+
+
+def bench_current_selection(dataset, layout, n_units, pages=5):
+    """ Read the selected form values of parsed result pages
+    """
+    html = fixtures.layout_page(layout, n_units=n_units)
+    # Selection is read with the extractor of the scraper, see
+    # VantetiderDataset._read_result_page
+    if dataset.scraper.extractor == "stream":
+        page = ExtractedPage(html)
+    else:
+        page = ResultPage(html)
+
+    def _run():
+        for i in range(pages):
+            dataset._get_current_selection(page)
+        return pages, 0
+    return _run
+
+
+def bench_parse_result_page(dataset, regions):
+    """ Request and parse the regional result pages of a dataset
+    """
+    def _run():
+        rows = 0
+        for region in regions:
+            url = dataset.get_url(region)
+            rows += len(dataset._parse_result_page(
+                url, {"select_region": region}))
+        return len(regions), rows
+    return _run
+
+
+def bench_fetch(server, dataset, query, workers):
+    """ Fetch a query, end to end
+    """
+    def _run():
+        requests = server.requests
+        res = dataset.fetch(query, workers=workers)
+        # Fetch keeps results by query
+        dataset._data.clear()
+        return server.requests - requests, len(res)
+    return _run
+
+
+def run_benchmarks(repeat=3, n_units=fixtures.DEFAULT_UNITS, workers=4,
+                   names=None, memory=True):
+    """ Run all benchmarks
+        :param names: only run benchmarks with names containing one of these
+        :returns: {name: result}, see measure()
+    """
+    def _wanted(name):
+        return names is None or any(x in name for x in names)
+
+    results = {}
+    for layout in fixtures.LAYOUTS:
+        name = "datatable.{}".format(layout)
+        if _wanted(name):
+            results[name] = measure(bench_datatable(layout, n_units), repeat)
+        name = "extract.{}".format(layout)
+        if _wanted(name):
+            results[name] = measure(bench_extract(layout, n_units), repeat)
+
+    with FixtureServer(n_units=n_units) as server:
+        # No cache, so that every page is requested and parsed
+        scraper = VantetiderScraper(cache=None, workers=workers,
+                                    progress_interval=None)
+        for dataset_id, label, layout, radios in fixtures.DATASETS:
+            scraper.move_to_top()
+            dataset = scraper.get(dataset_id)
+            regions = [x[0] for x in fixtures.REGIONS[1:]]
+
+            name = "current_selection.{}".format(dataset_id)
+            if _wanted(name):
+                results[name] = measure(bench_current_selection(
+                    dataset, layout, n_units), repeat)
+
+            name = "parse_result_page.{}".format(dataset_id)
+            if _wanted(name):
+                results[name] = measure(bench_parse_result_page(
+                    dataset, regions[:5]), repeat)
+
+            name = "fetch.{}".format(dataset_id)
+            if _wanted(name):
+                query = {"region": regions, "year": fixtures.YEARS[0],
+                         "period": fixtures.PERIODS[:2]}
+                func = bench_fetch(server, dataset, query, workers)
+                results[name] = measure(func, repeat)
+                if memory:
+                    results[name]["peak_mb"] = measure_memory(func)
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    with open(path, "w") as f:
+        json.dump({"machine": get_machine(), "created": time.time(),
+                   "results": results}, f, indent=2, sort_keys=True)
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Compare results with a baseline
+        :returns: a list of (name, seconds, baseline seconds, ratio,
+            is regression)
+    """
+    rows = []
+    for name, result in sorted(results.items()):
+        base = baseline["results"].get(name) if baseline else None
+        if base is None:
+            rows.append((name, result["seconds"], None, None, False))
+            continue
+        ratio = result["seconds"] / base["seconds"]
+        rows.append((name, result["seconds"], base["seconds"], ratio,
+                     ratio > 1 + tolerance))
+    return rows
+
+
+def format_results(results, comparison):
+    lines = [u"{:<42} {:>9} {:>9} {:>10} {:>8} {:>7}".format(
+        u"benchmark", u"seconds", u"pages/s", u"rows/s", u"peak MB",
+        u"vs base")]
+    for name, seconds, base, ratio, regression in comparison:
+        result = results[name]
+        lines.append(u"{:<42} {:>9.4f} {:>9.1f} {:>10.0f} {:>8} {:>7}{}".format(
+            name, seconds, result["pages_per_s"] or 0, result["rows_per_s"] or 0,
+            u"{:.1f}".format(result["peak_mb"]) if "peak_mb" in result else u"",
+            u"{:.2f}x".format(ratio) if ratio is not None else u"-",
+            u"  SLOWER" if regression else u""))
+    return u"\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark parsing and fetching against a local copy "
+                    "of vantetider.se")
+    parser.add_argument("-k", "--filter", action="append", default=None,
+                        metavar="NAME",
+                        help="Only run benchmarks with names containing NAME")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--units", type=int, default=fixtures.DEFAULT_UNITS,
+                        help="Units per region on regional pages")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Workers of fetch benchmarks")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skip measuring peak memory")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true",
+                        help="Save the results as the baseline")
+    parser.add_argument("--check", action="store_true",
+                        help="Exit with status 1 if a benchmark is slower "
+                             "than the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(repeat=args.repeat, n_units=args.units,
+                             workers=args.workers, names=args.filter,
+                             memory=not args.no_memory)
+    baseline = load_baseline(args.baseline)
+    if baseline is not None and baseline.get("machine") != get_machine():
+        print(u"Baseline is from another machine: {}".format(
+            baseline.get("machine")))
+    comparison = compare(results, baseline, tolerance=args.tolerance)
+    print(format_results(results, comparison))
+
+    if args.save:
+        save_baseline(results, args.baseline)
+        print(u"Saved baseline to {}".format(args.baseline))
+    if args.check and any(x[4] for x in comparison):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
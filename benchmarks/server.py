@@ -0,0 +1,147 @@
+# encoding: utf-8
+"""A local stand-in for vantetider.se, serving the pages of
+benchmarks.fixtures.
+
+    with FixtureServer() as server:
+        scraper = VantetiderScraper()
+        dataset = scraper.get("Overbelaggning")  # from the local server
+
+While the server runs, vantetider.scraper.BASE_URL points to it.
+"""
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl
+
+from vantetider import scraper as scraper_module
+
+from . import fixtures
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def get_page(path, form, n_units=fixtures.DEFAULT_UNITS):
+    """ Get the html of a url path, as the site would respond
+        :param path: eg "/Kontaktkort/Blekinges/Overbelaggning/"
+        :param form: posted form data
+        :returns: html, or None if there is no such page
+    """
+    parts = [x for x in path.split("?")[0].split("/") if x]
+    if parts == ["Kontaktkort", "Sveriges"]:
+        return fixtures.get_recorded("start") or fixtures.start_page()
+    if len(parts) != 3 or parts[0] != "Kontaktkort":
+        return None
+    slug, dataset_id = parts[1], parts[2]
+    try:
+        fixtures.get_dataset(dataset_id)
+        region_id = fixtures.get_region_by_slug(slug)
+    except KeyError:
+        return None
+
+    recorded = fixtures.get_recorded(u"{}-{}".format(dataset_id, slug)) or \
+        fixtures.get_recorded(dataset_id)
+    if recorded is not None:
+        return recorded
+    form = dict(form)
+    form.setdefault("select_region", region_id)
+    return fixtures.result_page(dataset_id, form, n_units=n_units)
+
+
+class FixtureServer(object):
+    """ Serve fixtures on a local port, in a thread
+    """
+    def __init__(self, n_units=fixtures.DEFAULT_UNITS, port=0, errors=0,
+                 error_status=500, retry_after=None):
+        """
+            :param n_units: units per region on regional pages
+            :param port: port to listen on, 0 picks a free port
+            :param errors: respond with an error to this many result page
+                queries (POST) first, like the site does when it fails
+            :param error_status: HTTP status of the error responses, 500 when
+                a page fails to render, 503 when the site is overloaded
+            :param retry_after: Retry-After header of the error responses
+        """
+        self.n_units = n_units
+        self.port = port
+        self.errors = errors
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._httpd = None
+
+    @property
+    def base_url(self):
+        return u"http://127.0.0.1:{}/Kontaktkort/".format(
+            self._httpd.server_address[1])
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _respond(self, form):
+                with server._lock:
+                    server.requests += 1
+                    fail = self.command == "POST" and server.errors > 0
+                    if fail:
+                        server.errors -= 1
+                if fail:
+                    self.send_response(server.error_status)
+                    if server.retry_after is not None:
+                        self.send_header("Retry-After", str(server.retry_after))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                html = get_page(self.path, form, n_units=server.n_units)
+                if html is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                data = html.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond({})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8")
+                self._respond(parse_qsl(body))
+
+        return Handler
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", self.port),
+                                          self._make_handler())
+        thread = threading.Thread(target=self._httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self._base_url = scraper_module.BASE_URL
+        scraper_module.BASE_URL = self.base_url
+        return self
+
+    def stop(self):
+        scraper_module.BASE_URL = self._base_url
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -22,11 +22,28 @@ setup(
     zip_safe=False,
     install_requires=[
         "requests",
-        "requests_cache",
+        # Retry(allowed_methods=...)
+        "urllib3>=1.26",
         "BeautifulSoup4",
+        "numpy",
+        "pandas",
     ],
+    extras_require={
+        # Faster html parsing
+        "lxml": ["lxml"],
+        # Async http client of vantetider.aio
+        "aiohttp": ["aiohttp"],
+        # Parquet and Arrow export, see vantetider.export
+        "pyarrow": ["pyarrow"],
+    },
+    entry_points={
+        "console_scripts": [
+            "vantetider-harvest=vantetider.harvest:main",
+        ],
+    },
     test_suite="nose.collector",
-    tests_require=["nose"],
+    # pyarrow and aiohttp for the tests of the export and the async client
+    tests_require=["nose", "pyarrow", "aiohttp"],
     include_package_data=True,
     download_url="https://github.com/jplusplus/vantetider-scraper/archive/%s.tar.gz"
                  % version,
@@ -0,0 +1,101 @@
+# encoding: utf-8
+"""Pages of vantetider.se, and helpers, shared by the tests.
+"""
+from vantetider import VantetiderScraper
+from vantetider.scraper import VantetiderDataset
+
+# The fixture server of the benchmarks, serving pages like vantetider.se.
+# Tests get it from here.
+from benchmarks.server import FixtureServer  # noqa: F401
+
+# The landing page of a dataset, with its filter form
+LANDING_PAGE = u"""<html><body>
+<div class="nav"><a href="/">Start</a></div>
+<form action="/Kontaktkort/Sveriges/Overbelaggning/" method="post">
+  <select name="select_region">
+    <option value="10" selected="selected">Riket</option>
+    <option value="27">Blekinge</option>
+  </select>
+  <select name="select_year"><option>2019</option><option>2018</option></select>
+  <input type="radio" name="type_of_overbelaggning" value="0" id="Somatik"/>
+  <input type="radio" name="type_of_overbelaggning" value="1" id="Psykiatri" checked="checked"/>
+  <input type="checkbox" name="checkbox_gender" value="true"/>
+  <label class="checkbox">Kön</label>
+</form>
+<div class="chart table scrolling"><table></table></div>
+</body></html>"""
+
+# The filter form of a dataset by year and period
+MONTHLY_LANDING_PAGE = u"""<form action="/Kontaktkort/Sveriges/Overbelaggning/">
+  <select name="select_region">
+    <option value="10">Riket</option><option value="27">Blekinge</option>
+  </select>
+  <select name="select_year">
+    <option>2017</option><option selected="selected">2018</option>
+  </select>
+  <select name="select_period">
+    <option>Januari</option><option selected="selected">Februari</option>
+    <option>Mars</option>
+  </select>
+</form>"""
+
+# The filter form of a dataset by year only
+YEARLY_LANDING_PAGE = u"""<form action="/Kontaktkort/Sveriges/Overbelaggning/">
+  <select name="select_region"><option value="10">Riket</option></select>
+  <select name="select_year">
+    <option>2017</option><option selected="selected">2018</option>
+    <option>2019</option>
+  </select>
+</form>"""
+
+# Result pages with a table of each layout, see ResultPage.layout
+LABEL = u'<span class="clickable" onclick="handle_click_event_landsting(this, {})">{}</span>'
+
+REGULAR_TABLE = u"""<html><body>
+<div class="chart table scrolling"><table></table></div>
+<div class="chart table scrolling"><table>
+  <thead><tr><th>Region</th><th>Antal</th><th>Andel</th></tr></thead>
+  <tbody>
+    <tr><td>{}</td><td>1 234 st</td><td>12,5 %</td></tr>
+    <tr><td>{}</td><td>-</td><td>7,0 %</td></tr>
+  </tbody>
+</table></div>
+</body></html>""".format(LABEL.format(27, u"Blekinge"),
+                         LABEL.format(2701, u"Karlskrona VC"))
+
+VERTICAL_SCROLL_TABLE = u"""<html><body>
+<div id="DataTables_Table_0_wrapper">
+  <div class="dataTables_scrollHead"><table><tr><th>Region</th><th>Antal</th></tr></table></div>
+  <div class="dataTables_scrollBody"><table><tbody>
+    <tr><td>{}</td><td>3</td></tr>
+  </tbody></table></div>
+</div>
+</body></html>""".format(LABEL.format(9, u"Gotland"))
+
+TABBED_TABLE = u"""<html><body>
+<ul class="table_switch">
+  <li><span class="visible_normal">Antal</span><span>A</span></li>
+  <li>Andel</li>
+</ul>
+{tables}
+</body></html>"""
+
+SUB_TABLE = u"""<div class="dataTables_wrapper"><div class="DTFC_ScrollWrapper">
+  <div class="DTFC_LeftBodyWrapper"><table><tbody><tr><td>{}</td></tr></tbody></table></div>
+  <div class="dataTables_scrollHead"><table><tr><th>Januari</th><th>Februari</th></tr></table></div>
+  <div class="dataTables_scrollBody"><table><tbody><tr><td>{}</td><td>{}</td></tr></tbody></table></div>
+</div></div>"""
+
+
+def make_dataset(html=LANDING_PAGE, scraper=None, label=None):
+    """ A dataset read from a landing page, without any requests
+        :param scraper: the scraper of the dataset, by default a new one
+            without cache
+    """
+    if scraper is None:
+        scraper = VantetiderScraper(cache=None)
+    dataset = VantetiderDataset("Overbelaggning", label=label)
+    dataset._html = html
+    dataset.scraper = scraper
+    scraper.current_item = dataset
+    return dataset
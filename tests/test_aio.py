@@ -0,0 +1,207 @@
+# encoding: utf-8
+import asyncio
+import time
+from unittest import TestCase, skipIf
+
+from vantetider import VantetiderScraper
+from vantetider.aio import (AsyncVantetiderScraper, AsyncFlights, Response,
+                            AiohttpClient, imap_bounded, aiohttp)
+
+from tests.fixtures import FixtureServer
+
+
+class CountingClient(object):
+    """ Wraps a client, and counts the requests in flight
+    """
+    def __init__(self, client):
+        self.client = client
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self, method, url, data=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            return await self.client.request(method, url, data)
+        finally:
+            self.in_flight -= 1
+
+    async def close(self):
+        await self.client.close()
+
+
+class TestAsyncScraper(TestCase):
+
+    def test_same_results_as_sync(self):
+        query = {"region": ["Blekinge", "Kalmar"], "year": ["2017", "2018"]}
+        with FixtureServer(n_units=2):
+            dataset = VantetiderScraper(cache=None).get("Overbelaggning")
+            expected = dataset.fetch(query).list_of_dicts
+            expected_rows = list(dataset.iter_fetch(query))
+
+            async def _fetch():
+                async with AsyncVantetiderScraper(cache=None) as scraper:
+                    dataset = await scraper.get("Overbelaggning")
+                    res = await scraper.fetch(dataset, query)
+                    rows = [row async for row in
+                            scraper.iter_fetch(dataset, query, ordered=False)]
+                    return res, rows, scraper.stats
+
+            res, rows, stats = asyncio.run(_fetch())
+
+        self.assertEqual(res.list_of_dicts, expected)
+
+        def _key(row):
+            return repr(sorted(row.items()))
+        self.assertEqual(sorted(rows, key=_key),
+                         sorted(expected_rows, key=_key))
+        self.assertEqual(stats.get("requests_total", method="POST"), 8)
+
+    def test_concurrency_limit(self):
+        query = {"region": "Blekinge", "year": ["2016", "2017", "2018"],
+                 "period": ["Januari", "Februari"]}
+        with FixtureServer(n_units=1):
+            async def _fetch():
+                async with AsyncVantetiderScraper(cache=None, concurrency=2) \
+                        as scraper:
+                    scraper.client = CountingClient(scraper.client)
+                    dataset = await scraper.get("Overbelaggning")
+                    res = await scraper.fetch(dataset, query)
+                    return res, scraper.client
+
+            res, client = asyncio.run(_fetch())
+        self.assertEqual(len(res), 6 * 2 * 3)
+        self.assertEqual(client.max_in_flight, 2)
+
+    def test_reuse_in_loops(self):
+        # One scraper, used in two event loops one after the other, with
+        # requests waiting for a slot in both
+        query = {"region": "Blekinge", "year": ["2017", "2018"]}
+        with FixtureServer(n_units=1):
+            scraper = AsyncVantetiderScraper(cache=None, concurrency=1,
+                                             client="threads")
+            scraper.client = CountingClient(scraper.client)
+
+            async def _fetch():
+                dataset = await scraper.get("Overbelaggning")
+                return await scraper.fetch(dataset, query)
+
+            try:
+                for i in range(2):
+                    self.assertEqual(len(asyncio.run(_fetch())), 2 * 2 * 3)
+            finally:
+                asyncio.run(scraper.close())
+        self.assertEqual(scraper.client.max_in_flight, 1)
+
+    @skipIf(aiohttp is None, "aiohttp is not installed")
+    def test_aiohttp_client(self):
+        query = {"region": ["Blekinge", "Kalmar"], "year": "2018"}
+        with FixtureServer(n_units=1, errors=1, error_status=503,
+                           retry_after=1):
+            async def _fetch():
+                client = AiohttpClient(retries=1, backoff_factor=0)
+                async with AsyncVantetiderScraper(cache=None, client=client) \
+                        as scraper:
+                    dataset = await scraper.get("Overbelaggning")
+                    start = time.time()
+                    res = await scraper.fetch(dataset, query)
+                    return res, time.time() - start
+
+            res, elapsed = asyncio.run(_fetch())
+            expected = VantetiderScraper(cache=None).get("Overbelaggning")\
+                .fetch(query).list_of_dicts
+        self.assertEqual(res.list_of_dicts, expected)
+        # The 503 was retried after the Retry-After of the response
+        self.assertGreaterEqual(elapsed, 1)
+
+    def test_skip_errors(self):
+        class FailingClient(object):
+            async def request(self, method, url, data=None):
+                return Response(500, b"", 0.0, 0.0, 0.0, None)
+
+            async def close(self):
+                pass
+
+        with FixtureServer(n_units=1):
+            async def _fetch():
+                async with AsyncVantetiderScraper(cache=None, retry_passes=1,
+                                                  retry_delay=0) as scraper:
+                    dataset = await scraper.get("Overbelaggning")
+                    scraper.client = FailingClient()
+                    res = await scraper.fetch(dataset, {"region": "Blekinge"})
+                    return res, scraper.stats
+
+            res, stats = asyncio.run(_fetch())
+        self.assertEqual(len(res), 0)
+        self.assertEqual(stats.get("retried_pages_total"), 1)
+        self.assertEqual(stats.get("skipped_pages_total"), 1)
+        self.assertEqual(stats.get("http_errors_total", status="500"), 2)
+
+    def test_retry_pass(self):
+        query = {"region": "Blekinge", "year": ["2017", "2018"]}
+        with FixtureServer(n_units=1, errors=1):
+            async def _fetch():
+                async with AsyncVantetiderScraper(cache=None, retry_passes=1,
+                                                  retry_delay=0,
+                                                  rate_limit="adaptive") \
+                        as scraper:
+                    dataset = await scraper.get("Overbelaggning")
+                    res = await scraper.fetch(dataset, query)
+                    return res, scraper.stats
+
+            res, stats = asyncio.run(_fetch())
+        self.assertEqual(len(res), 2 * 2 * 3)
+        self.assertEqual(stats.get("retried_pages_total"), 1)
+        self.assertEqual(stats.get("skipped_pages_total"), 0)
+
+    def test_adaptive_retries(self):
+        with FixtureServer(n_units=1, errors=2, error_status=503,
+                           retry_after=1):
+            async def _fetch():
+                async with AsyncVantetiderScraper(cache=None, backoff_factor=0,
+                                                  rate_limit="adaptive") \
+                        as scraper:
+                    dataset = await scraper.get("Overbelaggning")
+                    res = await scraper.fetch(dataset, {"region": "Blekinge",
+                                                        "year": "2018"})
+                    return res, scraper.scraper.rate_limiter
+
+            res, limiter = asyncio.run(_fetch())
+        self.assertEqual(len(res), 2 * 3)
+        self.assertGreaterEqual(limiter.decreases, 1)
+        self.assertGreater(limiter.error_rate, 0)
+
+
+class TestAsyncHelpers(TestCase):
+
+    def test_flights(self):
+        calls = []
+
+        async def _call(x):
+            calls.append(x)
+            await asyncio.sleep(0.01)
+            return x * 2
+
+        async def _run():
+            flights = AsyncFlights()
+            results = await asyncio.gather(*[flights.do("a", _call, 1)
+                                             for _ in range(3)])
+            return results, flights.shared
+
+        results, shared = asyncio.run(_run())
+        self.assertEqual(calls, [1])
+        self.assertEqual(shared, 2)
+        self.assertEqual(sorted(results), [(2, False), (2, True), (2, True)])
+
+    def test_imap_bounded(self):
+        async def _double(x):
+            await asyncio.sleep(0.01 * (3 - x))
+            return x * 2
+
+        async def _run(ordered):
+            return [x async for x in imap_bounded(_double, range(3), limit=3,
+                                                  ordered=ordered)]
+
+        self.assertEqual(asyncio.run(_run(True)), [0, 2, 4])
+        self.assertEqual(asyncio.run(_run(False)), [4, 2, 0])
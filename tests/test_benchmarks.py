@@ -0,0 +1,40 @@
+# encoding: utf-8
+from unittest import TestCase
+
+from benchmarks.run import run_benchmarks, compare
+from vantetider import VantetiderScraper
+from vantetider import scraper as scraper_module
+
+from tests.fixtures import FixtureServer
+
+
+class TestBenchmarks(TestCase):
+
+    def test_fixture_server(self):
+        base_url = scraper_module.BASE_URL
+        with FixtureServer(n_units=2) as server:
+            scraper = VantetiderScraper(cache=None)
+            self.assertEqual(len(scraper.items), 6)
+            dataset = scraper.get("Overbelaggning")
+            self.assertEqual(dataset.layout, "regular")
+            res = dataset.fetch({"region": "Blekinge", "year": "2018"})
+            # A region, two units and three measures
+            self.assertEqual(len(res), 9)
+            self.assertTrue(server.requests > 0)
+        self.assertEqual(scraper_module.BASE_URL, base_url)
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(repeat=1, n_units=2, workers=2,
+                                 names=["datatable", "fetch.Overbelaggning"])
+        self.assertEqual(sorted(results), ["datatable.regular", "datatable.tabs",
+                                           "datatable.vertical_scroll",
+                                           "fetch.Overbelaggning"])
+        self.assertTrue(results["fetch.Overbelaggning"]["rows"] > 0)
+        self.assertIn("peak_mb", results["fetch.Overbelaggning"])
+
+        baseline = {"results": {"datatable.tabs": dict(
+            results["datatable.tabs"],
+            seconds=results["datatable.tabs"]["seconds"] / 2)}}
+        comparison = dict((x[0], x) for x in compare(results, baseline))
+        self.assertTrue(comparison["datatable.tabs"][4])
+        self.assertIsNone(comparison["datatable.regular"][2])
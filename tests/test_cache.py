@@ -0,0 +1,102 @@
+# encoding: utf-8
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from vantetider.cache import make_cache, canonical_payload, HttpCache,\
+    MemoryBackend
+
+URL = u"https://www.vantetider.se/Kontaktkort/Blekinges/Overbelaggning/"
+
+
+class TestCache(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_caches(self, **kwargs):
+        return [
+            make_cache("memory", **kwargs),
+            make_cache("sqlite", path=os.path.join(self.tmp_dir, "c.sqlite"),
+                       **kwargs),
+            make_cache("filesystem", path=os.path.join(self.tmp_dir, "c"),
+                       **kwargs),
+        ]
+
+    def test_canonical_payload(self):
+        self.assertEqual(canonical_payload({"b": 1, "a": "2"}),
+                         canonical_payload({"a": "2", "b": 1}))
+        self.assertEqual(canonical_payload(None), "")
+
+    def test_get_set(self):
+        for cache in self.get_caches():
+            payload = {"select_year": "2017", "select_period": "Mars"}
+            self.assertIsNone(cache.get("POST", URL, payload))
+            cache.set("POST", URL, payload, b"<html/>")
+            self.assertEqual(cache.get("POST", URL, payload), b"<html/>")
+            # Same payload in another order
+            self.assertEqual(cache.get("POST", URL, dict(reversed(list(payload.items())))),
+                             b"<html/>")
+            self.assertIsNone(cache.get("GET", URL))
+
+    def test_ttl(self):
+        for cache in self.get_caches(ttl=[(r"^GET ", -1), (r"^POST ", None)]):
+            cache.set("GET", URL, None, b"landing page")
+            cache.set("POST", URL, {"select_year": "2017"}, b"result page")
+            self.assertIsNone(cache.get("GET", URL))
+            self.assertEqual(cache.get("POST", URL, {"select_year": "2017"}),
+                             b"result page")
+
+    def test_eviction(self):
+        for cache in self.get_caches(max_size=25):
+            for i in range(5):
+                cache.set("POST", URL, {"i": i}, b"0123456789")
+                time.sleep(0.01)
+            self.assertLessEqual(cache.backend.size, 25)
+            self.assertIsNone(cache.get("POST", URL, {"i": 0}))
+            self.assertIsNotNone(cache.get("POST", URL, {"i": 4}))
+
+    def test_lru(self):
+        cache = HttpCache(MemoryBackend(), max_size=20)
+        cache.set("POST", URL, {"i": 0}, b"0123456789")
+        cache.set("POST", URL, {"i": 1}, b"0123456789")
+        cache.get("POST", URL, {"i": 0})
+        cache.set("POST", URL, {"i": 2}, b"0123456789")
+        self.assertIsNotNone(cache.get("POST", URL, {"i": 0}))
+        self.assertIsNone(cache.get("POST", URL, {"i": 1}))
+
+    def test_purge(self):
+        for cache in self.get_caches():
+            cache.set("GET", URL, None, b"a")
+            cache.set("POST", URL, {"select_year": "2017"}, b"b")
+            cache.set("POST", URL, {"select_year": "2018"}, b"c")
+            other_url = URL.replace("Overbelaggning", "PrimarvardTelefon")
+            cache.set("POST", other_url, {"select_year": "2017"}, b"d")
+
+            self.assertEqual(cache.purge(dataset="Overbelaggning", year="2017"), 1)
+            self.assertIsNone(cache.get("POST", URL, {"select_year": "2017"}))
+            self.assertEqual(cache.purge(dataset="Overbelaggning"), 2)
+            self.assertEqual(len(cache), 1)
+
+    def test_page_cache(self):
+        for cache in self.get_caches():
+            payload = {"select_year": "2017", "select_region": "27"}
+            self.assertIsNone(cache.get_page("Overbelaggning", "Blekinges", payload))
+            cache.set_page("Overbelaggning", "Blekinges", URL, payload, b"page")
+            self.assertEqual(cache.get_page("Overbelaggning", "Blekinges",
+                                            dict(payload)), b"page")
+            self.assertIsNone(cache.get_page("PrimarvardTelefon", "Blekinges",
+                                             payload))
+            self.assertEqual(cache.page_stats.hits, 1)
+            self.assertEqual(cache.page_stats.misses, 2)
+            # Result pages can be purged by year too
+            self.assertEqual(cache.purge(year="2017"), 1)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            make_cache("redis")
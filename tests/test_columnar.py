@@ -0,0 +1,58 @@
+# encoding: utf-8
+from unittest import TestCase
+
+from statscraper import Result
+
+from vantetider.columnar import ColumnarResult
+
+ROWS = [
+    {"region": u"Blekinge", "year": u"2017", "value": 12.0},
+    {"region": u"Skåne", "year": u"2017", "value": u"-"},
+    {"region": u"Blekinge", "year": u"2018", "value": 3.5, "unit": u"Karlshamn"},
+    {"region": u"Skåne", "year": u"2018", "value": None},
+]
+
+
+class TestColumnarResult(TestCase):
+
+    def setUp(self):
+        self.res = ColumnarResult.from_rows(ROWS)
+
+    def test_len_and_dimensions(self):
+        self.assertEqual(len(self.res), 4)
+        self.assertEqual(self.res.dimensions, ["region", "year", "unit"])
+
+    def test_list_of_dicts_round_trip(self):
+        self.assertEqual(self.res.list_of_dicts[0], ROWS[0])
+        self.assertEqual(self.res.list_of_dicts[1], ROWS[1])
+        self.assertEqual(self.res.list_of_dicts[2], ROWS[2])
+        self.assertEqual(self.res.list_of_dicts[3], ROWS[3])
+
+    def test_labels_are_stored_once(self):
+        self.assertEqual(self.res._categories["region"], [u"Blekinge", u"Skåne"])
+        self.assertEqual(list(self.res._codes["region"]), [0, 1, 0, 1])
+
+    def test_pandas(self):
+        df = self.res.pandas
+        self.assertEqual(str(df["value"].dtype), "float64")
+        self.assertEqual(str(df["region"].dtype), "category")
+        self.assertEqual(df["value"].sum(), 15.5)
+        self.assertEqual(df["missing"].tolist()[1], u"-")
+        self.assertTrue(df["unit"].isnull()[0])
+        self.assertEqual(df["unit"][2], u"Karlshamn")
+
+    def test_append_after_read(self):
+        values, column, df = self.res.values, self.res.column("region"), \
+            self.res.pandas
+        self.res.append(1.0, {"region": u"Kalmar"})
+        self.assertEqual(len(self.res.values), 5)
+        self.assertEqual(len(values), 4)
+
+    def test_from_results(self):
+        res = ColumnarResult.from_rows([Result(1.0, {"region": u"Kalmar"})])
+        self.assertEqual(res.list_of_dicts, [{"region": u"Kalmar", "value": 1.0}])
+
+    def test_empty(self):
+        res = ColumnarResult()
+        self.assertEqual(len(res.pandas), 0)
+        self.assertEqual(res.list_of_dicts, [])
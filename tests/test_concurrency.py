@@ -0,0 +1,162 @@
+# encoding: utf-8
+import threading
+import time
+from unittest import TestCase
+
+from vantetider.concurrency import RateLimiter, ProcessRateLimiter,\
+    AdaptiveRateLimiter, SingleFlight, imap_bounded, parse_retry_after
+
+
+class TestConcurrency(TestCase):
+
+    def test_imap_bounded_ordered(self):
+        def slow_square(x):
+            time.sleep(0.01 * (5 - x))
+            return x * x
+
+        res = list(imap_bounded(slow_square, range(5), workers=3))
+        self.assertEqual(res, [0, 1, 4, 9, 16])
+
+    def test_imap_bounded_unordered(self):
+        res = list(imap_bounded(lambda x: x * x, range(20), workers=4,
+                                ordered=False))
+        self.assertEqual(sorted(res), [x * x for x in range(20)])
+
+    def test_imap_bounded_raises(self):
+        def fail(x):
+            if x == 3:
+                raise ValueError("boom")
+            return x
+
+        with self.assertRaises(ValueError):
+            list(imap_bounded(fail, range(10), workers=2))
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rate=50)
+        start = time.time()
+        for i in range(6):
+            limiter.wait("https://www.vantetider.se/Kontaktkort/Sveriges")
+        # First request is immediate, the other five wait 1/50 s each
+        self.assertGreaterEqual(time.time() - start, 0.09)
+
+    def test_no_rate_limit(self):
+        limiter = RateLimiter()
+        start = time.time()
+        for i in range(100):
+            limiter.wait("https://www.vantetider.se/")
+        self.assertLess(time.time() - start, 0.05)
+
+    def test_rate_limiter_reserve(self):
+        limiter = RateLimiter(rate=10)
+        delays = [limiter.reserve("https://www.vantetider.se/")
+                  for i in range(3)]
+        self.assertAlmostEqual(delays[0], 0.0, places=2)
+        self.assertAlmostEqual(delays[2], 0.2, places=2)
+        # Other hosts have slots of their own
+        self.assertAlmostEqual(limiter.reserve("http://127.0.0.1/"), 0.0,
+                               places=2)
+        self.assertEqual(RateLimiter().reserve("https://www.vantetider.se/"),
+                         0.0)
+
+    def test_adaptive_rate_limiter(self):
+        limiter = AdaptiveRateLimiter(rate=10, concurrency=4, window=5,
+                                      max_concurrency=5)
+        for i in range(5):
+            limiter.record(200, 0.1)
+        # Additive increase
+        self.assertEqual(limiter.rate, 11)
+        self.assertEqual(limiter.concurrency, 5)
+        for i in range(5):
+            limiter.record(200, 0.1)
+        self.assertEqual(limiter.concurrency, 5)
+
+        # Multiplicative decrease, once for a burst of errors
+        limiter.record(503, 0.1)
+        self.assertEqual(limiter.rate, 6)
+        self.assertEqual(limiter.concurrency, 2)
+        limiter.record(503, 0.1)
+        self.assertEqual(limiter.rate, 6)
+        limiter.record(503, 0.1)
+        self.assertEqual(limiter.rate, 3)
+        self.assertEqual(limiter.decreases, 2)
+
+        # Slow responses
+        limiter = AdaptiveRateLimiter(rate=10, target_latency=1.0)
+        limiter.record(200, 5.0)
+        self.assertEqual(limiter.rate, 5)
+
+        # A single HTTP 500 is not a sign of overload
+        limiter = AdaptiveRateLimiter(rate=10)
+        limiter.record(500, 0.1)
+        self.assertEqual(limiter.rate, 10)
+
+    def test_retry_after(self):
+        limiter = AdaptiveRateLimiter(rate=100)
+        limiter.record(429, 0.1, retry_after="2")
+        self.assertGreater(limiter.reserve(), 1.9)
+        self.assertEqual(parse_retry_after("120"), 120)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+        self.assertIsNone(parse_retry_after("soon"))
+
+    def test_adaptive_concurrency(self):
+        limiter = AdaptiveRateLimiter(rate=1000, concurrency=2)
+        in_flight = []
+
+        def request(i):
+            with limiter.slot():
+                in_flight.append(limiter.in_flight)
+                time.sleep(0.01)
+
+        list(imap_bounded(request, range(8), workers=4))
+        self.assertEqual(max(in_flight), 2)
+
+    def test_process_rate_limiter(self):
+        limiter = ProcessRateLimiter(rate=50)
+        start = time.time()
+        for i in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(time.time() - start, 0.09)
+
+    def test_single_flight(self):
+        flights = SingleFlight()
+        calls = []
+
+        def slow(x):
+            calls.append(x)
+            time.sleep(0.05)
+            return x * 2
+
+        res = []
+        threads = [threading.Thread(target=lambda: res.append(flights.do("a", slow, 1)))
+                   for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(sorted(res), [(2, False)] + [(2, True)] * 4)
+        self.assertEqual(flights.shared, 4)
+        # The next call is made anew
+        self.assertEqual(flights.do("a", slow, 2), (4, False))
+
+    def test_single_flight_raises(self):
+        flights = SingleFlight()
+        errors = []
+
+        def fail():
+            time.sleep(0.05)
+            raise ValueError("boom")
+
+        def run():
+            try:
+                flights.do("a", fail)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(errors), 3)
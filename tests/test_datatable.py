@@ -0,0 +1,94 @@
+# encoding: utf-8
+from unittest import TestCase
+
+import numpy as np
+
+from vantetider.parsing import Sheet, parse_values
+from vantetider.scraper import Datatable, ResultPage
+
+from tests.fixtures import (REGULAR_TABLE, VERTICAL_SCROLL_TABLE, TABBED_TABLE,
+                            SUB_TABLE, LABEL)
+
+
+class TestDatatable(TestCase):
+
+    def test_regular_table(self):
+        page = ResultPage(REGULAR_TABLE)
+        self.assertEqual(page.layout, "regular")
+
+        table = Datatable(page)
+        self.assertEqual(len(table.data), 4)
+        self.assertEqual(table.data[0], {
+            "region_or_unit": ("27", u"Blekinge"),
+            "measure": u"Antal",
+            "value": 1234.0,
+        })
+        self.assertEqual(table.data[1]["value"], 12.5)
+        self.assertEqual(table.data[2]["value"], "-")
+        self.assertEqual(sorted(table.measures), [u"Andel", u"Antal"])
+
+    def test_iterate_rows(self):
+        rows = list(Datatable(REGULAR_TABLE))
+        self.assertEqual(rows, Datatable(REGULAR_TABLE).data)
+
+    def test_vertical_scroll_table(self):
+        table = Datatable(VERTICAL_SCROLL_TABLE)
+        self.assertEqual(table.page.layout, "vertical_scroll")
+        self.assertEqual(table.data, [{
+            "region_or_unit": ("9", u"Gotland"),
+            "measure": u"Antal",
+            "value": 3.0,
+        }])
+
+    def test_tabbed_table(self):
+        html = TABBED_TABLE.format(tables=SUB_TABLE.format(
+            LABEL.format(27, u"Blekinge"), "1", "2") + SUB_TABLE.format(
+            LABEL.format(27, u"Blekinge"), "50 %", "N/A"))
+        table = Datatable(html)
+        self.assertEqual(table.page.layout, "tabs")
+        self.assertTrue(table.has_horizontal_scroll)
+        self.assertEqual(len(table.data), 4)
+        self.assertEqual(table.data[0]["measure"], u"Antal")
+        self.assertEqual(table.data[0]["region_or_unit"], ("27", u"Blekinge"))
+        self.assertEqual(table.data[3]["measure"], u"Andel")
+        self.assertEqual([x["value"] for x in table.data], [1.0, 2.0, 50.0, "N/A"])
+
+
+class TestSheet(TestCase):
+
+    def setUp(self):
+        values, missing = parse_values([u"1", u"2", u"-", u"4"])
+        self.sheet = Sheet([u"a", u"b"], [u"x", u"y"],
+                           values.reshape(2, 2), missing.reshape(2, 2))
+
+    def test_long_format(self):
+        self.assertEqual(list(self.sheet.long_format), [
+            (u"a", u"x", 1.0),
+            (u"a", u"y", 2.0),
+            (u"b", u"x", u"-"),
+            (u"b", u"y", 4.0),
+        ])
+
+    def test_list_of_lists(self):
+        sheet = Sheet([u"a"], [u"x", u"y"], [[1.0, None]])
+        self.assertEqual(sheet.as_dictlist, [
+            {"row": u"a", "col": u"x", "value": 1.0},
+            {"row": u"a", "col": u"y", "value": None},
+        ])
+
+    def test_shape_mismatch(self):
+        with self.assertRaises(ValueError):
+            Sheet([u"a"], [u"x"], [[1.0, 2.0]])
+
+    def test_to_frame(self):
+        df = self.sheet.to_frame()
+        self.assertEqual(list(df.columns), ["row", "col", "value", "missing"])
+        self.assertEqual(df["row"].tolist(), [u"a", u"a", u"b", u"b"])
+        self.assertEqual(df["col"].tolist(), [u"x", u"y", u"x", u"y"])
+        self.assertTrue(np.isnan(df["value"][2]))
+        self.assertEqual(df["missing"][2], u"-")
+        self.assertTrue(df["missing"].isnull()[0])
+
+    def test_to_frame_tuple_rows(self):
+        sheet = Sheet([("27", u"Blekinge")], [u"x"], [[1.0]])
+        self.assertEqual(sheet.to_frame()["row"][0], ("27", u"Blekinge"))
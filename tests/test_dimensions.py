@@ -0,0 +1,52 @@
+# encoding: utf-8
+from unittest import TestCase
+
+from tests.fixtures import make_dataset
+
+
+class TestDimensions(TestCase):
+
+    def setUp(self):
+        self.dataset = make_dataset()
+        self.scraper = self.dataset.scraper
+        self.dimensions = {x.id: x for x in
+                           self.scraper._fetch_dimensions(self.dataset)}
+
+    def test_dimensions(self):
+        self.assertEqual(sorted(self.dimensions.keys()),
+                         ["gender", "measure", "region", "type_of_overbelaggning",
+                          "unit_id", "year"])
+        self.assertEqual(self.dimensions["region"].elem_type, "select")
+        self.assertEqual(self.dimensions["gender"].elem_type, "checkbox")
+        self.assertEqual(self.dimensions["type_of_overbelaggning"].elem_type,
+                         "radio")
+
+    def test_default_values(self):
+        self.assertEqual(self.dimensions["region"].default_value, "10")
+        # First option if none is selected
+        self.assertEqual(self.dimensions["year"].default_value, "2019")
+        self.assertEqual(
+            self.dimensions["type_of_overbelaggning"].default_value, "1")
+        self.assertEqual(self.dimensions["gender"].default_value, "true")
+
+    def test_allowed_values(self):
+        regions = list(self.scraper._fetch_allowed_values(
+            self.dimensions["region"]))
+        self.assertEqual([(x.value, x.label) for x in regions],
+                         [("10", u"Riket"), ("27", u"Blekinge")])
+        years = list(self.scraper._fetch_allowed_values(
+            self.dimensions["year"]))
+        self.assertEqual([x.value for x in years], ["2019", "2018"])
+
+    def test_region_lookup(self):
+        self.assertEqual(self.dataset._get_region(u"Blekinge").value, "27")
+        self.assertEqual(self.dataset._get_region("27").label, u"Blekinge")
+        self.assertEqual(self.dataset._get_region_slug("27"), u"Blekinges")
+        self.assertEqual(self.dataset._get_region_slug(u"Riket"), u"Sveriges")
+        with self.assertRaises(KeyError):
+            self.dataset._get_region("foo")
+
+    def test_no_soup_kept(self):
+        # Dimensions hold plain data, not the parsed page
+        self.assertFalse(hasattr(self.dataset, "_soup"))
+        self.assertFalse(hasattr(self.dimensions["region"], "elem"))
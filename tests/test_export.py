@@ -0,0 +1,146 @@
+# encoding: utf-8
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+from vantetider import VantetiderScraper
+from vantetider.export import (ExportWriter, read_export, partition_dir,
+                               parse_partition_dir, pa)
+
+from tests.fixtures import FixtureServer
+
+ROWS = [
+    {"value": 1.0, "region": u"Blekinge", "year": u"2018", "period": u"Januari"},
+    {"value": u"-", "region": u"Kalmar", "year": u"2018", "period": u"Januari"},
+    {"value": 3.0, "region": u"Blekinge", "year": u"2018", "period": u"Februari"},
+    {"value": 4.0, "region": u"Blekinge", "year": u"2019", "period": u"Januari"},
+    {"value": 5.0, "region": u"Kalmar", "year": u"2019", "period": u"Januari"},
+]
+
+
+class TestExport(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _write(self, format, **kwargs):
+        with ExportWriter(self.path, format=format, **kwargs) as writer:
+            writer.write("Overbelaggning", ROWS)
+        return writer
+
+    def _check(self, df):
+        self.assertEqual(len(df), 5)
+        df = df.sort_values(["year", "period", "region"])
+        self.assertEqual(list(df["region"]), [u"Blekinge", u"Blekinge",
+                                              u"Kalmar", u"Blekinge",
+                                              u"Kalmar"])
+        self.assertEqual(str(df["region"].dtype), "category")
+        self.assertEqual(set(df["dataset"]), set([u"Overbelaggning"]))
+        kalmar = df[(df["region"] == u"Kalmar") & (df["year"] == u"2018")]
+        self.assertTrue(kalmar["value"].isnull().all())
+        self.assertEqual(list(kalmar["missing"]), [u"-"])
+
+    def test_csv(self):
+        writer = self._write("csv")
+        self.assertEqual(writer.rows, 5)
+        # One file per dataset, year and period
+        self.assertEqual(len(writer.files), 3)
+        self.assertIn(os.path.join(self.path, "dataset=Overbelaggning",
+                                   "year=2018", "period=Februari",
+                                   "part-00000.csv"), writer.files)
+        self._check(read_export(self.path))
+        self.assertEqual(len(read_export(self.path, dataset="Other")), 0)
+
+    def test_batches(self):
+        # Partitions are written as they fill up, or to keep at most
+        # max_rows rows in memory
+        writer = self._write("csv", batch_size=1)
+        self.assertEqual(len(writer.files), 5)
+        shutil.rmtree(self.path)
+        writer = self._write("csv", partition_by=[], max_rows=2)
+        self.assertEqual(len(writer.files), 2)
+        self._check(read_export(self.path))
+
+    def test_overwrite_partitions(self):
+        self._write("csv", batch_size=1)
+        self._write("csv")
+        self.assertEqual(len(read_export(self.path)), 5)
+
+    def test_overwrite_dataset(self):
+        # Files partitioned otherwise are replaced too, and other datasets
+        # are kept
+        with ExportWriter(self.path, format="csv") as writer:
+            writer.write("Other", ROWS[:1])
+        self._write("csv", partition_by=["year"])
+        writer = self._write("csv")
+        self.assertEqual(len(read_export(self.path,
+                                         dataset="Overbelaggning")), 5)
+        self.assertEqual(len(read_export(self.path, dataset="Other")), 1)
+        self.assertFalse(os.path.exists(os.path.join(
+            self.path, "dataset=Overbelaggning", "year=2018", "part-00000.csv")))
+
+    def test_keep_other_partitions(self):
+        for year in [u"2019", u"2018"]:
+            with ExportWriter(self.path, format="csv") as writer:
+                writer.write("Overbelaggning",
+                             [x for x in ROWS if x["year"] == year])
+        self._check(read_export(self.path))
+
+    def test_empty_export(self):
+        self._write("csv")
+        with ExportWriter(self.path, format="csv") as writer:
+            writer.write("Overbelaggning", [])
+        self.assertEqual(writer.files, [])
+        self._check(read_export(self.path))
+        self.assertEqual(os.listdir(self.path), ["dataset=Overbelaggning"])
+
+    def test_failed_export(self):
+        # Nothing is replaced until the writer is closed
+        self._write("csv")
+        with self.assertRaises(ZeroDivisionError):
+            with ExportWriter(self.path, format="csv", batch_size=1) \
+                    as writer:
+                writer.write("Overbelaggning", ROWS[:2])
+                self.assertEqual(len(read_export(self.path)), 5)
+                1 / 0
+        self._check(read_export(self.path))
+        self.assertEqual(os.listdir(self.path), ["dataset=Overbelaggning"])
+
+    def test_partition_dir(self):
+        self.assertEqual(partition_dir("region", u"Västra Götaland"),
+                         u"region=V%C3%A4stra%20G%C3%B6taland")
+        self.assertEqual(parse_partition_dir(partition_dir("region", u"A/B")),
+                         ("region", u"A/B"))
+        self.assertEqual(parse_partition_dir(partition_dir("period", None)),
+                         ("period", None))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            ExportWriter(self.path, format="xlsx")
+
+    @skipIf(pa is None, "pyarrow is not installed")
+    def test_arrow_formats(self):
+        for format in ["parquet", "arrow"]:
+            shutil.rmtree(self.path)
+            writer = self._write(format)
+            self.assertEqual(len(writer.files), 3)
+            df = read_export(self.path)
+            self._check(df)
+
+    def test_dataset_export(self):
+        query = {"region": "Blekinge", "year": ["2017", "2018"]}
+        with FixtureServer(n_units=1):
+            dataset = VantetiderScraper(cache=None).get("Overbelaggning")
+            writer = dataset.export(self.path, query, format="csv")
+            expected = dataset.fetch(query)
+        self.assertEqual(writer.rows, len(expected))
+        df = read_export(self.path, dataset="Overbelaggning")
+        self.assertEqual(len(df), len(expected))
+        self.assertEqual(sorted(df["year"].unique()), [u"2017", u"2018"])
+        self.assertEqual(sorted(df["value"].dropna()),
+                         sorted(x.value for x in expected
+                                if isinstance(x.value, float)))
@@ -0,0 +1,80 @@
+# encoding: utf-8
+from unittest import TestCase
+
+from vantetider import VantetiderScraper
+from vantetider.extract import ExtractedPage, ExtractError, extract_page
+from vantetider.scraper import Datatable, ResultPage
+
+from tests.fixtures import (REGULAR_TABLE, VERTICAL_SCROLL_TABLE, TABBED_TABLE,
+                            SUB_TABLE, LABEL, LANDING_PAGE, make_dataset)
+
+TABS = TABBED_TABLE.format(tables=SUB_TABLE.format(
+    LABEL.format(27, u"Blekinge"), "1", "2") + SUB_TABLE.format(
+    LABEL.format(27, u"Blekinge"), "50 %", "N/A"))
+
+
+class TestExtract(TestCase):
+
+    def test_same_rows_as_datatable(self):
+        for html, layout in [(REGULAR_TABLE, "regular"),
+                             (VERTICAL_SCROLL_TABLE, "vertical_scroll"),
+                             (TABS, "tabs")]:
+            page = ExtractedPage(html)
+            self.assertEqual(page.layout, layout)
+            self.assertEqual(page.data, Datatable(html).data)
+            self.assertEqual(list(page), page.data)
+
+    def test_stray_end_tags(self):
+        # End tags of elements that are not open are ignored, like
+        # BeautifulSoup does
+        html = REGULAR_TABLE.replace(u"<tbody>", u"</span></p><tbody>")
+        self.assertEqual(len(ExtractedPage(html).data), 4)
+        self.assertEqual(ExtractedPage(html).data, Datatable(html).data)
+
+    def test_unknown_layout(self):
+        with self.assertRaises(ExtractError):
+            extract_page(u"<html><body><p>Inga data</p></body></html>")
+        # Horizontal scroll without tabs is not implemented
+        with self.assertRaises(ExtractError):
+            extract_page(SUB_TABLE.format(LABEL.format(27, u"Blekinge"),
+                                          "1", "2"))
+
+    def test_undecodable_page(self):
+        # Pages that the stream extractor can not decode are read with
+        # BeautifulSoup
+        html = LANDING_PAGE.encode("latin-1")
+        with self.assertRaises(ExtractError):
+            extract_page(html)
+
+        dataset = make_dataset()
+        page, selection, table = dataset._read_result_page(html)
+        self.assertIsInstance(page, ResultPage)
+        self.assertEqual(selection["region"], ("10", u"Riket"))
+        self.assertEqual(
+            dataset.scraper.stats.get("extract_fallbacks_total"), 1)
+
+    def test_current_selection(self):
+        dataset = make_dataset()
+
+        page = ExtractedPage(LANDING_PAGE)
+        selection = dataset._get_current_selection(page)
+        self.assertEqual(selection,
+                         dataset._get_current_selection(ResultPage(LANDING_PAGE)))
+        self.assertEqual(selection["region"], ("10", u"Riket"))
+        self.assertEqual(selection["year"], ("2019", "2019"))
+        self.assertEqual(selection["type_of_overbelaggning"],
+                         ("1", "Psykiatri"))
+        self.assertEqual(selection["gender"], (False, False))
+
+    def test_get_options(self):
+        page = ExtractedPage(LANDING_PAGE)
+        soup_page = ResultPage(LANDING_PAGE)
+        for elem_id, elem_type in [("select_region", "select"),
+                                   ("type_of_overbelaggning", "radio")]:
+            self.assertEqual(page.get_options(elem_id, elem_type),
+                             soup_page.get_options(elem_id, elem_type))
+
+    def test_extractor_option(self):
+        self.assertEqual(VantetiderScraper().extractor, "stream")
+        with self.assertRaises(ValueError):
+            VantetiderScraper(extractor="lxml")
@@ -0,0 +1,159 @@
+# encoding: utf-8
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from vantetider import VantetiderScraper
+from vantetider.harvest import HarvestStore, get_row_key, parse_query_args,\
+    get_timepoints, harvest, update, harvest_all
+from vantetider.stats import Stats
+
+from tests.fixtures import (FixtureServer, MONTHLY_LANDING_PAGE,
+                            YEARLY_LANDING_PAGE, make_dataset)
+
+class TestHarvest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = HarvestStore(os.path.join(self.tmp_dir, "h.db"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_row_key(self):
+        row = {"region": "Blekinge", "year": "2017", "measure": "Antal",
+               "unit": None, "unit_id": None, "value": 1.0}
+        # Value and unit label are not part of the key
+        self.assertEqual(get_row_key(row),
+                         get_row_key(dict(row, value=2.0, unit="x")))
+        self.assertNotEqual(get_row_key(row),
+                            get_row_key(dict(row, year="2018")))
+
+    def test_upsert_and_checkpoint(self):
+        rows = [
+            {"region": "Blekinge", "year": "2017", "value": 1.0},
+            {"region": "Gotland", "year": "2017", "value": "-"},
+        ]
+        self.store.save("Overbelaggning", "Sveriges q1", rows)
+        self.store.save("Overbelaggning", "Blekinges q2",
+                        [{"region": "Blekinge", "year": "2017", "value": 3.0,
+                          "gender": "true"}])
+        stored = sorted(self.store.rows("Overbelaggning"),
+                        key=lambda x: (x["region"], x["gender"] or ""))
+        self.assertEqual(len(stored), 3)
+        self.assertEqual([x["value"] for x in stored], [1.0, 3.0, "-"])
+        self.assertEqual(self.store.completed("Overbelaggning"),
+                         set(["Sveriges q1", "Blekinges q2"]))
+
+        self.store.save("Overbelaggning", "Sveriges q1", rows)
+        self.assertEqual(len(list(self.store.rows("Overbelaggning"))), 3)
+
+        self.store.reset("Overbelaggning")
+        self.assertEqual(self.store.completed("Overbelaggning"), set())
+
+    def test_get_timepoints(self):
+        dataset = make_dataset(MONTHLY_LANDING_PAGE)
+        timepoints = get_timepoints(dataset)
+        self.assertEqual(len(timepoints), 5)
+        self.assertEqual(timepoints[0], {"year": "2017", "period": "Januari"})
+        self.assertEqual(timepoints[-1], {"year": "2018", "period": "Februari"})
+
+    def test_no_period(self):
+        dataset = make_dataset(YEARLY_LANDING_PAGE)
+        self.assertEqual(dataset.latest_timepoint, {"year": "2018"})
+        self.assertEqual(get_timepoints(dataset),
+                         [{"year": "2017"}, {"year": "2018"}])
+
+        # No year up to the latest one
+        dataset.dimensions["year"]._default_value = "2016"
+        self.assertEqual(get_timepoints(dataset), [])
+        status = update(dataset, store=self.store)
+        self.assertEqual(status["pages"], 0)
+        self.assertEqual(status["rows"], 0)
+
+    def test_harvest_and_resume(self):
+        query = {"region": "Blekinge", "year": ["2017", "2018"],
+                 "period": ["Januari", "Februari"]}
+        # The first page fails, like an interrupted harvest
+        with FixtureServer(n_units=1, errors=1) as server:
+            dataset = VantetiderScraper(cache=None).get("Overbelaggning")
+            status = harvest(dataset, query, store=self.store)
+            self.assertEqual((status["fetched"], status["failed"]), (3, 1))
+
+            # Only the failed page is fetched again
+            n_requests = server.requests
+            status = harvest(dataset, query, store=self.store)
+            self.assertEqual(server.requests - n_requests, 1)
+            self.assertEqual((status["skipped"], status["fetched"]), (3, 1))
+
+            # Nothing is left to fetch
+            n_requests = server.requests
+            status = harvest(dataset, query, store=self.store)
+            self.assertEqual(server.requests, n_requests)
+            self.assertEqual(status["skipped"], 4)
+
+            # Unless the checkpoints are ignored, and rows are upserted
+            status = harvest(dataset, query, store=self.store, resume=False)
+            self.assertEqual(status["fetched"], 4)
+        # A region and a unit, with three measures, on each page
+        self.assertEqual(len(list(self.store.rows("Overbelaggning"))),
+                         4 * 2 * 3)
+
+    def test_update_after_harvest(self):
+        dataset_id = "VantatKortareAn60Dagar"
+        with FixtureServer(n_units=1) as server:
+            dataset = VantetiderScraper(cache=None).get(dataset_id)
+            # Up to the latest period, January 2019: 4 years and a month,
+            # a region and a unit, three measures
+            status = update(dataset, {"region": "Blekinge"}, store=self.store)
+            self.assertEqual(status["rows"], (4 * 12 + 1) * 2 * 3)
+            rows = list(self.store.rows(dataset_id))
+            self.assertEqual(set(x["period"] for x in rows
+                                 if x["year"] == "2019"), set([u"Januari"]))
+
+            # Years that update() completed are skipped
+            status = harvest(dataset, {"region": "Blekinge", "year": "*",
+                                       "period": "*"}, store=self.store)
+            self.assertEqual(status["skipped"], 4)
+            self.assertEqual(status["rows"], 12 * 2 * 3)
+
+            # Only the two latest periods are fetched again
+            n_requests = server.requests
+            status = update(dataset, {"region": "Blekinge"}, store=self.store,
+                            lookback=2)
+            self.assertEqual(server.requests - n_requests, 2)
+        self.assertEqual(status["fetched"], 2)
+        self.assertEqual(status["rows"], 2 * 2 * 3)
+        self.assertEqual(len(list(self.store.rows(dataset_id))),
+                         5 * 12 * 2 * 3)
+
+    def test_harvest_all(self):
+        datasets = ["Overbelaggning", "VantatKortareAn60Dagar"]
+        query = {"region": "Blekinge", "year": ["2017", "2018"]}
+        with FixtureServer(n_units=1):
+            statuses = harvest_all(datasets, query, store=self.store.path,
+                                   processes=2, cache=None)
+            self.assertEqual(sorted(statuses), datasets)
+            for dataset_id in datasets:
+                self.assertEqual(statuses[dataset_id]["fetched"], 2)
+                self.assertEqual(len(list(self.store.rows(dataset_id))),
+                                 2 * 2 * 3)
+
+            # A second run requests no result pages. The snapshot is checked
+            # against the site once, not again by the workers.
+            path = os.path.join(self.tmp_dir, u"metadata.json")
+            VantetiderScraper(cache=None).export_metadata(path, datasets)
+            stats = Stats()
+            statuses = harvest_all(datasets, query, store=self.store.path,
+                                   processes=2, cache=None, stats=stats,
+                                   metadata=path)
+        self.assertEqual([x["skipped"] for x in statuses.values()], [2, 2])
+        self.assertEqual(stats.get("requests_total", method="POST"), 0)
+        self.assertEqual(stats.get("requests_total", method="GET"), 0)
+
+    def test_parse_query_args(self):
+        self.assertEqual(parse_query_args(["year=2018,2019", "region=*"]),
+                         {"year": ["2018", "2019"], "region": "*"})
+        with self.assertRaises(ValueError):
+            parse_query_args(["year"])
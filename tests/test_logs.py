@@ -0,0 +1,41 @@
+# encoding: utf-8
+import logging
+from unittest import TestCase
+
+from vantetider import VantetiderScraper
+from vantetider.logs import ProgressLog, new_timing, log_timing, logger
+from vantetider.scraper import PrintLogger
+
+
+class TestLogs(TestCase):
+
+    def test_log_timing(self):
+        timing = new_timing("GET", "https://www.vantetider.se/")
+        timing.update(status=200, bytes=1024, connect=0.05, total=0.2)
+        with self.assertLogs("vantetider.requests", level="DEBUG") as cm:
+            log_timing(timing)
+        record = cm.records[0]
+        self.assertEqual(record.timing["status"], 200)
+        self.assertIn("status=200 bytes=1024", record.getMessage())
+        self.assertIn("connect=0.050", record.getMessage())
+
+    def test_progress_log(self):
+        log = logging.getLogger("vantetider.test")
+        progress = ProgressLog(log, interval=3600)
+        with self.assertLogs("vantetider.test", level="INFO") as cm:
+            progress.update(u"Query %s/%s", 1, 3)
+            progress.update(u"Query %s/%s", 2, 3)
+            progress.update(u"Done with %s queries", 3, force=True)
+        self.assertEqual([x.getMessage() for x in cm.records],
+                         [u"Done with 3 queries"])
+
+        progress = ProgressLog(log, interval=0)
+        with self.assertLogs("vantetider.test", level="INFO") as cm:
+            progress.update(u"Query %s/%s", 1, 3)
+            progress.update(u"Query %s/%s", 2, 3)
+        self.assertEqual(len(cm.records), 2)
+
+    def test_scraper_logger(self):
+        self.assertIs(VantetiderScraper().log, logger)
+        print_logger = PrintLogger()
+        self.assertIs(VantetiderScraper(logger=print_logger).log, print_logger)
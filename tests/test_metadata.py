@@ -0,0 +1,104 @@
+# encoding: utf-8
+import json
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from vantetider import VantetiderScraper
+from vantetider.metadata import load_metadata, VERSION
+from vantetider.scraper import VantetiderDimension
+
+from tests.fixtures import FixtureServer, make_dataset
+
+
+def make_snapshot(scraper, created=None):
+    dataset = make_dataset(scraper=scraper, label=u"Överbeläggningar")
+    return {
+        "version": VERSION,
+        "created": time.time() if created is None else created,
+        "datasets": [{
+            "id": dataset.id,
+            "label": dataset.label,
+            "dimensions": [x.to_dict() for x in dataset.dimensions],
+            "region_slugs": dataset._get_region_index()[2],
+        }],
+    }
+
+
+class TestMetadata(TestCase):
+
+    def setUp(self):
+        self.snapshot = make_snapshot(VantetiderScraper(cache=None))
+
+    def test_dimension_round_trip(self):
+        data = self.snapshot["datasets"][0]["dimensions"]
+        dims = dict((x["id"], VantetiderDimension.from_dict(x)) for x in data)
+        self.assertEqual(dims["region"].elem_type, "select")
+        self.assertEqual(dims["region"].default_value, "10")
+        self.assertEqual(dims["type_of_overbelaggning"].default_value, "1")
+        self.assertEqual([(x.value, x.label) for x in dims["region"].allowed_values],
+                         [("10", u"Riket"), ("27", u"Blekinge")])
+        self.assertEqual([x.to_dict() for x in dims.values()], data)
+        self.assertFalse(hasattr(dims["measure"], "elem_id"))
+
+    def test_start_from_snapshot(self):
+        # No requests are made: the scraper has no site to talk to
+        scraper = VantetiderScraper(cache=None, metadata=self.snapshot)
+        dataset = scraper.get("Overbelaggning")
+        self.assertEqual(dataset.label, u"Överbeläggningar")
+        self.assertEqual(dataset.dimensions["year"].default_value, "2019")
+        self.assertTrue(dataset.get_url("27").endswith("/Blekinges/Overbelaggning/"))
+
+    def test_load_file(self):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            # Snapshots are utf-8, whatever the locale
+            with open(path, "wb") as f:
+                f.write(json.dumps(self.snapshot, ensure_ascii=False)
+                        .encode("utf-8"))
+            dataset = load_metadata(path)["datasets"][0]
+            self.assertEqual(dataset["id"], "Overbelaggning")
+            self.assertEqual(dataset["label"], u"Överbeläggningar")
+        finally:
+            os.remove(path)
+
+    def test_expired(self):
+        self.snapshot["created"] = time.time() - 100
+        self.assertIsNone(load_metadata(self.snapshot, ttl=10))
+        self.assertIsNotNone(load_metadata(self.snapshot, ttl=None))
+        scraper = VantetiderScraper(cache=None, metadata=self.snapshot,
+                                    metadata_ttl=10)
+        self.assertIsNone(scraper.metadata)
+
+    def test_version(self):
+        self.snapshot["version"] = VERSION + 1
+        with self.assertRaises(ValueError):
+            load_metadata(self.snapshot)
+
+    def test_outdated_snapshot(self):
+        with FixtureServer(n_units=1):
+            snapshot = VantetiderScraper(cache=None).export_metadata(
+                datasets=["Overbelaggning"])
+            dims = dict((x["id"], x) for x in
+                        snapshot["datasets"][0]["dimensions"])
+            self.assertEqual(dims["period"]["default_value"], u"Januari")
+            # A snapshot made before 2019 was published
+            dims["period"]["default_value"] = u"December"
+            dims["year"]["options"] = [x for x in dims["year"]["options"]
+                                       if x[0] != "2019"]
+            dims["year"]["default_value"] = u"2018"
+
+            scraper = VantetiderScraper(cache=None, metadata=snapshot)
+            dataset = scraper.get("Overbelaggning")
+            self.assertEqual(dataset.dimensions["year"].default_value, "2018")
+            self.assertEqual(dataset.latest_timepoint,
+                             {"year": "2019", "period": u"Januari"})
+
+            # A fetch plans its query from the page, too
+            scraper = VantetiderScraper(cache=None, metadata=snapshot)
+            dataset = scraper.get("Overbelaggning")
+            res = dataset.fetch({"region": "Blekinge"})
+        self.assertEqual(set(x["year"] for x in res.list_of_dicts),
+                         set(["2019"]))
@@ -0,0 +1,160 @@
+# encoding: utf-8
+from unittest import TestCase
+
+import requests
+from requests.exceptions import HTTPError
+from statscraper import Result
+
+from vantetider import VantetiderScraper
+from vantetider.scraper import Unit
+from vantetider.planner import QueryPlan
+
+from tests.fixtures import FixtureServer, MONTHLY_LANDING_PAGE, make_dataset
+
+PERIODS = [u"Januari", u"Februari", u"Mars"]
+
+
+class TestPlanner(TestCase):
+
+    def setUp(self):
+        self.dataset = make_dataset(MONTHLY_LANDING_PAGE)
+        self.requests = []
+
+    def get_tab_page(self, url, payload):
+        """ A tabbed page, with columns for January and February only
+        """
+        self.requests.append(payload)
+        for period in PERIODS[:2]:
+            yield Result(1.0, {"region": u"Blekinge", "unit": None,
+                               "period": period})
+
+    def test_regular_layout(self):
+        self.dataset._layout = "regular"
+        report = self.dataset.plan({"period": PERIODS}).report()
+        self.assertEqual(report["collapsed"], [])
+        self.assertEqual(report["planned_requests"], 3)
+        self.assertEqual(report["naive_requests"], 3)
+
+    def test_tabs_layout(self):
+        self.dataset._layout = "tabs"
+        plan = self.dataset.plan({"period": PERIODS})
+        self.assertEqual(plan.report()["collapsed"], ["period"])
+        self.assertEqual(len(plan), 1)
+
+        rows = list(plan.iter_results(plan.requests[0], self.get_tab_page))
+        # Mars is not on the page, and is requested on its own
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.requests[1]["select_period"], u"Mars")
+        self.assertEqual([x.raw_dimensions["period"] for x in rows],
+                         [u"Januari", u"Februari"])
+
+    def test_filter_rows(self):
+        self.dataset._layout = "tabs"
+        plan = self.dataset.plan({"period": PERIODS[1:]})
+        rows = list(plan.iter_results(plan.requests[0], self.get_tab_page))
+        self.assertEqual([x.raw_dimensions["period"] for x in rows],
+                         [u"Februari"])
+
+    def test_filter_single_period(self):
+        self.dataset._layout = "tabs"
+        plan = self.dataset.plan({"period": u"Februari"})
+        self.assertEqual(plan.report()["collapsed"], [])
+        rows = list(plan.iter_results(plan.requests[0], self.get_tab_page))
+        self.assertEqual([x.raw_dimensions["period"] for x in rows],
+                         [u"Februari"])
+        # Without a period, the selected one is kept
+        plan = self.dataset.plan({})
+        rows = list(plan.iter_results(plan.requests[0], self.get_tab_page))
+        self.assertEqual([x.raw_dimensions["period"] for x in rows],
+                         [u"Februari"])
+        self.assertEqual(len(self.requests), 2)
+
+    def test_filter_without_plan(self):
+        self.dataset._layout = "tabs"
+        plan = QueryPlan(self.dataset, {"period": PERIODS[:2]},
+                         collapse=False)
+        self.assertEqual(len(plan), 2)
+        rows = [x.raw_dimensions["period"] for request in plan.requests
+                for x in plan.iter_results(request, self.get_tab_page)]
+        self.assertEqual(rows, [u"Januari", u"Februari"])
+
+    def test_tabbed_pages(self):
+        query = {"region": "Blekinge", "year": "2018"}
+        with FixtureServer(n_units=1):
+            dataset = VantetiderScraper(cache=None)\
+                .get("VantatKortareAn60Dagar")
+            single = dataset.fetch(dict(query, period=u"Mars"))
+            naive = dataset.fetch(dict(query, period=[u"Mars", u"April"]),
+                                  plan=False)
+        # A region and a unit, with three measures
+        self.assertEqual(len(single), 2 * 3)
+        self.assertEqual(set(x["period"] for x in single.list_of_dicts),
+                         set([u"Mars"]))
+        self.assertEqual(len(naive), 2 * 2 * 3)
+        self.assertEqual(sorted(set(x["period"] for x in naive.list_of_dicts)),
+                         [u"April", u"Mars"])
+
+    def test_regions_from_national_page(self):
+        self.dataset._layout = "regular"
+        query = {"region": [u"Riket", u"Blekinge"]}
+        self.assertEqual(len(self.dataset.plan(query)), 2)
+        plan = self.dataset.plan(query, include_units=False)
+        self.assertEqual(len(plan), 1)
+        self.assertEqual(plan.requests[0].payload["select_region"], "10")
+        self.assertEqual(plan.requests[0].keep["region"],
+                         [u"Riket", u"Blekinge"])
+
+    def test_retry_failed_pages(self):
+        def get_failing_page(url, payload):
+            self.requests.append(payload)
+            response = requests.Response()
+            response.status_code = 500
+            raise HTTPError(response=response)
+
+        self.dataset._layout = "tabs"
+        plan = self.dataset.plan({"period": PERIODS})
+        retry = []
+        rows = list(plan.iter_results(plan.requests[0], get_failing_page,
+                                      retry=retry))
+        self.assertEqual(rows, [])
+        # The periods of the failed tabbed page are requested one by one,
+        # and queued for a retry
+        self.assertEqual(len(self.requests), 4)
+        self.assertEqual([x.payload["select_period"] for x in retry], PERIODS)
+        self.assertEqual(retry[0].keep, {"period": [u"Januari"]})
+
+        with self.assertRaises(HTTPError):
+            list(plan.iter_results(plan.requests[0], get_failing_page))
+
+    def test_retry_pass(self):
+        with FixtureServer(n_units=1, errors=1) as server:
+            scraper = VantetiderScraper(cache=None, retry_passes=1,
+                                        retry_delay=0)
+            dataset = scraper.get("Overbelaggning")
+            query = {"region": "Blekinge", "year": ["2017", "2018"]}
+            res = dataset.fetch(query)
+            expected = VantetiderScraper(cache=None).get("Overbelaggning")\
+                .fetch(query)
+        self.assertEqual(len(res), len(expected))
+        # Rows of the retried page come last
+        self.assertEqual(res[0].raw_dimensions["year"], u"2018")
+        self.assertEqual(scraper.stats.get("retried_pages_total"), 1)
+        self.assertEqual(scraper.stats.get("skipped_pages_total"), 0)
+
+    def test_units(self):
+        with FixtureServer(n_units=2):
+            dataset = VantetiderScraper(cache=None).get("Overbelaggning")
+            self.assertEqual(dataset.get_units("Blekinge"),
+                             [Unit("27001", u"Vårdcentral 27 1", u"Blekinge"),
+                              Unit("27002", u"Vårdcentral 27 2", u"Blekinge")])
+            res = dataset.fetch({"region": ["Blekinge", "Kalmar"],
+                                 "unit": ["27001", u"Vårdcentral 8 2"],
+                                 "year": "2018"})
+            # Without a region, the pages of all regions are read
+            res_all = dataset.fetch({"unit": ["27001", u"Vårdcentral 8 2"],
+                                     "year": "2018"})
+        expected = [(u"Blekinge", "27001"), (u"Kalmar", "8002")]
+        for res in [res, res_all]:
+            self.assertEqual(sorted(set((x["region"], x["unit_id"])
+                                        for x in res.list_of_dicts)),
+                             expected)
@@ -0,0 +1,67 @@
+# encoding: utf-8
+import time
+from unittest import TestCase
+
+from vantetider.session import make_session
+from vantetider import VantetiderScraper
+
+from tests.fixtures import FixtureServer
+
+
+class TestSession(TestCase):
+
+    def test_make_session(self):
+        session = make_session(pool_size=4, retries=2, gzip=False)
+        adapter = session.get_adapter("https://www.vantetider.se/")
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        # Pages that fail with 500 are retried by the scraper, not here
+        self.assertNotIn(500, adapter.max_retries.status_forcelist)
+        self.assertEqual(session.headers["Accept-Encoding"], "identity")
+
+    def test_scraper_session(self):
+        scraper = VantetiderScraper(workers=16, timeout=5)
+        adapter = scraper.session.get_adapter("https://www.vantetider.se/")
+        # Pool should be large enough for all workers
+        self.assertEqual(adapter._pool_maxsize, 16)
+        self.assertEqual(scraper.timeout, 5)
+
+    def test_adaptive_retries(self):
+        # With an adaptive rate limiter every attempt is seen by the limiter,
+        # not only the last one
+        scraper = VantetiderScraper(cache=None, rate_limit="adaptive",
+                                    backoff_factor=0)
+        adapter = scraper.session.get_adapter("https://www.vantetider.se/")
+        self.assertEqual(adapter.max_retries.total, 0)
+        with FixtureServer(n_units=1, errors=2, error_status=503,
+                           retry_after=1):
+            dataset = scraper.get("Overbelaggning")
+            res = dataset.fetch({"region": "Blekinge", "year": "2018"})
+        self.assertEqual(len(res), 2 * 3)
+        self.assertGreaterEqual(scraper.rate_limiter.decreases, 1)
+        self.assertGreater(scraper.rate_limiter.error_rate, 0)
+
+    def test_adaptive_concurrency(self):
+        # Requests in flight are not capped by the number of workers, but by
+        # the rate limiter
+        scraper = VantetiderScraper(cache=None, workers=2, pool_size=4,
+                                    rate_limit="adaptive")
+        scraper.rate_limiter.rate = 1000
+        request = scraper.session.request
+        in_flight = []
+
+        def counting_request(*args, **kwargs):
+            in_flight.append(scraper.rate_limiter.in_flight)
+            time.sleep(0.05)
+            return request(*args, **kwargs)
+        scraper.session.request = counting_request
+
+        query = {"region": "Blekinge", "year": ["2016", "2017", "2018"],
+                 "period": ["Januari", "Februari"]}
+        with FixtureServer(n_units=1):
+            dataset = scraper.get("Overbelaggning")
+            scraper.rate_limiter.concurrency = 4
+            res = dataset.fetch(query, plan=False)
+        self.assertEqual(len(res), 6 * 2 * 3)
+        self.assertEqual(max(in_flight), 4)
@@ -0,0 +1,78 @@
+# encoding: utf-8
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from vantetider import VantetiderScraper
+from vantetider.logs import new_timing
+from vantetider.stats import Stats, Histogram
+
+
+class TestStats(TestCase):
+
+    def test_histogram(self):
+        hist = Histogram(buckets=(1, 10))
+        for value in [0.5, 5, 50]:
+            hist.observe(value)
+        # Buckets are cumulative
+        self.assertEqual(hist.counts, [1, 2])
+        self.assertEqual(hist.count, 3)
+        self.assertEqual(hist.mean, 55.5 / 3)
+
+    def test_counters(self):
+        stats = Stats()
+        stats.incr("requests_total", method="GET")
+        stats.incr("requests_total", method="GET")
+        stats.incr("requests_total", method="POST")
+        self.assertEqual(stats.get("requests_total", method="GET"), 2)
+        self.assertEqual(stats.total("requests_total"), 3)
+        self.assertEqual(stats.get("cache_hits_total"), 0)
+
+    def test_record_request(self):
+        stats = Stats()
+        timing = new_timing("POST", "https://www.vantetider.se/")
+        timing.update(status=500, bytes=100, total=0.2)
+        stats.record_request(timing)
+        timing = new_timing("POST", "https://www.vantetider.se/")
+        timing.update(cache_hit=True, bytes=200, total=0.001)
+        stats.record_request(timing)
+
+        self.assertEqual(stats.get("requests_total", method="POST"), 2)
+        self.assertEqual(stats.get("response_bytes_total"), 300)
+        self.assertEqual(stats.get("cache_hits_total"), 1)
+        self.assertEqual(stats.get("http_errors_total", status="500"), 1)
+        self.assertEqual(stats.get("request_seconds", method="POST").count, 2)
+
+    def test_prometheus(self):
+        stats = Stats()
+        stats.incr("requests_total", method="GET")
+        stats.observe("rows_per_page", 30, layout="tabs")
+        text = stats.to_prometheus()
+        self.assertIn('vantetider_requests_total{method="GET"} 1\n', text)
+        self.assertIn("# TYPE vantetider_rows_per_page histogram", text)
+        self.assertIn('vantetider_rows_per_page_bucket{layout="tabs",le="25"} 0\n', text)
+        self.assertIn('vantetider_rows_per_page_bucket{layout="tabs",le="50"} 1\n', text)
+        self.assertIn('vantetider_rows_per_page_bucket{layout="tabs",le="+Inf"} 1\n', text)
+        self.assertIn('vantetider_rows_per_page_count{layout="tabs"} 1\n', text)
+
+    def test_merge_and_dump(self):
+        stats = Stats()
+        stats.incr("skipped_pages_total")
+        stats.observe("parse_seconds", 0.1, layout="regular")
+
+        total = Stats()
+        total.merge(stats)
+        total.merge(json.loads(stats.to_json()))
+        self.assertEqual(total.get("skipped_pages_total"), 2)
+        self.assertEqual(total.get("parse_seconds", layout="regular").count, 2)
+
+        path = os.path.join(tempfile.mkdtemp(), "stats.json")
+        total.dump(path)
+        with open(path) as f:
+            self.assertEqual(len(json.load(f)["histograms"]), 1)
+
+    def test_scraper_stats(self):
+        stats = Stats()
+        self.assertIs(VantetiderScraper(stats=stats).stats, stats)
+        self.assertIsInstance(VantetiderScraper().stats, Stats)
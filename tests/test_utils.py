@@ -0,0 +1,43 @@
+# encoding: utf-8
+from unittest import TestCase
+
+import numpy as np
+
+from vantetider.parsing import parse_value, parse_values, as_value
+from vantetider.scraper import chunked, get_region_slug
+
+
+class TestUtils(TestCase):
+
+    def test_chunked(self):
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunked([], 2)), [])
+
+    def test_get_region_slug(self):
+        self.assertEqual(get_region_slug(u"Norrbotten"), u"Norrbottens")
+        self.assertEqual(get_region_slug(u"Västra Götaland"), u"Vastra-Gotalands")
+        self.assertEqual(get_region_slug(u"Jämtland Härjedalen"), u"Jamtlands")
+        self.assertEqual(get_region_slug(u"Riket"), u"Sveriges")
+
+    def test_parse_value(self):
+        self.assertEqual(parse_value(u"12,5 %"), 12.5)
+        self.assertEqual(parse_value(u"1 234 st"), 1234.0)
+        self.assertEqual(parse_value(u"Ej deltagit"), u"Ejdeltagit")
+        self.assertEqual(parse_value(u" - "), u"-")
+        self.assertIsNone(parse_value(u"\n"))
+
+    def test_parse_values(self):
+        texts = [u"12,5 %", u"-", u"", u"N/A", u"3", u"Ej deltagit"]
+        values, missing = parse_values(texts)
+        self.assertEqual(values.dtype, np.float64)
+        self.assertEqual(values[0], 12.5)
+        self.assertEqual(values[4], 3.0)
+        self.assertTrue(np.isnan(values[[1, 2, 3, 5]]).all())
+        self.assertEqual(missing.tolist(), [0, 4, 1, 3, 0, 2])
+        self.assertEqual([as_value(*x) for x in zip(values, missing)],
+                         [parse_value(x) for x in texts])
+
+    def test_parse_values_empty(self):
+        values, missing = parse_values([])
+        self.assertEqual(len(values), 0)
+        self.assertEqual(len(missing), 0)
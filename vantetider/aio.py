@@ -0,0 +1,736 @@
+# encoding: utf-8
+"""An asyncio front end of the scraper.
+
+AsyncVantetiderScraper runs the queries of a VantetiderScraper on an event
+loop. Requests are made concurrently, up to `concurrency` at a time, through
+the cache, rate limiter and stats of the scraper. Result pages are parsed by
+the dataset, as in the sync scraper, in a thread pool so that the event
+loop is not blocked. Results are the same as those of `dataset.fetch`.
+
+    async with AsyncVantetiderScraper(concurrency=8) as scraper:
+        dataset = await scraper.get("Overbelaggning")
+        res = await scraper.fetch(dataset, {"region": "*", "year": "2018"})
+
+        async for chunk in scraper.iter_fetch(dataset, query, chunk_size=1000):
+            await db.insert_many(chunk)
+
+Requests are made with aiohttp if it is installed, else with the pooled
+session of the sync scraper, in threads (see ThreadedClient).
+
+Finding datasets and dimensions is left to the sync scraper, in a thread.
+Only the landing page of a dataset is requested here. Start from a metadata
+snapshot to make no such requests at all.
+"""
+import asyncio
+import functools
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import requests
+from requests.exceptions import HTTPError
+from statscraper import Result, ResultSet
+
+from .session import (RETRY_STATUSES, RETRY_ERRORS as SESSION_RETRY_ERRORS,
+                      reset_connect_time, get_connect_time)
+from .concurrency import (AdaptiveRateLimiter, OVERLOAD_STATUSES,
+                          parse_retry_after)
+from .planner import is_server_error
+from .logs import new_timing, log_timing, ProgressLog
+from .scraper import (VantetiderScraper, get_request_key, is_unit_row,
+                      canonical_payload)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Errors of a request that are worth retrying, see
+# vantetider.session.RETRY_ERRORS
+RETRY_ERRORS = SESSION_RETRY_ERRORS + (asyncio.TimeoutError,)
+if aiohttp is not None:
+    RETRY_ERRORS += (aiohttp.ClientConnectionError,)
+
+# A response of a client. Timings are in seconds, see vantetider.logs
+Response = namedtuple("Response", ["status", "content", "connect", "wait",
+                                   "transfer", "retry_after"])
+
+
+class AiohttpClient(object):
+    """ An aiohttp session, with a pool of kept-alive connections and
+        retries like the session of the sync scraper, see
+        vantetider.session.make_session
+    """
+    def __init__(self, pool_size=10, timeout=30, retries=3,
+                 backoff_factor=0.5, gzip=True):
+        if aiohttp is None:
+            raise ImportError(u"aiohttp is not installed")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.gzip = gzip
+        self._session = None
+
+    def _get_session(self):
+        # Created on first use, as it has to be created in the event loop
+        if self._session is None:
+            if isinstance(self.timeout, tuple):
+                connect, read = self.timeout
+                timeout = aiohttp.ClientTimeout(sock_connect=connect,
+                                                sock_read=read)
+            else:
+                timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+            # Time spent opening connections, by request
+            trace = aiohttp.TraceConfig()
+
+            async def _connect_start(session, ctx, params):
+                ctx.trace_request_ctx["connect_start"] = time.time()
+
+            async def _connect_end(session, ctx, params):
+                timing = ctx.trace_request_ctx
+                timing["connect"] += time.time() - timing["connect_start"]
+
+            trace.on_connection_create_start.append(_connect_start)
+            trace.on_connection_create_end.append(_connect_end)
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=timeout, trace_configs=[trace],
+                headers={"Accept-Encoding": "gzip, deflate" if self.gzip
+                         else "identity"})
+        return self._session
+
+    async def request(self, method, url, data=None):
+        """ Make a request. Connection errors and 502-504 responses are
+            retried `retries` times, with backoff, or after as long as the
+            Retry-After header of the response asks. The last response is
+            returned whatever its status.
+            :returns: a Response
+        """
+        session = self._get_session()
+        delay = 0.0
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(max(
+                    self.backoff_factor * 2 ** (attempt - 1), delay))
+                delay = 0.0
+            timing = {"connect": 0.0}
+            start = time.time()
+            try:
+                async with session.request(method, url, data=data,
+                                           trace_request_ctx=timing) as r:
+                    headers_received = time.time()
+                    content = await r.read()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+                continue
+            if r.status in RETRY_STATUSES and attempt < self.retries:
+                delay = parse_retry_after(r.headers.get("Retry-After")) or 0.0
+                continue
+
+            connect = timing["connect"]
+            return Response(r.status, content, connect,
+                            max(headers_received - start - connect, 0.0),
+                            time.time() - headers_received,
+                            r.headers.get("Retry-After"))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class ThreadedClient(object):
+    """ Makes requests with a requests session, eg the pooled and retrying
+        session of a VantetiderScraper, in a pool of threads
+    """
+    def __init__(self, session, timeout=30, executor=None):
+        """
+            :param executor: the threads to make requests in, one per
+                concurrent request
+        """
+        self.session = session
+        self.timeout = timeout
+        self.executor = executor
+
+    def _request(self, method, url, data=None):
+        reset_connect_time()
+        start = time.time()
+        r = self.session.request(method, url, data=data, timeout=self.timeout)
+        # Time to the response headers, including connecting
+        elapsed = r.elapsed.total_seconds()
+        connect = get_connect_time()
+        return Response(r.status_code, r.content, connect,
+                        max(elapsed - connect, 0.0),
+                        max(time.time() - start - elapsed, 0.0),
+                        r.headers.get("Retry-After"))
+
+    async def request(self, method, url, data=None):
+        """ :returns: a Response
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(self._request, method, url, data))
+
+    async def close(self):
+        pass
+
+
+def raise_for_status(url, response):
+    """ Raise a requests HTTPError on 4xx and 5xx responses, like the sync
+        scraper does, so that errors are handled the same way
+    """
+    if response.status < 400:
+        return
+    r = requests.Response()
+    r.status_code = response.status
+    r.url = url
+    r._content = response.content
+    r.raise_for_status()
+
+
+class AsyncFlights(object):
+    """ Lets concurrent calls with the same key share one call, like
+        vantetider.concurrency.SingleFlight but for coroutines in one event
+        loop
+    """
+    def __init__(self):
+        self._flights = {}
+        self.shared = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        """ Await `func(*args, **kwargs)`, unless a call with `key` is
+            already in flight
+            :returns: (result, shared)
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.shared += 1
+            return await asyncio.shield(flight), True
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            # Mark the exception as retrieved, in case no one else waits
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+        finally:
+            del self._flights[key]
+        return result, False
+
+
+async def imap_bounded(func, items, limit=1, ordered=True):
+    """ Await `func(item)` for every item, with at most `limit` calls in
+        flight, and yield the results, in the order of `items` if `ordered`
+        is True, else as they complete. Like
+        vantetider.concurrency.imap_bounded.
+    """
+    items = iter(items)
+    in_flight = deque()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(in_flight) < limit:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight.append(asyncio.ensure_future(func(item)))
+
+            if not in_flight:
+                break
+
+            if ordered:
+                task = in_flight.popleft()
+                yield await task
+            else:
+                done, _ = await asyncio.wait(
+                    in_flight, return_when=asyncio.FIRST_COMPLETED)
+                task = [x for x in in_flight if x in done][0]
+                in_flight.remove(task)
+                yield task.result()
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+
+class AsyncVantetiderScraper(object):
+    """ Runs the queries of a VantetiderScraper on an asyncio event loop
+    """
+    def __init__(self, scraper=None, concurrency=8, client=None,
+                 executor=None, parse_workers=2, **kwargs):
+        """
+            :param scraper: the VantetiderScraper to use the datasets,
+                cache, rate limiter, stats and logger of. By default one is
+                created, with `kwargs`.
+            :param concurrency: max number of requests in flight. Queries
+                are planned as in the sync scraper, and at most 2 x
+                `concurrency` result pages are in flight at any time.
+            :param client: "aiohttp", "threads", an AiohttpClient or a
+                ThreadedClient. By default aiohttp if it is installed, else
+                threads.
+            :param executor: a thread pool to parse result pages in. By
+                default one with `parse_workers` threads is created.
+                Result pages are parsed by the dataset and scraper objects,
+                that can not be sent to other processes, so a process pool
+                can not be used.
+            :param parse_workers: number of threads parsing pages
+        """
+        if scraper is None:
+            kwargs.setdefault("pool_size", max(10, concurrency))
+            scraper = VantetiderScraper(**kwargs)
+        self.scraper = scraper
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self._slots_condition = None
+        self._slots_loop = None
+        self.flights = AsyncFlights() if scraper.flights is not None else None
+
+        # Threads for blocking calls: the sync scraper, the http cache and
+        # requests of a ThreadedClient
+        self._io_executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=parse_workers)
+        self.executor = executor
+
+        if client is None:
+            client = "aiohttp" if aiohttp is not None else "threads"
+        if client == "aiohttp":
+            adaptive = isinstance(scraper.rate_limiter, AdaptiveRateLimiter)
+            client = AiohttpClient(pool_size=max(10, concurrency),
+                                   timeout=scraper.timeout,
+                                   retries=0 if adaptive else scraper.retries,
+                                   backoff_factor=scraper.backoff_factor)
+        elif client == "threads":
+            client = ThreadedClient(scraper.session, timeout=scraper.timeout,
+                                    executor=self._io_executor)
+        elif not hasattr(client, "request"):
+            raise ValueError(u"Unknown client: {}".format(client))
+        self.client = client
+
+    @property
+    def log(self):
+        return self.scraper.log
+
+    @property
+    def stats(self):
+        return self.scraper.stats
+
+    @property
+    def cache(self):
+        return self.scraper.cache
+
+    async def close(self):
+        """ Close the http client and the thread pools
+        """
+        await self.client.close()
+        self._io_executor.shutdown(wait=False)
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _run_io(self, func, *args, **kwargs):
+        """ Run a blocking call in a thread
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._io_executor, functools.partial(func, *args, **kwargs))
+
+    async def _run_parse(self, func, *args, **kwargs):
+        """ Run a cpu bound call in the parse executor
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def get(self, dataset_id):
+        """ Get a dataset, with its dimensions loaded
+            :returns: a VantetiderDataset, of the sync scraper
+        """
+        def _get():
+            self.scraper.move_to_top()
+            return self.scraper.get(dataset_id)
+
+        dataset = await self._run_io(_get)
+        if getattr(dataset, "_metadata", None) is None and \
+                not hasattr(dataset, "_html"):
+            dataset._html = await self._get_html(dataset.get_url())
+        await self._run_parse(self._load_dataset, dataset)
+        return dataset
+
+    def _load_dataset(self, dataset):
+        # Everything that fetch() needs, before any request is made
+        dataset._move_here()
+        dataset.dimensions
+        dataset.layout
+        dataset._get_region_index()
+
+    async def fetch(self, dataset, query=None, **kwargs):
+        """ Fetch data, like `dataset.fetch`
+            :param dataset: a VantetiderDataset from `get`
+            :param query: a query, as passed to `dataset.fetch`
+            :param kwargs: see _fetch_data
+            :returns: a ResultSet
+        """
+        rs = ResultSet()
+        rs.dialect = dataset.dialect
+        rs.dataset = dataset
+        async for result in self._fetch_data(dataset, query, **kwargs):
+            rs.append(result)
+        return rs
+
+    async def iter_fetch(self, dataset, query=None, chunk_size=None,
+                         **kwargs):
+        """ Fetch data, yielding rows as they are parsed, like
+            `dataset.iter_fetch`
+
+            async for row in scraper.iter_fetch(dataset, query):
+                ...
+
+            :param chunk_size: yield lists of this many rows instead of
+                single rows
+            :returns: dicts like {"value": 12.0, "region": "Blekinge", ...}
+        """
+        chunk = []
+        async for result in self._fetch_data(dataset, query, **kwargs):
+            row = dict(result.raw_dimensions, value=result.value)
+            if chunk_size is None:
+                yield row
+                continue
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def _fetch_data(self, dataset, query=None, ordered=True, plan=True,
+                          include_units=True, retry_passes=None):
+        """ Get the Results of a query, see VantetiderScraper._fetch_data
+            :param ordered: yield rows in query order, rather than as
+                pages are parsed
+            :param plan: see vantetider.planner
+            :param include_units: see vantetider.planner.QueryPlan
+            :param retry_passes: see VantetiderScraper
+        """
+        if retry_passes is None:
+            retry_passes = self.scraper.retry_passes
+
+        # May make a request for the regions of units
+        query_plan, units, only_region = await self._run_io(
+            self.scraper._plan_fetch, dataset, query, plan=plan,
+            include_units=include_units)
+        jobs = query_plan.requests
+
+        n_queries = len(jobs)
+        self.log.info(u"Making a total of %s queries (%s without a plan)",
+                      n_queries, len(query_plan.naive_requests))
+
+        # Requests of pages that the server failed to render, to retry
+        # once all other pages are fetched, see QueryPlan.iter_results
+        retry = [] if retry_passes else None
+
+        async def _get_results(request, found=None):
+            # The Results of the page of a request, or None if the page is
+            # to be retried
+            try:
+                results = await self._parse_result_page(
+                    dataset, request.url, request.payload,
+                    only_region=only_region, skip_errors=retry is None)
+            except HTTPError as e:
+                if retry is None or not is_server_error(e):
+                    raise
+                return None
+            return list(query_plan.filter_results(request, results, found))
+
+        async def _run_page(request):
+            results = await _get_results(request)
+            if results is None:
+                retry.append(request)
+                return []
+            return results
+
+        async def _run(job):
+            found = dict((dim_id, set()) for dim_id in job.keep)
+            results = await _get_results(job, found)
+            if results is None:
+                if not job.keep:
+                    retry.append(job)
+                    return []
+                # The values of the collapsed request are requested one by
+                # one below
+                results = []
+            for missing in query_plan.get_missing_requests(job, found):
+                results.extend(await _run_page(missing))
+            return results
+
+        progress = ProgressLog(self.log, self.scraper.progress_interval)
+        n_rows = 0
+        i = 0
+        async for rows in imap_bounded(_run, jobs, limit=self.concurrency * 2,
+                                       ordered=ordered):
+            i += 1
+            self.log.debug(u"Query %s/%s", i, n_queries)
+            for row in rows:
+                if units is not None and not is_unit_row(row, units):
+                    continue
+                n_rows += 1
+                yield row
+            progress.update(u"Query %s/%s of %s, %s rows", i, n_queries,
+                            dataset.id, n_rows)
+
+        for n in range(retry_passes):
+            if not retry:
+                break
+            failed = list(retry)
+            del retry[:]
+            self.log.info(u"Retrying %s pages of %s that failed, in %s s",
+                          len(failed), dataset.id, self.scraper.retry_delay)
+            self.stats.incr("retried_pages_total", len(failed))
+            await asyncio.sleep(self.scraper.retry_delay)
+            async for rows in imap_bounded(_run_page, failed,
+                                           limit=self.concurrency * 2,
+                                           ordered=ordered):
+                for row in rows:
+                    if units is not None and not is_unit_row(row, units):
+                        continue
+                    n_rows += 1
+                    yield row
+
+        for request in retry or []:
+            self.log.warning(u"Unable to get %s with %s", request.url,
+                             request.payload)
+            self.stats.incr("skipped_pages_total")
+
+        progress.update(u"Done with %s queries of %s, %s rows", n_queries,
+                        dataset.id, n_rows, force=True)
+
+        if self.cache is not None:
+            self.log.info(u"Result page cache: %s", self.cache.page_stats)
+
+    async def _parse_result_page(self, dataset, url, payload,
+                                 only_region=False, skip_errors=True,
+                                 refresh=False):
+        """ Get data from a result page, see
+            VantetiderDataset._parse_result_page
+            :return: a list of Results
+        """
+        if self.flights is None:
+            return await self._read_result_page(dataset, url, payload,
+                                                only_region, skip_errors,
+                                                refresh)
+
+        # Concurrent identical queries share the parsed page
+        _, region_slug, normalized = dataset._get_result_page_key(url, payload)
+        key = ("parsed", dataset.id, region_slug,
+               canonical_payload(normalized), only_region, skip_errors,
+               refresh)
+        results, shared = await self.flights.do(
+            key, self._read_result_page, dataset, url, payload, only_region,
+            skip_errors, refresh)
+        if shared:
+            # Results are tied to the ResultSet they are added to
+            results = [Result(x.value, dict(x.raw_dimensions)) for x in results]
+        return results
+
+    async def _read_result_page(self, dataset, url, payload, only_region,
+                                skip_errors, refresh):
+        # The timing event of the html request, logged with the time spent
+        # parsing the page once it has been read
+        timing = {}
+        if only_region:
+            html = await self._get_html(url, refresh=refresh, timing=timing)
+        else:
+            try:
+                html = await self._post_html(
+                    url, payload=payload,
+                    page_key=dataset._get_result_page_key(url, payload),
+                    refresh=refresh, timing=timing)
+            except HTTPError as e:
+                log_timing(timing)
+                if skip_errors and e.response.status_code == 500:
+                    self.log.warning(u"Unable to get %s with %s", url,
+                                     payload)
+                    self.stats.incr("skipped_pages_total")
+                    return []
+                raise
+
+        return await self._run_parse(
+            lambda: list(dataset._iter_page_results(html, timing)))
+
+    # HELPER METHODS
+    async def _get_html(self, url, refresh=False, timing=None):
+        """ Get html from url, see VantetiderScraper._get_html
+        """
+        self.log.debug(u"/GET %s", url)
+        return await self._request("GET", url, refresh=refresh, timing=timing)
+
+    async def _post_html(self, url, payload, page_key=None, refresh=False,
+                         timing=None):
+        """ Post a query, see VantetiderScraper._post_html
+        """
+        self.log.debug(u"/POST %s with %s", url, payload)
+        return await self._request("POST", url, payload, page_key=page_key,
+                                   refresh=refresh, timing=timing)
+
+    async def _request(self, method, url, payload=None, page_key=None,
+                       refresh=False, timing=None):
+        """ Make a request through the cache, rate limiter and client.
+            Concurrent identical requests share one request.
+            :param timing: see VantetiderScraper._request
+            :returns: content of the response
+        """
+        _timing = new_timing(method, url)
+        start = time.time()
+        try:
+            if self.flights is None:
+                return await self._make_request(method, url, payload,
+                                                page_key=page_key,
+                                                refresh=refresh,
+                                                timing=_timing)
+            key = get_request_key(method, url, payload, page_key, refresh)
+            content, shared = await self.flights.do(
+                key, self._make_request, method, url, payload,
+                page_key=page_key, refresh=refresh, timing=_timing)
+            _timing["shared"] = shared
+            return content
+        finally:
+            _timing["total"] = time.time() - start
+            self.stats.record_request(_timing)
+            if timing is None:
+                log_timing(_timing)
+            else:
+                timing.update(_timing)
+
+    async def _make_request(self, method, url, payload=None, page_key=None,
+                            refresh=False, timing=None):
+        """ Make a request through the cache, rate limiter and client
+            :param timing: a timing event to fill in
+            :returns: content of the response
+        """
+        if timing is None:
+            timing = new_timing(method, url)
+        cache = self.cache
+        if cache is not None and not refresh:
+            if page_key is None:
+                content = await self._run_io(cache.get, method, url, payload)
+            else:
+                content = await self._run_io(cache.get_page, *page_key)
+            if content is not None:
+                timing["cache_hit"] = True
+                timing["bytes"] = len(content)
+                return content
+
+        limiter = self.scraper.rate_limiter
+        adaptive = isinstance(limiter, AdaptiveRateLimiter)
+        # With an adaptive rate limiter the client does not retry, see
+        # VantetiderScraper._make_request
+        attempts = self.scraper.retries + 1 if adaptive else 1
+        for attempt in range(attempts):
+            if attempt > 0:
+                await asyncio.sleep(self.scraper.backoff_factor *
+                                    2 ** (attempt - 1))
+            async with self._request_slot():
+                await self._wait_for_rate_limit(url)
+                start = time.time()
+                try:
+                    response = await self.client.request(method, url,
+                                                         payload)
+                except RETRY_ERRORS:
+                    if not adaptive:
+                        raise
+                    limiter.record(None, time.time() - start)
+                    if attempt < attempts - 1:
+                        continue
+                    raise
+                except Exception:
+                    if adaptive:
+                        limiter.record(None, time.time() - start)
+                    raise
+            if adaptive:
+                limiter.record(response.status,
+                               response.connect + response.wait,
+                               response.retry_after)
+                if response.status in OVERLOAD_STATUSES and \
+                        attempt < attempts - 1:
+                    continue
+            break
+
+        timing["status"] = response.status
+        timing["bytes"] = len(response.content)
+        timing["connect"] = response.connect
+        timing["wait"] = response.wait
+        timing["transfer"] = response.transfer
+        raise_for_status(url, response)
+
+        if cache is None:
+            pass
+        elif page_key is None:
+            await self._run_io(cache.set, method, url, payload,
+                               response.content)
+        else:
+            dataset_id, region_slug, normalized_payload = page_key
+            await self._run_io(cache.set_page, dataset_id, region_slug, url,
+                               normalized_payload, response.content)
+
+        return response.content
+
+    def _max_in_flight(self):
+        limiter = self.scraper.rate_limiter
+        if isinstance(limiter, AdaptiveRateLimiter):
+            return min(self.concurrency, limiter.concurrency)
+        return self.concurrency
+
+    @property
+    def _slots(self):
+        # Created in the running loop, and anew in every loop the scraper is
+        # used in, as a condition can only be waited on in one loop
+        loop = asyncio.get_running_loop()
+        if self._slots_loop is not loop:
+            self._slots_condition = asyncio.Condition()
+            self._slots_loop = loop
+        return self._slots_condition
+
+    @asynccontextmanager
+    async def _request_slot(self):
+        """ Count a request as in flight, once fewer than `concurrency`
+            requests, or as many as an adaptive rate limiter allows, are
+        """
+        async with self._slots:
+            await self._slots.wait_for(
+                lambda: self.in_flight < self._max_in_flight())
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._slots:
+                self.in_flight -= 1
+                self._slots.notify_all()
+
+    async def _wait_for_rate_limit(self, url):
+        rate_limiter = self.scraper.rate_limiter
+        if hasattr(rate_limiter, "reserve"):
+            delay = rate_limiter.reserve(url)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            await self._run_io(rate_limiter.wait, url)
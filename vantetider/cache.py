@@ -0,0 +1,435 @@
+# encoding: utf-8
+"""A per-scraper http cache with pluggable backends, url based expiry and
+a max size.
+
+    cache = make_cache("sqlite", path="vantetider.sqlite",
+                       ttl=[(r"^GET ", 24 * 3600)],  # landing pages: 1 day
+                       max_size=2 * 1024 ** 3)  # 2 GB
+    scraper = VantetiderScraper(cache=cache)
+    scraper.cache.purge(dataset="Overbelaggning", year="2020")
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+
+# Landing pages show the latest period and change when new data is
+# published, result pages for a given query change rarely.
+DEFAULT_TTL = [
+    (r"^GET ", 24 * 3600),
+    (r"^POST ", None),
+]
+DEFAULT_MAX_SIZE = 256 * 1024 ** 2  # 256 MB
+BACKENDS = ["memory", "sqlite", "filesystem"]
+
+CacheEntry = namedtuple("CacheEntry", ["method", "url", "payload", "content",
+                                       "created", "expires"])
+
+
+def canonical_payload(payload):
+    """ Serialize a form payload so that equal dicts give equal strings
+        {"b": 1, "a": 2} => "a=2&b=1"
+    """
+    if not payload:
+        return ""
+    return urlencode(sorted((k, u"{}".format(v)) for k, v in payload.items()))
+
+
+class CacheStats(object):
+    """ Thread safe hit/miss counter
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return None
+        return float(self.hits) / total
+
+    def __repr__(self):
+        return u"<CacheStats: {} hits, {} misses>".format(self.hits,
+                                                          self.misses)
+
+
+class HttpCache(object):
+    """ Stores responses by method, url and payload in a backend.
+        Result pages are stored by dataset, region and normalized payload,
+        see get_page() and set_page().
+    """
+    def __init__(self, backend, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        """
+            :param backend: a MemoryBackend, SQLiteBackend or FileSystemBackend
+            :param ttl: seconds until an entry expires. Either a number
+                (same for all entries), None (never expire) or a list of
+                (regex, seconds) that are matched, in order, against
+                "<METHOD> <url>?<payload>", eg "POST https://...?select_year=2020"
+            :param max_size: max total size of stored responses in bytes.
+                The oldest entries are evicted first. None means no limit.
+        """
+        self.backend = backend
+        if ttl is None or isinstance(ttl, (int, float)):
+            ttl = [(r"", ttl)]
+        self.ttl = [(re.compile(pattern), seconds) for pattern, seconds in ttl]
+        self.max_size = max_size
+        self.page_stats = CacheStats()
+
+    def key(self, method, url, payload=None):
+        """ Get the key that a request is stored under
+        """
+        raw = u"{} {}?{}".format(method, url, canonical_payload(payload))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get_ttl(self, method, url, payload=None):
+        """ Get the number of seconds a response should be kept
+        """
+        target = u"{} {}?{}".format(method, url, canonical_payload(payload))
+        for pattern, seconds in self.ttl:
+            if pattern.search(target):
+                return seconds
+        return None
+
+    def page_key(self, dataset, region_slug, payload):
+        """ Get the key that a result page is stored under
+
+            :param dataset: id of dataset
+            :param region_slug: region part of the url, eg "Blekinges"
+            :param payload: a payload normalized by the dataset, with all
+                form fields given
+        """
+        raw = u"PAGE {} {} {}".format(dataset, region_slug,
+                                      canonical_payload(payload))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get_page(self, dataset, region_slug, payload):
+        """ :returns: a cached result page, or None
+        """
+        content = self.get("POST", None, payload,
+                           key=self.page_key(dataset, region_slug, payload))
+        if content is None:
+            self.page_stats.miss()
+        else:
+            self.page_stats.hit()
+        return content
+
+    def set_page(self, dataset, region_slug, url, payload, content):
+        self.set("POST", url, payload, content,
+                 key=self.page_key(dataset, region_slug, payload))
+
+    def get(self, method, url, payload=None, key=None):
+        """ :returns: the cached content, or None
+        """
+        if key is None:
+            key = self.key(method, url, payload)
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        if entry.expires is not None and entry.expires < time.time():
+            self.backend.delete(key)
+            return None
+        return entry.content
+
+    def set(self, method, url, payload, content, key=None):
+        if key is None:
+            key = self.key(method, url, payload)
+        now = time.time()
+        ttl = self.get_ttl(method, url, payload)
+        expires = None if ttl is None else now + ttl
+        entry = CacheEntry(method, url, dict(payload or {}), content,
+                           now, expires)
+        self.backend.set(key, entry)
+        if self.max_size is not None and self.backend.size > self.max_size:
+            self.backend.evict(self.max_size)
+
+    def purge(self, dataset=None, year=None):
+        """ Remove entries for a dataset and/or year. Returns the number of
+            removed entries.
+
+            :param dataset: id of dataset, eg "Overbelaggning"
+            :param year: a year, as in the "select_year" form field
+        """
+        n = 0
+        for key, method, url, payload in list(self.backend.iter_meta()):
+            if dataset is not None and u"/{}/".format(dataset) not in url:
+                continue
+            if year is not None and \
+                    u"{}".format(payload.get("select_year")) != u"{}".format(year):
+                continue
+            self.backend.delete(key)
+            n += 1
+        return n
+
+    def clear(self):
+        self.backend.clear()
+
+    def __len__(self):
+        return len(list(self.backend.iter_meta()))
+
+
+class MemoryBackend(object):
+    """ Keeps entries in memory. Evicts least recently used entries.
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.content)
+            self._entries[key] = entry
+            self.size += len(entry.content)
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.content)
+
+    def evict(self, max_size):
+        with self._lock:
+            while self.size > max_size and self._entries:
+                _, old = self._entries.popitem(last=False)
+                self.size -= len(old.content)
+
+    def iter_meta(self):
+        with self._lock:
+            items = list(self._entries.items())
+        for key, entry in items:
+            yield key, entry.method, entry.url, entry.payload
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class SQLiteBackend(object):
+    """ Keeps entries in a sqlite file. Evicts the oldest entries.
+        Reads do not update the entries, to avoid write contention. Only an
+        expired entry is deleted when it is read, see HttpCache.get.
+    """
+    def __init__(self, path="vantetider_cache.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            method TEXT,
+            url TEXT,
+            payload TEXT,
+            content BLOB,
+            created REAL,
+            expires REAL,
+            size INTEGER)""")
+        self._conn.execute("""CREATE INDEX IF NOT EXISTS responses_created
+            ON responses (created)""")
+        self._conn.commit()
+        self.size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT method, url, payload, content, created, expires
+                   FROM responses WHERE key = ?""", (key,)).fetchone()
+        if row is None:
+            return None
+        method, url, payload, content, created, expires = row
+        return CacheEntry(method, url, json.loads(payload), bytes(content),
+                          created, expires)
+
+    def set(self, key, entry):
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                """INSERT OR REPLACE INTO responses
+                   (key, method, url, payload, content, created, expires, size)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (key, entry.method, entry.url, json.dumps(entry.payload),
+                 sqlite3.Binary(entry.content), entry.created, entry.expires,
+                 len(entry.content)))
+            self._conn.commit()
+            self.size += len(entry.content) - (old[0] if old else 0)
+
+    def delete(self, key):
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old is None:
+                return
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+            self.size -= old[0]
+
+    def evict(self, max_size):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY created").fetchall()
+            evicted = []
+            for key, size in rows:
+                if self.size <= max_size:
+                    break
+                evicted.append((key,))
+                self.size -= size
+            self._conn.executemany("DELETE FROM responses WHERE key = ?",
+                                   evicted)
+            self._conn.commit()
+
+    def iter_meta(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, method, url, payload FROM responses").fetchall()
+        for key, method, url, payload in rows:
+            yield key, method, url, json.loads(payload)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self.size = 0
+
+
+class FileSystemBackend(object):
+    """ Keeps one file per entry in a directory, with metadata in a json
+        file next to it. Evicts the oldest entries.
+    """
+    def __init__(self, path="vantetider_cache"):
+        self.path = path
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.size = sum(os.path.getsize(os.path.join(path, x))
+                        for x in os.listdir(path) if x.endswith(".bin"))
+
+    def _path(self, key, ext):
+        return os.path.join(self.path, key + ext)
+
+    def get(self, key):
+        try:
+            with open(self._path(key, ".json")) as f:
+                meta = json.load(f)
+            with open(self._path(key, ".bin"), "rb") as f:
+                content = f.read()
+        except (IOError, OSError, ValueError):
+            return None
+        return CacheEntry(meta["method"], meta["url"], meta["payload"],
+                          content, meta["created"], meta["expires"])
+
+    def set(self, key, entry):
+        meta = {
+            "method": entry.method,
+            "url": entry.url,
+            "payload": entry.payload,
+            "created": entry.created,
+            "expires": entry.expires,
+        }
+        with self._lock:
+            self._remove(key)
+            with open(self._path(key, ".bin"), "wb") as f:
+                f.write(entry.content)
+            # Meta is written last, an entry without meta is not used
+            with open(self._path(key, ".json"), "w") as f:
+                json.dump(meta, f)
+            self.size += len(entry.content)
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key, ".json"))
+        except OSError:
+            pass
+        try:
+            size = os.path.getsize(self._path(key, ".bin"))
+            os.remove(self._path(key, ".bin"))
+            self.size -= size
+        except OSError:
+            pass
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def evict(self, max_size):
+        with self._lock:
+            files = [x for x in os.listdir(self.path) if x.endswith(".bin")]
+            files.sort(key=lambda x: os.path.getmtime(os.path.join(self.path, x)))
+            for filename in files:
+                if self.size <= max_size:
+                    break
+                self._remove(filename[:-len(".bin")])
+
+    def iter_meta(self):
+        for filename in os.listdir(self.path):
+            if not filename.endswith(".json"):
+                continue
+            key = filename[:-len(".json")]
+            try:
+                with open(self._path(key, ".json")) as f:
+                    meta = json.load(f)
+            except (IOError, OSError, ValueError):
+                continue
+            yield key, meta["method"], meta["url"], meta["payload"]
+
+    def clear(self):
+        with self._lock:
+            for filename in os.listdir(self.path):
+                if filename.endswith(".bin") or filename.endswith(".json"):
+                    os.remove(os.path.join(self.path, filename))
+            self.size = 0
+
+
+def make_cache(backend="memory", path=None, ttl=DEFAULT_TTL,
+               max_size=DEFAULT_MAX_SIZE):
+    """ Create a HttpCache
+
+        :param backend: "memory"|"sqlite"|"filesystem"
+        :param path: file (sqlite) or directory (filesystem) to store
+            responses in
+        :param ttl: see HttpCache
+        :param max_size: see HttpCache
+    """
+    if backend == "memory":
+        _backend = MemoryBackend()
+    elif backend == "sqlite":
+        _backend = SQLiteBackend(path or "vantetider_cache.sqlite")
+    elif backend == "filesystem":
+        _backend = FileSystemBackend(path or "vantetider_cache")
+    else:
+        raise ValueError(u"Unknown cache backend: {}. Use one of {}."
+                         .format(backend, BACKENDS))
+
+    return HttpCache(_backend, ttl=ttl, max_size=max_size)
@@ -0,0 +1,180 @@
+# encoding: utf-8
+"""A compact, column by column, container for query results.
+
+Each dimension is stored as an array of integer codes into a list of its
+unique labels, and values as an array of floats. Non-numeric values
+("-", "N/A", "Ejdeltagit" or empty cells) are NaN in the value array, with
+the original value kept in a separate "missing" column.
+
+    res = dataset.fetch_columnar({"region": "*", "year": "*"})
+    df = res.pandas  # categorical dimension columns, float values
+"""
+from array import array
+
+import numpy as np
+import pandas as pd
+
+VALUE_KEY = "value"
+MISSING_KEY = "missing"
+NO_CODE = -1
+
+
+class ColumnarResult(object):
+    """ Rows of a query, stored column by column
+    """
+    def __init__(self):
+        self._values = array("d")
+        # 0 means numeric, n means self._missing_labels[n - 1]
+        self._missing = array("B")
+        self._missing_labels = []
+        self._codes = {}
+        self._categories = {}
+        self._lookup = {}
+        self._list_of_dicts = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        """ :param rows: an iterable of statscraper Results or of dicts with
+                a "value" key, like the rows of `dataset.iter_fetch()`
+        """
+        result = cls()
+        result.extend(rows)
+        return result
+
+    @property
+    def dimensions(self):
+        """ Ids of the dimension columns, in the order they were first seen
+        """
+        return list(self._codes.keys())
+
+    def append(self, value, dimensions):
+        """ Add a row
+
+            :param value: a float, or a non-numeric value such as "-"
+            :param dimensions: a dict with the dimension values of the row
+        """
+        n = len(self._values)
+        if isinstance(value, float) or isinstance(value, int):
+            self._values.append(value)
+            self._missing.append(0)
+        else:
+            self._values.append(np.nan)
+            self._missing.append(self._get_missing_code(value))
+
+        for dim_id, label in dimensions.items():
+            if dim_id not in self._codes:
+                # Earlier rows did not have this dimension
+                self._codes[dim_id] = array("i", [NO_CODE] * n)
+                self._categories[dim_id] = []
+                self._lookup[dim_id] = {}
+            self._codes[dim_id].append(self._get_code(dim_id, label))
+
+        for dim_id, codes in self._codes.items():
+            if len(codes) == n:
+                # This row does not have this dimension
+                codes.append(NO_CODE)
+
+        self._list_of_dicts = None
+
+    def extend(self, rows):
+        """ Add rows, see `from_rows`
+        """
+        for row in rows:
+            if isinstance(row, dict):
+                dims = dict(row)
+                value = dims.pop(VALUE_KEY, None)
+            else:
+                value, dims = row.value, row.raw_dimensions
+            self.append(value, dims)
+
+    def _get_code(self, dim_id, label):
+        lookup = self._lookup[dim_id]
+        try:
+            return lookup[label]
+        except KeyError:
+            code = len(self._categories[dim_id])
+            self._categories[dim_id].append(label)
+            lookup[label] = code
+            return code
+
+    def _get_missing_code(self, value):
+        if value not in self._missing_labels:
+            self._missing_labels.append(value)
+        return self._missing_labels.index(value) + 1
+
+    def __len__(self):
+        return len(self._values)
+
+    @property
+    def values(self):
+        """ A float array of all values, NaN where the value is missing.
+            A copy, as a numpy view would lock the buffer for append().
+        """
+        return np.array(self._values, dtype=np.float64)
+
+    def column(self, dim_id):
+        """ Get a dimension column as a pandas Categorical
+        """
+        codes = np.array(self._codes[dim_id], dtype=np.int32)
+        categories = self._categories[dim_id]
+        if any(x is None for x in categories):
+            # None can not be a category, and becomes NaN
+            none_code = categories.index(None)
+            codes = np.where(codes == none_code, NO_CODE, codes)
+            codes = np.where(codes > none_code, codes - 1, codes)
+            categories = [x for x in categories if x is not None]
+        return pd.Categorical.from_codes(codes, categories=pd.Index(categories, dtype=object))
+
+    @property
+    def missing(self):
+        """ A Categorical with the reason a value is missing, eg "-", and
+            NaN where the value is numeric
+        """
+        codes = np.array(self._missing, dtype=np.int32) - 1
+        labels = [u"" if x is None else x for x in self._missing_labels]
+        return pd.Categorical.from_codes(codes, categories=pd.Index(labels, dtype=object))
+
+    @property
+    def pandas(self):
+        """ A DataFrame with a float "value" column, a categorical "missing"
+            column and one categorical column per dimension
+        """
+        data = {
+            VALUE_KEY: self.values,
+            MISSING_KEY: self.missing,
+        }
+        for dim_id in self.dimensions:
+            data[dim_id] = self.column(dim_id)
+        return pd.DataFrame(data, columns=[VALUE_KEY, MISSING_KEY] + self.dimensions)
+
+    def __iter_raw(self):
+        """ Yield (value, dimensions) tuples
+        """
+        for i in range(len(self)):
+            missing = self._missing[i]
+            if missing == 0:
+                value = self._values[i]
+            else:
+                value = self._missing_labels[missing - 1]
+            dims = {}
+            for dim_id, codes in self._codes.items():
+                code = codes[i]
+                if code != NO_CODE:
+                    dims[dim_id] = self._categories[dim_id][code]
+            yield value, dims
+
+    def __iter__(self):
+        """ Yield rows as dicts, built on the fly
+        """
+        for value, dims in self.__iter_raw():
+            dims[VALUE_KEY] = value
+            yield dims
+
+    @property
+    def list_of_dicts(self):
+        """ Rows as a list of dicts, like ResultSet.list_of_dicts. Built
+            the first time it is asked for.
+        """
+        if self._list_of_dicts is None:
+            self._list_of_dicts = list(self)
+        return self._list_of_dicts
@@ -0,0 +1,390 @@
+# encoding: utf-8
+"""Helpers for running scraper queries concurrently.
+"""
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from .logs import logger
+
+# Statuses that mean the server is overloaded, or asks us to slow down
+OVERLOAD_STATUSES = (429, 502, 503, 504)
+
+
+class RateLimiter(object):
+    """ Spaces out requests so that no more than `rate` requests per second
+        are made to any one host. Shared by all threads of a scraper.
+    """
+    def __init__(self, rate=None):
+        """
+            :param rate: max number of requests per second and host. None
+                means no limit.
+        """
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url):
+        """ Block until a request to the host of `url` may be made
+        """
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self, url):
+        """ Book the next free slot for a request to the host of `url`,
+            without waiting for it, eg to wait with asyncio.sleep
+            :returns: seconds until the request may be made
+        """
+        if not self.rate:
+            return 0.0
+
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1.0 / self.rate
+        return slot - now
+
+
+class ProcessRateLimiter(object):
+    """ A rate limiter shared by several processes, eg the workers of a
+        process pool. All requests, to any host, share the same budget.
+        Pass it to the workers when the pool is created.
+    """
+    def __init__(self, rate=None):
+        """
+            :param rate: max number of requests per second, across all
+                processes. None means no limit.
+        """
+        self.rate = rate
+        self._lock = multiprocessing.Lock()
+        self._next_slot = multiprocessing.Value("d", 0.0, lock=False)
+
+    def wait(self, url=None):
+        """ Block until a request may be made
+        """
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self, url=None):
+        """ Book the next free slot for a request, without waiting for it
+            :returns: seconds until the request may be made
+        """
+        if not self.rate:
+            return 0.0
+
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + 1.0 / self.rate
+        return slot - now
+
+
+class AdaptiveRateLimiter(object):
+    """ Adapts the request rate and the number of requests in flight to
+        the server, AIMD style: both are increased a little after every
+        `window` responses that came back fast and without errors, and
+        halved when responses are slow, fail or the server signals that it
+        is overloaded (429, 502-504). A Retry-After header pauses all
+        requests for as long as the server asks.
+
+        All requests, to any host, share the same budget.
+
+        limiter = AdaptiveRateLimiter(rate=5, concurrency=4)
+        with limiter.slot():
+            limiter.wait(url)
+            r = session.get(url)
+        limiter.record(r.status_code, r.elapsed.total_seconds(),
+                       r.headers.get("Retry-After"))
+    """
+    def __init__(self, rate=5.0, min_rate=0.5, max_rate=50.0, concurrency=4,
+                 max_concurrency=16, target_latency=2.0, max_error_rate=0.1,
+                 increase=1.0, decrease=0.5, window=20, log=logger):
+        """
+            :param rate: requests per second to start at
+            :param min_rate: requests per second never to go below
+            :param max_rate: requests per second never to go above
+            :param concurrency: requests in flight to start at
+            :param max_concurrency: requests in flight never to go above
+            :param target_latency: seconds. Slow down when the average
+                response time is above this.
+            :param max_error_rate: slow down when the share of failed
+                requests (5xx, 429 and connection errors), on average, is
+                above this. Vantetider.se responds with 500 on some queries
+                that never succeed, so a few errors are expected.
+            :param increase: requests per second to add, and
+            :param decrease: factor to multiply rate and concurrency by
+            :param window: responses between two changes
+        """
+        self.rate = float(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.log = log
+
+        # Moving averages of response time and error rate
+        self.latency = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        # Number of times the rate has been decreased
+        self.decreases = 0
+
+        self._cond = threading.Condition()
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._responses = 0
+
+    def reserve(self, url=None):
+        """ Book the next free slot for a request, without waiting for it
+            :returns: seconds until the request may be made
+        """
+        with self._cond:
+            now = time.time()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + 1.0 / self.rate
+        return slot - now
+
+    def wait(self, url=None):
+        """ Block until a request may be made
+        """
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    def acquire(self):
+        """ Block until fewer than `concurrency` requests are in flight
+        """
+        with self._cond:
+            while self.in_flight >= self.concurrency:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """ Count a request as in flight during a with block
+        """
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record(self, status, latency, retry_after=None):
+        """ Adapt to the response of a request
+            :param status: status code, or None if the request failed
+                without a response, eg on a timeout
+            :param latency: seconds to the response
+            :param retry_after: the Retry-After header of the response
+        """
+        failed = status is None or status >= 500 or status == 429
+        # Averaged over about `window` responses
+        alpha = 1.0 / self.window
+        with self._cond:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += alpha * (latency - self.latency)
+            self.error_rate += alpha * (failed - self.error_rate)
+
+            pause = parse_retry_after(retry_after)
+            if pause:
+                self._paused_until = max(self._paused_until,
+                                         time.time() + pause)
+                self.log.info(u"Server asks to retry after %s s, pausing "
+                              u"requests", pause)
+
+            self._responses += 1
+            overloaded = status is None or status in OVERLOAD_STATUSES or \
+                self.error_rate > self.max_error_rate or \
+                self.latency > self.target_latency
+            if overloaded:
+                # Not again until the requests that were in flight at the
+                # last decrease have responded, as they are likely to be
+                # slow too: `concurrency` responses, at most `window`
+                if self._responses >= min(self.window, self.concurrency) or \
+                        self.decreases == 0:
+                    self._decrease(status)
+            elif self._responses >= self.window:
+                self._increase()
+
+    def _decrease(self, status):
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self.concurrency = max(1, int(self.concurrency * self.decrease))
+        self.decreases += 1
+        self._responses = 0
+        self.log.info(u"Slowing down to %.1f requests/s, %s in flight "
+                      u"(status %s, latency %.2f s, error rate %.2f)",
+                      self.rate, self.concurrency, status, self.latency,
+                      self.error_rate)
+
+    def _increase(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+        self._responses = 0
+        self._cond.notify_all()
+        self.log.debug(u"Speeding up to %.1f requests/s, %s in flight",
+                       self.rate, self.concurrency)
+
+    def as_dict(self):
+        """ The current state, eg to log
+        """
+        with self._cond:
+            return {
+                "rate": self.rate,
+                "concurrency": self.concurrency,
+                "in_flight": self.in_flight,
+                "latency": self.latency,
+                "error_rate": self.error_rate,
+                "decreases": self.decreases,
+            }
+
+    def __repr__(self):
+        return u"<AdaptiveRateLimiter: {:.1f} requests/s, {} in flight>"\
+            .format(self.rate, self.concurrency)
+
+
+def parse_retry_after(value):
+    """ Parse a Retry-After header, in seconds or as a date
+        :returns: seconds to wait, or None
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(),
+                   0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def imap_bounded(func, items, workers=1, ordered=True):
+    """ Apply `func` to every item, using a pool of `workers` threads.
+        Results are yielded as they complete, or in the order of `items`
+        if `ordered` is True. At most 2 x `workers` items are in flight at
+        any time, so long lists of queries are not all submitted up front.
+
+        imap_bounded(fetch, [url_a, url_b], workers=2) => res_a, res_b
+
+        :param func: a function taking one item
+        :param items: an iterable of items
+        :param workers: number of threads. 1 runs everything in the
+            calling thread.
+        :param ordered: keep the order of `items`
+    """
+    if workers is None or workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    items = iter(items)
+    max_in_flight = workers * 2
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < max_in_flight:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight.append(executor.submit(func, item))
+
+            if not in_flight:
+                break
+
+            if ordered:
+                future = in_flight.popleft()
+            else:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                future = [x for x in in_flight if x in done][0]
+                in_flight.remove(future)
+
+            try:
+                yield future.result()
+            except BaseException:
+                for pending in in_flight:
+                    pending.cancel()
+                raise
+
+
+class _Flight(object):
+    """ A call in flight, and its outcome
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Lets concurrent calls with the same key share one call. The first
+        caller makes the call, and the others wait for its result (or
+        exception). Once it has returned, the next call with the key is
+        made anew.
+
+        flights = SingleFlight()
+        flights.do(("GET", url), fetch, url)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        # Number of calls that were shared rather than made
+        self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """ Call `func(*args, **kwargs)`, unless a call with `key` is
+            already in flight, and return its result
+            :returns: (result, shared), where shared is True if the result
+                came from another caller's call
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.shared += 1
+
+        if not is_leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = func(*args, **kwargs)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
@@ -0,0 +1,354 @@
+# encoding: utf-8
+"""Export of query results to columnar files.
+
+Rows are written to Parquet or Arrow IPC files, partitioned by dataset,
+year and period in hive style directories:
+
+    vantetider/dataset=Overbelaggning/year=2018/period=Januari/part-00000.parquet
+
+Dimension columns are dictionary encoded, and values are float64, with a
+"missing" column for non-numeric values like in ColumnarResult. Partition
+columns are not stored in the files, but in the directory names.
+
+Rows are buffered per partition and written in batches, so memory use is
+bounded by `max_rows` whatever the size of the query:
+
+    dataset.export("vantetider", {"region": "*", "year": "*"})
+    df = read_export("vantetider", dataset="Overbelaggning")
+
+Files are written to a staging directory, and moved into place when the
+writer is closed. Each partition that is written replaces the partition of
+an earlier export, and the files of a coarser partitioning above it (eg
+"year=2018/part-00000.parquet" for "year=2018/period=Januari"). Other
+partitions are kept, so exporting 2018 after 2019 keeps both. If the export
+fails, nothing is replaced.
+
+Rows from elsewhere, eg `AsyncVantetiderScraper.iter_fetch`, can be written
+with an ExportWriter:
+
+    with ExportWriter("vantetider") as writer:
+        async for chunk in scraper.iter_fetch(dataset, query, chunk_size=1000):
+            writer.write(dataset.id, chunk)
+
+Parquet and Arrow need pyarrow. Without it rows are written as csv.
+"""
+import os
+import shutil
+import uuid
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+from .columnar import ColumnarResult, VALUE_KEY, MISSING_KEY
+
+try:
+    from urllib.parse import quote, unquote
+except ImportError:
+    from urllib import quote, unquote
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = ["parquet", "arrow", "csv"]
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+DATASET_KEY = "dataset"
+# Prefix of the directory that files are written to before they are moved
+# into place. Directories starting with a dot are not read.
+STAGING_PREFIX = ".tmp-"
+# Directory name of rows without a value of a partition column
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def get_default_format():
+    return "parquet" if pa is not None else "csv"
+
+
+def partition_dir(name, value):
+    """ "period", "Januari" => "period=Januari"
+    """
+    if value is None:
+        return u"{}={}".format(name, NULL_PARTITION)
+    return u"{}={}".format(name, quote(u"{}".format(value), safe=""))
+
+
+def parse_partition_dir(dirname):
+    """ "period=Januari" => ("period", "Januari")
+    """
+    name, value = dirname.split("=", 1)
+    if value == NULL_PARTITION:
+        return name, None
+    return name, unquote(value)
+
+
+class ExportWriter(object):
+    """ Writes rows to partitioned columnar files, in batches
+    """
+    def __init__(self, path, format=None, partition_by=("year", "period"),
+                 batch_size=100000, max_rows=500000, compression="snappy"):
+        """
+            :param path: directory to write to. Partitions that are written
+                to replace those of an earlier export, when the writer is
+                closed.
+            :param format: "parquet", "arrow" (Arrow IPC) or "csv". Defaults
+                to "parquet" if pyarrow is installed, else "csv".
+            :param partition_by: dimensions to partition by, after dataset
+            :param batch_size: rows of a partition to write at a time. Each
+                batch is a file.
+            :param max_rows: max number of rows to buffer, across
+                partitions. Once there are more, the largest partition is
+                written.
+            :param compression: compression of parquet files
+        """
+        if format is None:
+            format = get_default_format()
+        if format not in FORMATS:
+            raise ValueError(u"Unknown format: {}".format(format))
+        if format != "csv" and pa is None:
+            raise ImportError(u"Writing {} needs pyarrow".format(format))
+        self.path = path
+        self.format = format
+        self.partition_by = list(partition_by)
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.compression = compression
+
+        # Rows by partition, as (dataset id, partition values)
+        self._buffers = {}
+        self._n_buffered = 0
+        # Number of files written to each partition
+        self._parts = {}
+        self._staging = os.path.join(path, STAGING_PREFIX + uuid.uuid4().hex)
+        # Dimension columns of each dataset, in the order first seen
+        self._columns = {}
+        self.files = []
+        self.rows = 0
+
+    def write(self, dataset_id, rows):
+        """ Add rows
+            :param rows: statscraper Results, or dicts with a "value" key
+                like the rows of `dataset.iter_fetch()`
+        """
+        for row in rows:
+            if isinstance(row, dict):
+                dims = dict(row)
+                value = dims.pop(VALUE_KEY, None)
+            else:
+                value, dims = row.value, row.raw_dimensions
+            self.append(dataset_id, value, dims)
+
+    def append(self, dataset_id, value, dimensions):
+        """ Add a row, see ColumnarResult.append
+        """
+        key = (dataset_id,) + tuple(dimensions.get(x)
+                                    for x in self.partition_by)
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._buffers[key] = ColumnarResult()
+        buf.append(value, dict((k, v) for k, v in dimensions.items()
+                               if k not in self.partition_by))
+        self._n_buffered += 1
+
+        if len(buf) >= self.batch_size:
+            self.flush(key)
+        elif self._n_buffered > self.max_rows:
+            self.flush(max(self._buffers,
+                           key=lambda x: len(self._buffers[x])))
+
+    def flush(self, key=None):
+        """ Write the buffered rows of a partition, or of all partitions
+        """
+        keys = list(self._buffers) if key is None else [key]
+        for key in keys:
+            buf = self._buffers.pop(key)
+            self._n_buffered -= len(buf)
+            if len(buf):
+                self._write_part(key, buf)
+
+    def close(self):
+        """ Write the buffered rows, and move the written partitions into
+            place
+        """
+        self.flush()
+        trash = os.path.join(self._staging, "replaced")
+        for i, key in enumerate(sorted(self._parts, key=repr)):
+            dirname = self._get_dir(key)
+            # Files of a coarser partitioning, that hold rows of this one
+            parent = os.path.dirname(dirname)
+            while os.path.relpath(parent, self.path) != os.curdir:
+                for filename in glob(os.path.join(parent, "part-*")):
+                    os.remove(filename)
+                parent = os.path.dirname(parent)
+            if os.path.exists(dirname):
+                _move(dirname, os.path.join(trash, str(i)))
+            _move(self._get_dir(key, self._staging), dirname)
+        self.abort()
+
+    def abort(self):
+        """ Drop what has been written, and keep the earlier export
+        """
+        self._buffers = {}
+        self._n_buffered = 0
+        self._parts = {}
+        if os.path.exists(self._staging):
+            shutil.rmtree(self._staging)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _get_dir(self, key, path=None):
+        dataset_id, values = key[0], key[1:]
+        parts = [partition_dir(DATASET_KEY, dataset_id)]
+        parts += [partition_dir(name, value)
+                  for name, value in zip(self.partition_by, values)]
+        return os.path.join(self.path if path is None else path, *parts)
+
+    def _write_part(self, key, buf):
+        staging_dir = self._get_dir(key, self._staging)
+        n = self._parts.get(key, 0)
+        if n == 0:
+            os.makedirs(staging_dir)
+        self._parts[key] = n + 1
+
+        # Keep the columns of all files of a dataset the same, as far as
+        # they are known
+        columns = self._columns.setdefault(key[0], [])
+        for dim_id in buf.dimensions:
+            if dim_id not in columns:
+                columns.append(dim_id)
+
+        basename = u"part-{:05d}{}".format(n, EXTENSIONS[self.format])
+        filename = os.path.join(staging_dir, basename)
+        if self.format == "csv":
+            df = buf.pandas
+            for dim_id in columns:
+                if dim_id not in df:
+                    df[dim_id] = None
+            df[[VALUE_KEY, MISSING_KEY] + columns].to_csv(filename,
+                                                          index=False)
+        else:
+            table = to_arrow(buf, columns)
+            if self.format == "parquet":
+                pq.write_table(table, filename, compression=self.compression)
+            else:
+                with pa.OSFile(filename, "wb") as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+
+        self.files.append(os.path.join(self._get_dir(key), basename))
+        self.rows += len(buf)
+
+    def __repr__(self):
+        return u"<ExportWriter: {} ({}), {} rows in {} files>".format(
+            self.path, self.format, self.rows, len(self.files))
+
+
+def _move(src, dst):
+    parent = os.path.dirname(dst)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    os.replace(src, dst)
+
+
+def _dictionary_array(categorical):
+    """ A pandas Categorical as an arrow DictionaryArray
+    """
+    codes = np.asarray(categorical.codes, dtype=np.int32)
+    return pa.DictionaryArray.from_arrays(
+        pa.array(codes, type=pa.int32(), mask=codes < 0),
+        pa.array([u"{}".format(x) for x in categorical.categories],
+                 type=pa.string()))
+
+
+def to_arrow(result, columns=None):
+    """ A ColumnarResult as an arrow Table, with dictionary encoded
+        dimension columns
+        :param columns: dimension columns, in order. Columns that the
+            result does not have are null.
+    """
+    if columns is None:
+        columns = result.dimensions
+    arrays = [pa.array(result.values, type=pa.float64()),
+              _dictionary_array(result.missing)]
+    for dim_id in columns:
+        if dim_id in result.dimensions:
+            arrays.append(_dictionary_array(result.column(dim_id)))
+        else:
+            arrays.append(pa.nulls(len(result),
+                                   pa.dictionary(pa.int32(), pa.string())))
+    return pa.Table.from_arrays(arrays,
+                                names=[VALUE_KEY, MISSING_KEY] + list(columns))
+
+
+def _iter_parts(path):
+    """ Yield (filename, {partition column: value}) of the files of an
+        export
+    """
+    for dirpath, dirnames, filenames in os.walk(path):
+        # Not the staging directories of exports, see ExportWriter
+        dirnames[:] = sorted(x for x in dirnames if not x.startswith("."))
+        partitions = dict(parse_partition_dir(x) for x
+                          in os.path.relpath(dirpath, path).split(os.sep)
+                          if "=" in x)
+        for filename in sorted(filenames):
+            if filename.startswith("part-"):
+                yield os.path.join(dirpath, filename), partitions
+
+
+def read_export(path, dataset=None):
+    """ Load an export into a DataFrame, with partition and dimension
+        columns as categoricals
+
+        :param path: directory of the export
+        :param dataset: id of a dataset to load, by default all
+    """
+    if dataset is not None:
+        path = os.path.join(path, partition_dir(DATASET_KEY, dataset))
+    parts = list(_iter_parts(path))
+    if not parts:
+        return pd.DataFrame(columns=[VALUE_KEY, MISSING_KEY])
+
+    if parts[0][0].endswith(EXTENSIONS["csv"]):
+        frames = []
+        for filename, partitions in parts:
+            df = pd.read_csv(filename, dtype=object, keep_default_na=False,
+                             na_values=[""])
+            df[VALUE_KEY] = df[VALUE_KEY].astype(np.float64)
+            for name, value in partitions.items():
+                df[name] = value
+            frames.append(df)
+        df = pd.concat(frames, ignore_index=True, sort=False)
+        for column in df.columns:
+            if column != VALUE_KEY:
+                df[column] = df[column].astype("category")
+        return df
+
+    if pa is None:
+        raise ImportError(u"Reading {} needs pyarrow".format(parts[0][0]))
+    tables = []
+    for filename, partitions in parts:
+        if filename.endswith(EXTENSIONS["parquet"]):
+            table = pq.read_table(filename)
+        else:
+            with pa.OSFile(filename, "rb") as source:
+                table = pa.ipc.open_file(source).read_all()
+        for name, value in sorted(partitions.items()):
+            table = table.append_column(name, pa.DictionaryArray.from_arrays(
+                pa.array(np.zeros(len(table), dtype=np.int32)),
+                pa.array([value], type=pa.string())))
+        tables.append(table)
+    try:
+        table = pa.concat_tables(tables, promote_options="default")
+    except TypeError:
+        # pyarrow < 14
+        table = pa.concat_tables(tables, promote=True)
+    return table.to_pandas()
@@ -0,0 +1,464 @@
+# encoding: utf-8
+"""Extract the data table and form state of a result page in one pass.
+
+Datatable builds a BeautifulSoup tree of the whole page and then runs many
+selects per row. ExtractedPage instead reads the page with an event driven
+parser (html.parser.HTMLParser), and keeps only what is needed: the cells
+of the data tables, the ids of regions and units (from
+"handle_click_event_landsting(this, 27)") and the options of the form.
+It gives the same rows as Datatable and the same selection as
+VantetiderDataset._get_current_selection.
+
+    page = ExtractedPage(html)
+    page.layout  # "tabs", "vertical_scroll" or "regular"
+    rows = list(page)
+
+If the page does not look like any of the known layouts, ExtractError is
+raised and the scraper falls back to BeautifulSoup.
+"""
+import re
+
+from .parsing import Sheet, parse_text, parse_values, parse_landsting
+
+try:
+    from html.parser import HTMLParser
+    # HTMLParser raises AssertionError on some malformed markup
+    PARSE_ERRORS = (UnicodeDecodeError, AssertionError)
+except ImportError:
+    from HTMLParser import HTMLParser, HTMLParseError
+    PARSE_ERRORS = (UnicodeDecodeError, AssertionError, HTMLParseError)
+
+# Elements without end tags
+VOID_ELEMENTS = set(["area", "base", "br", "col", "embed", "hr", "img",
+                     "input", "link", "meta", "param", "source", "track",
+                     "wbr"])
+
+# Classes (and ids) that mark parts of the data tables. See
+# Datatable._parse_*_table for how they are used.
+CONTEXT_CLASSES = {
+    "DTFC_LeftBodyWrapper": "left",
+    "dataTables_scrollHead": "head",
+    "dataTables_scrollBody": "body",
+}
+
+
+class ExtractError(ValueError):
+    pass
+
+
+class _Block(object):
+    """ An element holding a data table: ".chart.table.scrolling",
+        ".dataTables_wrapper" or "#DataTables_Table_0_wrapper"
+    """
+    def __init__(self, kind):
+        self.kind = kind
+        # (text, in scroll head)
+        self.ths = []
+        self.rows = []
+
+
+class _Row(object):
+    def __init__(self, context):
+        self.text = []
+        # Cell texts, as lists of strings
+        self.cells = []
+        self.in_tbody = context["tbody"] > 0
+        self.in_left = context["left"] > 0
+        self.in_body = context["body"] > 0
+        self.has_clickable = False
+        self.onclick = None
+
+
+class PageParser(HTMLParser):
+    """ Collects table blocks, rows, cells and form fields of a page
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        # [(tag, on_close)]
+        self._stack = []
+        self._collectors = []
+        self._blocks = []
+        self._context = {"left": 0, "head": 0, "body": 0, "tbody": 0,
+                         "td": 0, "switch": 0}
+        self._row = None
+        self._select = None
+
+        self.blocks = []
+        # [[li text, .visible_normal text or None]]
+        self.tabs = []
+        self.has_tabs = False
+        self.has_horizontal_scroll = False
+        self.has_vertical_scroll = False
+        # {name: [[(value, text, selected)]]}, options of each select
+        self.selects = {}
+        # {name: [attrs]}, radio and checkbox inputs
+        self.inputs = {}
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "input":
+            name = attrs.get("name")
+            if name is not None:
+                self.inputs.setdefault(name, []).append(attrs)
+            return
+        if tag in VOID_ELEMENTS:
+            return
+
+        closers = []
+        classes = (attrs.get("class") or u"").split()
+        elem_id = attrs.get("id")
+
+        if classes or elem_id:
+            self._start_classes(classes, elem_id, closers)
+
+        if tag == "tbody":
+            self._enter("tbody", closers)
+        elif tag == "tr":
+            self._start_row(closers)
+        elif tag == "td":
+            self._enter("td", closers)
+            if self._row is not None:
+                cell = []
+                self._row.cells.append(cell)
+                self._collect(cell, closers)
+        elif tag == "th":
+            text = []
+            self._collect(text, closers)
+            in_head = self._context["head"] > 0
+            for block in self._blocks:
+                block.ths.append((text, in_head))
+        elif tag == "li" and self._context["switch"] > 0:
+            tab = [[], None]
+            self.tabs.append(tab)
+            self._collect(tab[0], closers)
+        elif tag == "select":
+            self._start_select(attrs.get("name"), closers)
+        elif tag == "option" and self._select is not None:
+            text = []
+            self._select.append((attrs.get("value"), text,
+                                 "selected" in attrs))
+            self._collect(text, closers)
+
+        if "clickable" in classes and self._context["td"] > 0 and \
+                self._row is not None and not self._row.has_clickable:
+            self._row.has_clickable = True
+            self._row.onclick = attrs.get("onclick")
+
+        self._stack.append((tag, closers))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # Like BeautifulSoup: close the latest open element of this tag and
+        # everything opened after it. End tags of elements that are not open
+        # are ignored.
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i][0] == tag:
+                break
+        else:
+            return
+        while len(self._stack) > i:
+            for close in reversed(self._stack.pop()[1]):
+                close()
+
+    def handle_data(self, data):
+        for collector in self._collectors:
+            collector.append(data)
+
+    def _enter(self, context, closers):
+        self._context[context] += 1
+
+        def _close():
+            self._context[context] -= 1
+        closers.append(_close)
+
+    def _collect(self, text, closers):
+        # Elements are closed in reverse order, so the last collector is
+        # the one of the element being closed
+        self._collectors.append(text)
+        closers.append(self._collectors.pop)
+
+    def _start_classes(self, classes, elem_id, closers):
+        if "table_switch" in classes:
+            self.has_tabs = True
+            self._enter("switch", closers)
+        if "DTFC_ScrollWrapper" in classes:
+            self.has_horizontal_scroll = True
+        if elem_id == "DataTables_Table_0_wrapper":
+            self.has_vertical_scroll = True
+            self._start_block("vertical", closers)
+        if "dataTables_wrapper" in classes:
+            self._start_block("wrapper", closers)
+        if "chart" in classes and "table" in classes and \
+                "scrolling" in classes:
+            self._start_block("regular", closers)
+        if "visible_normal" in classes and self.tabs:
+            # The text of a tab, without the short version
+            text = []
+            self.tabs[-1][1] = text
+            self._collect(text, closers)
+        for cls, context in CONTEXT_CLASSES.items():
+            if cls in classes:
+                self._enter(context, closers)
+
+    def _start_block(self, kind, closers):
+        block = _Block(kind)
+        self.blocks.append(block)
+        self._blocks.append(block)
+        closers.append(self._blocks.pop)
+
+    def _start_row(self, closers):
+        row = _Row(self._context)
+        parent = self._row
+        self._row = row
+        for block in self._blocks:
+            block.rows.append(row)
+        self._collect(row.text, closers)
+
+        def _close():
+            self._row = parent
+        closers.append(_close)
+
+    def _start_select(self, name, closers):
+        options = []
+        self.selects.setdefault(name, []).append(options)
+        self._select = options
+
+        def _close():
+            self._select = None
+        closers.append(_close)
+
+    def feed_page(self, html):
+        """ Read a page
+            :raises ExtractError: if the page can not be decoded or parsed
+        """
+        try:
+            if isinstance(html, bytes):
+                html = html.decode("utf-8")
+            self.feed(html)
+            self.close()
+        except PARSE_ERRORS as e:
+            raise ExtractError(u"Unable to parse page: {}".format(e))
+
+
+def _text(parts):
+    return u"".join(parts)
+
+
+class ExtractedPage(object):
+    """ A result page, read with PageParser
+    """
+    def __init__(self, html):
+        """
+            :param html: html of a result page
+        """
+        parser = PageParser()
+        parser.feed_page(html)
+        self._parser = parser
+        self.has_tabs = parser.has_tabs
+        self.has_horizontal_scroll = parser.has_horizontal_scroll
+        self.has_vertical_scroll = parser.has_vertical_scroll
+        self._data = None
+
+    @property
+    def layout(self):
+        """ :returns: "tabs"|"vertical_scroll"|"regular", see
+            ResultPage.layout
+        """
+        if self.has_tabs:
+            return "tabs"
+        elif self.has_vertical_scroll:
+            return "vertical_scroll"
+        else:
+            return "regular"
+
+    def _get_sheets(self):
+        """ Get (measure, Sheet) of the data tables. Measure is None if the
+            measures are the columns.
+        """
+        blocks = self._parser.blocks
+        if self.has_tabs:
+            if not self.has_horizontal_scroll:
+                raise ExtractError(u"Tabs without horizontal scroll")
+            measures = [_text(visible) if visible is not None else _text(li)
+                        for li, visible in self._parser.tabs]
+            tables = [x for x in blocks if x.kind == "wrapper"]
+            if len(tables) != len(measures) or len(tables) == 0:
+                raise ExtractError(u"Found {} tabs and {} tables".format(
+                    len(measures), len(tables)))
+            return [(measure, self._get_horizontal_scroll_sheet(table))
+                    for measure, table in zip(measures, tables)]
+
+        if self.has_horizontal_scroll:
+            raise ExtractError(u"Horizontal scroll without tabs")
+        if self.has_vertical_scroll:
+            table = [x for x in blocks if x.kind == "vertical"][0]
+            cols = [parse_text(_text(text)) for text, in_head in table.ths
+                    if in_head][1:]
+        else:
+            tables = [x for x in blocks if x.kind == "regular"]
+            if not tables:
+                raise ExtractError(u"No data table found")
+            table = tables[-1]
+            cols = [parse_text(_text(text)) for text, in_head in table.ths][1:]
+        rows = [x for x in table.rows if x.in_tbody]
+        if any(not row.cells for row in rows):
+            raise ExtractError(u"Rows without cells")
+        labels = [parse_text(_text(x.cells[0])) for x in rows]
+        return [(None, self._get_sheet(rows, labels, cols,
+                                       [x.cells[1:] for x in rows]))]
+
+    def _get_horizontal_scroll_sheet(self, table):
+        label_rows = [x for x in table.rows if x.in_left and x.in_tbody]
+        labels = [parse_text(_text(x.text)) for x in label_rows]
+        cols = [parse_text(_text(text)) for text, in_head in table.ths
+                if in_head]
+        value_rows = [x for x in table.rows if x.in_body and x.in_tbody]
+        return self._get_sheet(label_rows, labels, cols,
+                               [x.cells for x in value_rows])
+
+    def _get_sheet(self, rows, labels, cols, cells):
+        ids = [None] * len(labels)
+        if any(x.has_clickable for x in rows):
+            if not all(x.has_clickable and x.onclick for x in rows):
+                raise ExtractError(u"Rows without ids")
+            ids = [parse_landsting(x.onclick) for x in rows]
+        n_cols = len(cells[0]) if cells else 0
+        if any(len(row) != n_cols for row in cells):
+            raise ExtractError(u"Table rows have different number of cells")
+        values, missing = parse_values([_text(cell) for row in cells
+                                        for cell in row])
+        try:
+            return Sheet(zip(ids, labels), cols,
+                         values.reshape(len(cells), n_cols),
+                         missing.reshape(len(cells), n_cols))
+        except ValueError as e:
+            raise ExtractError(str(e))
+
+    def _get_rows(self):
+        rows = []
+        for measure, sheet in self._get_sheets():
+            if measure is None:
+                for region, col, value in sheet.long_format:
+                    rows.append({
+                        "region_or_unit": region,
+                        "measure": col,
+                        "value": value,
+                    })
+            else:
+                for region, col, value in sheet.long_format:
+                    rows.append({
+                        "region_or_unit": region,
+                        # Tabs have a column per period
+                        "period": col,
+                        "measure": measure,
+                        "value": value,
+                    })
+        return rows
+
+    @property
+    def data(self):
+        """ All rows of the tables as a list of dicts, like Datatable.data
+            :raises ExtractError: if the tables can not be read
+        """
+        if self._data is None:
+            self._data = self._get_rows()
+        return self._data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def get_options(self, elem_id, elem_type):
+        """ Get the options of all form fields with a name
+            :param elem_type: "select" or "radio"
+            :returns: [(value, label, selected)]
+        """
+        if elem_type == "select":
+            options = []
+            for select in self._parser.selects.get(elem_id, []):
+                options += [_get_option(x) for x in select]
+            return options
+        return _get_radio_options(self._parser.inputs.get(elem_id, []))
+
+    def get_current_selection(self, dimensions):
+        """ Get the selected form values, like
+            VantetiderDataset._get_current_selection
+            :returns: {dim_id: (selected_id, selected_label)}
+        """
+        current_selection = {}
+        for dim in dimensions:
+            if dim.id in ["measure", "unit_id"]:
+                continue
+
+            if dim.elem_type == "select":
+                selects = self._parser.selects.get(dim.elem_id)
+                if not selects or not selects[0]:
+                    raise ExtractError(u"No options of {}".format(dim.elem_id))
+                options = selects[0]
+                selected = [x for x in options if x[2]] or options
+                selected_id, selected_label, _ = _get_option(selected[0])
+                current_selection[dim.id] = (selected_id, selected_label)
+
+            elif dim.elem_type == "radio":
+                selected_cat, selected_label = None, None
+                for (_id, label, checked) in _get_radio_options(
+                        self._parser.inputs.get(dim.elem_id, [])):
+                    if checked:
+                        selected_cat = _id
+                        selected_label = label
+                if selected_cat is None:
+                    raise ExtractError(u"No checked {}".format(dim.elem_id))
+                current_selection[dim.id] = (selected_cat, selected_label)
+
+            elif dim.elem_type == "checkbox":
+                inputs = self._parser.inputs.get(dim.elem_id)
+                if not inputs:
+                    raise ExtractError(u"No input {}".format(dim.elem_id))
+                checked = "checked" in inputs[0]
+                current_selection[dim.id] = (checked, checked)
+
+            else:
+                raise ExtractError(u"Unknown element type: {}".format(
+                    dim.elem_type))
+
+        return current_selection
+
+
+def _get_option(option):
+    """ (value, text, selected) of an option, like parse_select_options
+    """
+    value, text, selected = option
+    label = _text(text).strip()
+    if value is None:
+        value = label
+    if value == u"":
+        raise ExtractError(u"Option without value: {}".format(label))
+    return (value, label, selected)
+
+
+def _get_radio_options(inputs):
+    """ [(value, id, checked)] of radio inputs, like parse_radio_inputs
+    """
+    data = []
+    for attrs in inputs:
+        if attrs.get("type") != "radio":
+            continue
+        value = re.match(r"\w+", attrs.get("value") or u"")
+        _id = re.match(r"\w+", attrs.get("id") or u"")
+        if value is None or _id is None:
+            raise ExtractError(u"Unable to parse radio input {}".format(attrs))
+        if value.group() not in [x[0] for x in data]:
+            data.append((value.group(), _id.group(), "checked" in attrs))
+    return data
+
+
+def extract_page(html):
+    """ Read a result page, or raise ExtractError
+        :returns: an ExtractedPage, with its rows read
+    """
+    page = ExtractedPage(html)
+    page.data
+    return page
@@ -0,0 +1,583 @@
+# encoding: utf-8
+"""Resumable bulk harvesting of datasets to a sqlite database.
+
+Every result page is saved together with a checkpoint, so an interrupted
+harvest picks up where it stopped. Rows are upserted on their dimensions,
+so re-fetched pages never give duplicates.
+
+    python -m vantetider.harvest Overbelaggning --db vantetider.db \\
+        -q region=* -q year=* -q period=* -q type_of_overbelaggning=0,1
+
+All implemented datasets, four at a time, at most 5 requests per second:
+
+    python -m vantetider.harvest --processes 4 --rate-limit 5 -q region=*
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from requests.exceptions import HTTPError
+
+from .cache import canonical_payload, BACKENDS
+from .concurrency import imap_bounded, ProcessRateLimiter
+from .logs import ProgressLog
+from .planner import QueryPlan
+from .scraper import VantetiderScraper
+from .stats import Stats
+
+# Dimensions that are not part of the natural key of a row
+NOT_KEY_DIMS = ["value", "unit"]
+ALL = "*"
+
+
+class HarvestStore(object):
+    """ A sqlite database with one table of rows per dataset and a table of
+        completed queries.
+    """
+    def __init__(self, path="vantetider.db"):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS _checkpoints (
+            dataset TEXT,
+            query TEXT,
+            rows INTEGER,
+            completed REAL,
+            PRIMARY KEY (dataset, query))""")
+        self.conn.commit()
+        self._columns = {}
+
+    def _get_columns(self, table):
+        if table not in self._columns:
+            cursor = self.conn.execute(u'PRAGMA table_info("{}")'.format(table))
+            self._columns[table] = [x[1] for x in cursor.fetchall()]
+        return self._columns[table]
+
+    def _ensure_columns(self, table, columns):
+        """ Create the table of a dataset and add missing columns
+        """
+        existing = self._get_columns(table)
+        if len(existing) == 0:
+            self.conn.execute(u'CREATE TABLE "{}" ("_key" TEXT PRIMARY KEY, "value")'
+                              .format(table))
+            existing.extend(["_key", "value"])
+        for column in columns:
+            if column not in existing:
+                self.conn.execute(u'ALTER TABLE "{}" ADD COLUMN "{}"'
+                                  .format(table, column))
+                existing.append(column)
+
+    def completed(self, dataset_id):
+        """ :returns: a set of the completed queries of a dataset
+        """
+        cursor = self.conn.execute(
+            "SELECT query FROM _checkpoints WHERE dataset = ?", (dataset_id,))
+        return set(x[0] for x in cursor.fetchall())
+
+    def save(self, dataset_id, query_key, rows):
+        """ Upsert the rows of a result page and mark the query as completed,
+            in one transaction.
+
+            :param query_key: key of the query, or {key: number of rows} of
+                all queries that the page stands for, see get_query_keys
+        """
+        if isinstance(query_key, dict):
+            checkpoints = query_key
+        else:
+            checkpoints = {query_key: len(rows)}
+        columns = []
+        for row in rows:
+            for key in row:
+                if key not in columns:
+                    columns.append(key)
+
+        with self.conn:
+            self._ensure_columns(dataset_id, columns)
+            for row in rows:
+                keys = ["_key"] + list(row.keys())
+                sql = u'INSERT OR REPLACE INTO "{}" ({}) VALUES ({})'.format(
+                    dataset_id,
+                    u", ".join(u'"{}"'.format(x) for x in keys),
+                    u", ".join(["?"] * len(keys)))
+                self.conn.execute(sql, [get_row_key(row)] + list(row.values()))
+            now = time.time()
+            for key, n_rows in checkpoints.items():
+                self.conn.execute(
+                    """INSERT OR REPLACE INTO _checkpoints
+                       (dataset, query, rows, completed) VALUES (?, ?, ?, ?)""",
+                    (dataset_id, key, n_rows, now))
+
+    def rows(self, dataset_id):
+        """ Yield the stored rows of a dataset as dicts
+        """
+        if not self._get_columns(dataset_id):
+            return
+        cursor = self.conn.execute(u'SELECT * FROM "{}"'.format(dataset_id))
+        columns = [x[0] for x in cursor.description]
+        for values in cursor:
+            row = dict(zip(columns, values))
+            row.pop("_key")
+            yield row
+
+    def reset(self, dataset_id):
+        """ Forget the completed queries of a dataset. Stored rows are kept.
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM _checkpoints WHERE dataset = ?",
+                              (dataset_id,))
+
+
+def get_row_key(row):
+    """ Get the natural key of a row: a hash of all its dimensions
+    """
+    dims = sorted((k, u"{}".format(v)) for k, v in row.items()
+                  if k not in NOT_KEY_DIMS)
+    return hashlib.sha1(json.dumps(dims).encode("utf-8")).hexdigest()
+
+
+def get_query_key(dataset, url, payload, keep=None):
+    """ Identify the query of a result page, eg
+        "Blekinges select_period=Mars&select_region=27&select_year=2017"
+
+        :param keep: the rows kept from the page by a planned request, see
+            vantetider.planner.PlannedRequest
+    """
+    _, region_slug, normalized = dataset._get_result_page_key(url, payload)
+    key = u"{} {}".format(region_slug, canonical_payload(normalized))
+    if keep:
+        key += u" keep={}".format(canonical_payload(
+            dict((k, u"|".join(v)) for k, v in keep.items())))
+    return key
+
+
+def get_query_keys(dataset, plan, request):
+    """ Identify the queries that a planned request stands for, one per
+        combination of its collapsed values (see QueryPlan.split). Keys do
+        not depend on how requests were collapsed, so a page harvested for
+        a year and all periods counts as done for update() of one period.
+
+        :returns: [(key, split request)]
+    """
+    return [(get_query_key(dataset, x.url, x.payload, x.keep), x)
+            for x in plan.split(request)]
+
+
+def expand_query(dataset, query):
+    """ Replace "*" with all allowed values of a dimension
+        {"year": "*"} => {"year": ["2019", "2018", ...]}
+    """
+    expanded = {}
+    for dim_id, values in (query or {}).items():
+        if values == ALL or values == [ALL]:
+            dim = dataset.dimensions[dim_id]
+            values = [x.value for x in dim.allowed_values]
+            if len(values) == 0 and hasattr(dim, "options"):
+                # Allowed values are not implemented for all dimensions
+                values = [x[0] for x in dim.options]
+        expanded[dim_id] = values
+    return expanded
+
+
+def harvest(dataset, query=None, store="vantetider.db", workers=None,
+            resume=True, progress=None):
+    """ Fetch a query one result page at a time, saving the rows and a
+        checkpoint after each page. Pages completed in an earlier run are
+        skipped. Pages that the server fails to render are left for the
+        next run.
+
+        :param dataset: a VantetiderDataset
+        :param query: a query as passed to `fetch`. "*" means all allowed
+            values of a dimension.
+        :param store: a HarvestStore, or a path to a sqlite file
+        :param workers: number of concurrent queries, defaults to the
+            workers of the scraper
+        :param resume: skip queries completed in earlier runs
+        :param progress: a function called with (dataset id, status) after
+            each page
+        :returns: a dict with the number of "pages", "skipped", "fetched",
+            "failed" pages and saved "rows"
+    """
+    if not isinstance(store, HarvestStore):
+        store = HarvestStore(store)
+    if dataset.scraper.current_item is not dataset:
+        dataset._move_here()
+
+    query = expand_query(dataset, query)
+    plan = QueryPlan(dataset, query)
+    jobs = [(plan, request) for request in plan.requests]
+    return _harvest_jobs(dataset, jobs, store, workers=workers, resume=resume,
+                         progress=progress)
+
+
+def update(dataset, query=None, store="vantetider.db", lookback=2,
+           workers=None, progress=None):
+    """ Fetch the year/periods that are published on the site but missing
+        in the store, and re-fetch the `lookback` latest ones, which may
+        have been revised. Completed older periods cost no requests.
+
+        :param dataset: a VantetiderDataset
+        :param query: values of other dimensions than year and period to
+            query by. "*" means all allowed values.
+        :param store: a HarvestStore, or a path to a sqlite file
+        :param lookback: number of latest year/periods to always re-fetch
+        :param workers: number of concurrent queries
+        :param progress: see harvest()
+        :returns: a dict with the number of "pages", "skipped", "fetched",
+            "failed" pages and saved "rows"
+    """
+    if not isinstance(store, HarvestStore):
+        store = HarvestStore(store)
+    if dataset.scraper.current_item is not dataset:
+        dataset._move_here()
+
+    query = expand_query(dataset, query)
+    for dim_id in ["year", "period"]:
+        query.pop(dim_id, None)
+
+    timepoints = get_timepoints(dataset)
+    if not timepoints:
+        dataset.scraper.log.warning(u"No timepoints of %s up to %s, nothing "
+                                    u"to update", dataset.id,
+                                    dataset.latest_timepoint)
+        return _harvest_jobs(dataset, [], store)
+    n_older = max(len(timepoints) - lookback, 0)
+    dataset.scraper.log.info(u"Latest timepoint of %s is %s, re-fetching %s",
+                             dataset.id, timepoints[-1], timepoints[n_older:])
+
+    def _get_jobs(timepoints):
+        # One plan per year, so that pages with a column per period are
+        # requested once
+        periods_by_year = OrderedDict()
+        for timepoint in timepoints:
+            periods = periods_by_year.setdefault(timepoint["year"], [])
+            if "period" in timepoint:
+                periods.append(timepoint["period"])
+        jobs = []
+        for year, periods in periods_by_year.items():
+            _query = dict(query, year=year)
+            if periods:
+                _query["period"] = periods
+            plan = QueryPlan(dataset, _query)
+            jobs += [(plan, request) for request in plan.requests]
+        return jobs
+
+    status = _harvest_jobs(dataset, _get_jobs(timepoints[:n_older]), store,
+                           workers=workers, resume=True, progress=progress)
+    revised = _harvest_jobs(dataset, _get_jobs(timepoints[n_older:]), store,
+                            workers=workers, resume=False, refresh=True,
+                            progress=progress)
+    for key in status:
+        status[key] += revised[key]
+    return status
+
+
+def get_timepoints(dataset):
+    """ Get all year/periods of a dataset up to its latest timepoint, oldest
+        first. Periods are ordered as in the form of the dataset.
+        => [{"year": "2019", "period": "Januari"}, ...]
+    """
+    latest = dataset.latest_timepoint
+    years = sorted(x[0] for x in dataset.dimensions["year"].options)
+    years = [x for x in years if x <= latest["year"]]
+    if "period" not in dataset.dimensions:
+        return [{"year": x} for x in years]
+
+    periods = [x[0] for x in dataset.dimensions["period"].options]
+    timepoints = []
+    for year in years:
+        for period in periods:
+            timepoints.append({"year": year, "period": period})
+            if year == latest["year"] and period == latest["period"]:
+                return timepoints
+    return timepoints
+
+
+def _harvest_jobs(dataset, jobs, store, workers=None, resume=True,
+                  refresh=False, progress=None):
+    """ Fetch and save result pages
+
+        :param jobs: a list of (QueryPlan, PlannedRequest)
+        :param resume: skip queries completed in earlier runs
+        :param refresh: bypass the http cache
+        :param progress: see harvest()
+    """
+    scraper = dataset.scraper
+    if workers is None:
+        workers = scraper.workers
+    completed = store.completed(dataset.id) if resume else set()
+
+    todo = []
+    for plan, request in jobs:
+        keys = get_query_keys(dataset, plan, request)
+        if any(key not in completed for key, _ in keys):
+            todo.append((keys, plan, request))
+
+    status = {
+        "pages": len(jobs),
+        "skipped": len(jobs) - len(todo),
+        "fetched": 0,
+        "failed": 0,
+        "rows": 0,
+    }
+    scraper.log.info(u"Harvesting %s pages of %s, %s already completed",
+                     len(jobs), dataset.id, status["skipped"])
+
+    def _get_page(url, payload):
+        return dataset._parse_result_page(url, payload,
+                                          region=payload["select_region"],
+                                          skip_errors=False, refresh=refresh)
+
+    def _run(job):
+        keys, plan, request = job
+        try:
+            results = list(plan.iter_results(request, _get_page))
+        except HTTPError as e:
+            if e.response is not None and e.response.status_code == 500:
+                scraper.log.warning(u"Unable to get %s with %s, will retry on next run",
+                                    request.url, request.payload)
+                return None, None
+            raise
+        checkpoints = OrderedDict(
+            (key, len(list(plan.filter_results(split, results))))
+            for key, split in keys)
+        return checkpoints, [dict(x.raw_dimensions, value=x.value)
+                             for x in results]
+
+    progress_log = ProgressLog(scraper.log, scraper.progress_interval)
+    for checkpoints, rows in imap_bounded(_run, todo, workers=workers,
+                                          ordered=False):
+        if rows is None:
+            status["failed"] += 1
+        else:
+            store.save(dataset.id, checkpoints, rows)
+            status["fetched"] += 1
+            status["rows"] += len(rows)
+            scraper.log.debug(u"Saved %s rows (%s/%s pages)", len(rows),
+                              status["fetched"] + status["failed"], len(todo))
+        progress_log.update(u"%s: %s/%s pages, %s rows", dataset.id,
+                            status["fetched"] + status["failed"], len(todo),
+                            status["rows"])
+        if progress is not None:
+            progress(dataset.id, dict(status))
+    progress_log.update(u"%s: done, %s pages fetched, %s failed, %s rows",
+                        dataset.id, status["fetched"], status["failed"],
+                        status["rows"], force=True)
+
+    return status
+
+
+# Set in each worker process of harvest_all()
+_worker_rate_limiter = None
+_worker_progress_queue = None
+
+
+def _init_worker(rate_limiter, progress_queue):
+    global _worker_rate_limiter, _worker_progress_queue
+    _worker_rate_limiter = rate_limiter
+    _worker_progress_queue = progress_queue
+
+
+def _harvest_dataset(dataset_id, query, store, mode, lookback, scraper_kwargs):
+    """ Harvest one dataset in a worker process of harvest_all()
+        :returns: (status, stats of the scraper as a dict)
+    """
+    def _progress(dataset_id, status):
+        _worker_progress_queue.put((dataset_id, status))
+
+    # Progress is logged by the parent process
+    scraper = VantetiderScraper(rate_limit=_worker_rate_limiter,
+                                progress_interval=None, **scraper_kwargs)
+    dataset = scraper.get(dataset_id)
+    # Datasets have different dimensions
+    query = dict((k, v) for k, v in (query or {}).items()
+                 if k in dataset.dimensions)
+    if mode == "update":
+        status = update(dataset, query, store=store, lookback=lookback,
+                        progress=_progress)
+    else:
+        status = harvest(dataset, query, store=store, progress=_progress)
+    return status, scraper.stats.as_dict()
+
+
+def harvest_all(datasets=None, query=None, store="vantetider.db",
+                processes=None, rate_limit=None, mode="harvest", lookback=2,
+                progress_interval=10, stats=None, **scraper_kwargs):
+    """ Harvest several datasets at once, one dataset per process, so that
+        parsing is spread over all cores. All processes share one rate
+        limit. Rows end up in one table per dataset in the store.
+
+        :param datasets: ids of datasets. Defaults to all implemented
+            datasets.
+        :param query: a query. Dimensions that a dataset does not have are
+            ignored for that dataset. "*" means all allowed values.
+        :param store: path to a sqlite file
+        :param processes: number of processes, defaults to number of cores
+        :param rate_limit: max requests per second, across all processes
+        :param mode: "harvest" or "update", see harvest() and update()
+        :param lookback: see update()
+        :param progress_interval: log progress of each dataset this often,
+            in seconds
+        :param stats: a Stats to add the stats of all processes to. See
+            vantetider.stats
+        :param scraper_kwargs: passed to each VantetiderScraper, eg workers.
+            A `metadata` snapshot is checked against the site here, or made
+            here if none is given, and passed to the workers.
+        :returns: {dataset id: status}
+    """
+    scraper = VantetiderScraper(**scraper_kwargs)
+    if datasets is None:
+        datasets = [x.id for x in scraper.items]
+    # Workers start from a snapshot, checked here once, without fetching
+    # the start and landing pages again
+    for dataset_id in datasets:
+        scraper.move_to_top()
+        scraper.get(dataset_id)._check_metadata()
+    snapshot = scraper.export_metadata(datasets=datasets)
+    snapshot["datasets"] = [dict(x, checked=True)
+                            for x in snapshot["datasets"]]
+    scraper_kwargs = dict(scraper_kwargs, metadata=snapshot)
+    # Create tables for checkpoints before processes start writing
+    HarvestStore(store)
+
+    rate_limiter = ProcessRateLimiter(rate_limit)
+    progress_queue = multiprocessing.Queue()
+    latest = {}
+    statuses = {}
+
+    def _log_progress():
+        while not progress_queue.empty():
+            dataset_id, status = progress_queue.get()
+            latest[dataset_id] = status
+        for dataset_id, status in sorted(latest.items()):
+            scraper.log.info(u"%s: %s/%s pages, %s rows", dataset_id,
+                             status["skipped"] + status["fetched"] + status["failed"],
+                             status["pages"], status["rows"])
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(rate_limiter, progress_queue)) as executor:
+        futures = dict((executor.submit(_harvest_dataset, dataset_id, query,
+                                        store, mode, lookback, scraper_kwargs),
+                        dataset_id)
+                       for dataset_id in datasets)
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=progress_interval)
+            for future in done:
+                status, worker_stats = future.result()
+                statuses[futures[future]] = status
+                if stats is not None:
+                    stats.merge(worker_stats)
+            _log_progress()
+
+    return statuses
+
+
+def parse_query_args(args):
+    """ ["year=2018,2019", "region=*"] => {"year": ["2018", "2019"], "region": "*"}
+    """
+    query = {}
+    for arg in args:
+        try:
+            dim_id, values = arg.split("=", 1)
+        except ValueError:
+            raise ValueError(u"Invalid query: {}. Use DIM=VALUE[,VALUE]".format(arg))
+        if values == ALL:
+            query[dim_id] = ALL
+        else:
+            query[dim_id] = values.split(",")
+    return query
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Harvest datasets from vantetider.se to a sqlite "
+                    "database. An interrupted harvest is resumed when run "
+                    "again with the same arguments.")
+    parser.add_argument("datasets", nargs="*",
+                        help="Ids of datasets, eg Overbelaggning. All "
+                             "implemented datasets if none are given.")
+    parser.add_argument("-q", "--query", action="append", default=[],
+                        metavar="DIM=VALUES",
+                        help="Values to query by, eg year=2018,2019. "
+                             "Use DIM=* for all values.")
+    parser.add_argument("--db", default="vantetider.db",
+                        help="sqlite file to store rows and checkpoint in")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Concurrent queries per dataset")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Harvest several datasets at once in this "
+                             "many processes")
+    parser.add_argument("--rate-limit", type=float, default=None,
+                        help="Max requests per second")
+    parser.add_argument("--cache", default="memory",
+                        choices=BACKENDS + ["none"])
+    parser.add_argument("--cache-path", default=None)
+    parser.add_argument("--metadata", default=None,
+                        help="Start from this metadata snapshot. It is "
+                             "written first if the file does not exist")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore the checkpoint of earlier runs")
+    parser.add_argument("--update", action="store_true",
+                        help="Only fetch periods up to the latest one on "
+                             "the site that are missing in the database")
+    parser.add_argument("--lookback", type=int, default=2,
+                        help="With --update: number of latest periods to "
+                             "re-fetch, in case they were revised")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log every request, with its timing")
+    parser.add_argument("--stats", default=None, metavar="PATH",
+                        help="Write request and parse stats to this file "
+                             "when done, as json if it ends with .json, "
+                             "else in the Prometheus text format")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    cache = None if args.cache == "none" else args.cache
+    query = parse_query_args(args.query)
+    stats = Stats()
+    scraper_kwargs = {
+        "workers": args.workers,
+        "cache": cache,
+        "cache_path": args.cache_path,
+    }
+    if args.metadata:
+        if not os.path.exists(args.metadata):
+            VantetiderScraper(**scraper_kwargs).export_metadata(args.metadata)
+        scraper_kwargs["metadata"] = args.metadata
+
+    if len(args.datasets) != 1 or args.processes:
+        if args.restart:
+            parser.error("--restart can only be used with one dataset")
+        mode = "update" if args.update else "harvest"
+        status = harvest_all(args.datasets or None, query, store=args.db,
+                             processes=args.processes,
+                             rate_limit=args.rate_limit, mode=mode,
+                             lookback=args.lookback, stats=stats,
+                             **scraper_kwargs)
+    else:
+        scraper = VantetiderScraper(rate_limit=args.rate_limit, stats=stats,
+                                    **scraper_kwargs)
+        dataset = scraper.get(args.datasets[0])
+        if args.update:
+            status = update(dataset, query, store=args.db,
+                            lookback=args.lookback)
+        else:
+            status = harvest(dataset, query, store=args.db,
+                             resume=not args.restart)
+    if args.stats:
+        stats.dump(args.stats)
+    print(json.dumps(status))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# encoding: utf-8
+"""Logging.
+
+The scraper logs to the "vantetider" logger, and leaves it to the
+application to configure logging, eg:
+
+    logging.basicConfig(level=logging.INFO)
+
+Each request emits a timing event on the "vantetider.requests" logger, at
+DEBUG level. The fields of the event are also set as the `timing`
+attribute of the log record, for handlers that write structured logs:
+
+    method, url, status, bytes
+    cache_hit: the response came from the http cache
+    shared: the request was shared with an identical one in flight
+    connect: seconds spent on dns lookups and opening connections
+    wait: seconds from sending the request to the response headers
+    transfer: seconds spent reading the response body
+    parse: seconds spent parsing the page into rows (result pages only)
+    total: seconds in all, including waiting for the rate limiter
+"""
+import logging
+import time
+
+logger = logging.getLogger("vantetider")
+logger.addHandler(logging.NullHandler())
+
+request_logger = logging.getLogger("vantetider.requests")
+
+TIMING_FORMAT = (u"%(method)s %(url)s status=%(status)s bytes=%(bytes)s "
+                 u"cache_hit=%(cache_hit)s shared=%(shared)s "
+                 u"connect=%(connect).3f wait=%(wait).3f "
+                 u"transfer=%(transfer).3f parse=%(parse).3f "
+                 u"total=%(total).3f")
+
+
+def new_timing(method, url):
+    """ Get an empty timing event of a request
+    """
+    return {
+        "method": method,
+        "url": url,
+        "status": None,
+        "bytes": 0,
+        "cache_hit": False,
+        "shared": False,
+        "connect": 0.0,
+        "wait": 0.0,
+        "transfer": 0.0,
+        "parse": 0.0,
+        "total": 0.0,
+    }
+
+
+def log_timing(timing):
+    """ Emit a timing event, see new_timing()
+    """
+    if request_logger.isEnabledFor(logging.DEBUG):
+        request_logger.debug(TIMING_FORMAT, timing, extra={"timing": timing})
+
+
+class ProgressLog(object):
+    """ Logs progress at INFO level, at most once every `interval` seconds
+    """
+    def __init__(self, log, interval=10):
+        """
+            :param log: a logger
+            :param interval: seconds between messages. None only logs
+                forced messages.
+        """
+        self.log = log
+        self.interval = interval
+        self._last = time.time()
+
+    def update(self, msg, *args, **kwargs):
+        """ Log a message, if `interval` seconds have passed since the last
+            one or `force=True` is passed
+        """
+        now = time.time()
+        due = self.interval is not None and now - self._last >= self.interval
+        if due or kwargs.get("force"):
+            self._last = now
+            self.log.info(msg, *args)
@@ -0,0 +1,89 @@
+# encoding: utf-8
+"""Snapshots of the metadata of the site: datasets, their page layouts and
+dimensions, default and allowed values and region slugs.
+
+Discovering the metadata means fetching the start page and the landing
+page of every dataset, and parsing their forms. A scraper started from a
+snapshot does neither, and makes no requests until data is fetched.
+
+    scraper = VantetiderScraper()
+    export_metadata(scraper, "metadata.json")
+
+    scraper = VantetiderScraper(metadata="metadata.json")
+
+A snapshot older than the scraper's `metadata_ttl` is not used. Before the
+first query of a dataset is planned, its landing page is also checked
+against the snapshot. If the page has options (eg a new year) that the
+snapshot does not, or other default values (eg a new latest period), the
+dataset's metadata is read from the page. Datasets marked as "checked", like
+those that harvest_all passes to its workers after checking them, are not
+checked again.
+"""
+import io
+import json
+import time
+
+VERSION = 1
+
+# Keep snapshots for a day by default, as new periods are published
+DEFAULT_METADATA_TTL = 86400
+
+
+def export_metadata(scraper, path=None, datasets=None):
+    """ Get a snapshot of the metadata of a scraper, and save it as json
+
+        :param scraper: a VantetiderScraper
+        :param path: file to write the snapshot to, or None
+        :param datasets: ids of datasets to include, defaults to all
+        :returns: the snapshot, a dict
+    """
+    scraper.move_to_top()
+    if datasets is None:
+        datasets = [x.id for x in scraper.items]
+
+    snapshot = {
+        "version": VERSION,
+        "created": time.time(),
+        "datasets": [],
+    }
+    for dataset_id in datasets:
+        scraper.move_to_top()
+        dataset = scraper.get(dataset_id)
+        dimensions = [dim.to_dict() for dim in dataset.dimensions]
+        slugs = dataset._get_region_index()[2]
+        snapshot["datasets"].append({
+            "id": dataset.id,
+            "label": dataset.label,
+            "layout": dataset.layout,
+            "dimensions": dimensions,
+            "region_slugs": slugs,
+        })
+    scraper.move_to_top()
+
+    if path is not None:
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(snapshot, ensure_ascii=False,
+                               separators=(",", ":")))
+    return snapshot
+
+
+def load_metadata(metadata, ttl=DEFAULT_METADATA_TTL):
+    """ Load a snapshot
+
+        :param metadata: path to a json file, or a snapshot dict
+        :param ttl: max age of the snapshot in seconds. None means it never
+            expires.
+        :returns: the snapshot, or None if it has expired
+    """
+    if not isinstance(metadata, dict):
+        with io.open(metadata, encoding="utf-8") as f:
+            metadata = json.load(f)
+
+    if metadata.get("version") != VERSION:
+        raise ValueError(u"Unsupported metadata version: {}"
+                         .format(metadata.get("version")))
+
+    if ttl is not None and time.time() - metadata["created"] > ttl:
+        return None
+
+    return metadata
@@ -0,0 +1,189 @@
+# encoding: utf-8
+"""Parsing of the cells of result page tables, shared by the BeautifulSoup
+parser of vantetider.scraper and the stream extractor of vantetider.extract.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# Missing-reason codes of parse_values. 0 means the value is numeric, 1 an
+# empty cell and the others the text in the cell.
+MISSING_REASONS = [None, u"", u"Ejdeltagit", u"N/A", u"-"]
+MISSING_CODES = dict((x, i) for i, x in enumerate(MISSING_REASONS) if i > 0)
+
+# Drops "%" and spaces, and makes "," a decimal point
+VALUE_TRANSLATION = {ord(u"%"): None, ord(u" "): None, ord(u","): u"."}
+
+def clean_value(val):
+    """ Clean a cell text before parsing it as a number
+        "12,5 %" => "12.5"
+    """
+    return val.translate(VALUE_TRANSLATION).replace(u"st", u"").strip()
+
+def parse_value(val):
+    """ Parse values from html
+    """
+    val = clean_value(val)
+
+    if val in MISSING_CODES:
+        return as_value(None, MISSING_CODES[val])
+
+    return float(val)
+
+def parse_values(texts):
+    """ Parse a column or table of cell texts at once
+        ["12,5 %", "-", ""] => array([12.5, nan, nan]), array([0, 4, 1])
+
+        :param texts: an iterable of cell texts
+        :returns: a float array, NaN where the value is missing, and an
+            array of missing-reason codes (see MISSING_REASONS)
+    """
+    cleaned = [clean_value(x) for x in texts]
+    missing = np.array([MISSING_CODES.get(x, 0) for x in cleaned], dtype=np.int8)
+    values = np.full(len(cleaned), np.nan)
+    is_numeric = missing == 0
+    if is_numeric.any():
+        values[is_numeric] = np.array(
+            [x for x, code in zip(cleaned, missing) if code == 0],
+            dtype=np.float64)
+    return values, missing
+
+def as_value(value, missing):
+    """ Get the value of a cell, as returned by parse_value, from a value and
+        missing-reason code of parse_values
+    """
+    if missing == 0:
+        return value
+    return MISSING_REASONS[missing] or None
+
+def parse_value_table(rows):
+    """ Parse the cells of a table, all at once
+        :param rows: a list of lists of td elements, of the same length
+        :returns: 2-D arrays of values and missing-reason codes, see
+            parse_values
+    """
+    n_cols = len(rows[0]) if rows else 0
+    if any(len(row) != n_cols for row in rows):
+        raise ValueError(u"Table rows have different number of cells")
+    values, missing = parse_values([cell.text for row in rows for cell in row])
+    return values.reshape(len(rows), n_cols), missing.reshape(len(rows), n_cols)
+
+def parse_text(val):
+    """ Format strings fetched from html
+    """
+    return val.replace("\n", " ").strip()
+
+def parse_landsting(val):
+    """ Get region/unit id from "handle_click_event_landsting(this, 1)"
+    """
+    try:
+        return re.search(r"\(this, (\d+)", val).group(1)
+    except AttributeError:
+        return None
+
+
+class Sheet(object):
+    """ Represents a two-dimensional sheet/table with data
+    """
+    def __init__(self, rows, cols, values, missing=None):
+        """
+            :param rows: a list with row values
+            :param cols: a list with column headers
+            :param values: a 2-D float array (or a list of lists) with row
+                values
+            :param missing: a 2-D array of missing-reason codes, as returned
+                by parse_values. None if `values` holds parsed values.
+        """
+        rows = list(rows)
+        cols = list(cols)
+        if missing is None:
+            # Cell values as returned by parse_value, eg "-" or None
+            values = np.array(values, dtype=object)
+        else:
+            missing = np.asarray(missing)
+        values = np.asarray(values)
+
+        if rows and values.shape != (len(rows), len(cols)):
+            msg = (u"Error initing sheet. Expected {} rows and {} cols, "
+                   u"got values of shape {}."
+                   .format(len(rows), len(cols), values.shape))
+            raise ValueError(msg)
+
+        self.row_index = rows
+        self.col_index = cols
+        self.values = values
+        self.missing = missing
+
+    def __len__(self):
+        """ Number of cells
+        """
+        return len(self.row_index) * len(self.col_index)
+
+    def get_value(self, row_i, col_i):
+        """ Get the value of a cell, as returned by parse_value
+        """
+        value = self.values[row_i, col_i]
+        if self.missing is None:
+            return value
+        return as_value(float(value), self.missing[row_i, col_i])
+
+    def iter_cells(self):
+        """ Yield (row_i, col_i) of all cells, row by row
+        """
+        n_cols = len(self.col_index)
+        for i in range(len(self)):
+            yield divmod(i, n_cols)
+
+    @property
+    def as_dictlist(self):
+        """ Returns a dictlist with values
+            [
+                {
+                    "row": "row_a",
+                    "col": "col_a",
+                    "value": 1,
+                }
+            ]
+        """
+        return [{
+            "row": row,
+            "col": col,
+            "value": value,
+            } for row, col, value in self.long_format]
+
+    @property
+    def long_format(self):
+        """ Yield (row, col, value) for all cells, row by row
+        """
+        for row_i, col_i in self.iter_cells():
+            yield (self.row_index[row_i],
+                   self.col_index[col_i],
+                   self.get_value(row_i, col_i))
+
+    def to_frame(self):
+        """ Get the sheet as a long format DataFrame with categorical "row"
+            and "col" columns, and a "value" column. Parsed sheets also
+            get a "missing" column with the reason a value is missing.
+        """
+        n_rows, n_cols = len(self.row_index), len(self.col_index)
+        row_codes = np.repeat(np.arange(n_rows, dtype=np.int32), n_cols)
+        col_codes = np.tile(np.arange(n_cols, dtype=np.int32), n_rows)
+        data = {
+            # Row values are often (id, label) tuples
+            "row": pd.Categorical.from_codes(
+                row_codes, pd.Index(self.row_index, dtype=object,
+                                    tupleize_cols=False)),
+            "col": pd.Categorical.from_codes(
+                col_codes, pd.Index(self.col_index, dtype=object)),
+            "value": self.values.reshape(-1),
+        }
+        columns = ["row", "col", "value"]
+        if self.missing is not None:
+            codes = self.missing.reshape(-1).astype(np.int32) - 1
+            data["missing"] = pd.Categorical.from_codes(
+                codes, pd.Index([u"" if x is None else x
+                                 for x in MISSING_REASONS[1:]], dtype=object))
+            columns.append("missing")
+        return pd.DataFrame(data, columns=columns)
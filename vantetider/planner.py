@@ -0,0 +1,239 @@
+# encoding: utf-8
+"""Plan the requests of a query.
+
+Without a plan, a query makes one request per combination of its values,
+`product(*query_values)`. Some pages return several values of a dimension
+at once:
+
+- Tabbed pages ("tabs" layout) have a column for every period.
+- The national page has a row for every region (but no units).
+
+The planner makes one request for each group of combinations that one page
+returns, and filters the rows of the page to the queried values. Queried
+values that turn out to be missing from a page are requested on their own.
+Tabbed pages are filtered to the queried (or selected) period even when only
+one period is asked for, as they have all periods whatever is asked for.
+
+    plan = dataset.plan({"year": "2018", "period": PERIODS})
+    plan.report()
+    # {"layout": "tabs", "collapsed": ["period"],
+    #  "naive_requests": 12, "planned_requests": 1}
+"""
+from collections import namedtuple
+
+from requests.exceptions import HTTPError
+
+# Dimensions that a page of each layout returns all values of
+FREE_DIMENSIONS = {
+    "tabs": ["period"],
+    "vertical_scroll": [],
+    "regular": [],
+}
+
+# A request to make, and the rows to keep from it.
+# `keep` is {dim_id: [labels]}: only rows with one of these labels are kept.
+PlannedRequest = namedtuple("PlannedRequest", ["url", "payload", "keep"])
+
+
+class QueryPlan(object):
+    """ The requests to make for a query
+    """
+    def __init__(self, dataset, query=None, include_units=True, collapse=True):
+        """
+            :param dataset: a VantetiderDataset
+            :param query: a query, as passed to `fetch`
+            :param include_units: get the units of regions. If False, the
+                regions of a query are read from the national page, and
+                only region rows are returned.
+            :param collapse: collapse requests. False makes one request per
+                combination of values.
+        """
+        # Plans are made from the dimensions and their default values
+        dataset._check_metadata()
+        self.dataset = dataset
+        self.query = dict(query or {})
+        self.include_units = include_units
+        self.layout = dataset.layout if collapse else None
+        self.naive_requests = dataset.scraper._get_queries(dataset, self.query)
+
+        collapsed = {}
+        if collapse:
+            for dim_id in FREE_DIMENSIONS.get(self.layout, []):
+                values = self._get_values(dim_id)
+                if dim_id in dataset.dimensions and len(values) > 1:
+                    collapsed[dim_id] = values
+            regions = self._get_values("region")
+            if not include_units and len(regions) > 1:
+                collapsed["region"] = regions
+        self.collapsed = collapsed
+
+        if not collapsed:
+            self.requests = [PlannedRequest(url, payload,
+                                            self._get_page_keep(payload))
+                             for url, payload in self.naive_requests]
+            return
+
+        _query = dict(self.query)
+        keep = {}
+        for dim_id, values in collapsed.items():
+            if dim_id == "region":
+                # The national page
+                _query[dim_id] = dataset.dimensions["region"].default_value
+                keep[dim_id] = [dataset._get_region(x).label for x in values]
+            else:
+                _query[dim_id] = values[0]
+                keep[dim_id] = [self._get_label(dim_id, x) for x in values]
+        self.requests = [PlannedRequest(url, payload,
+                                        dict(self._get_page_keep(payload),
+                                             **keep))
+                         for url, payload
+                         in dataset.scraper._get_queries(dataset, _query)]
+
+    def _get_page_keep(self, payload):
+        """ Get the rows to keep of a page, by the values that its payload
+            asks for. A tabbed page has all periods, but only the period of
+            the payload is asked for.
+        """
+        dataset = self.dataset
+        if dataset.layout == "tabs" and "period" in dataset.dimensions:
+            elem_id = dataset.dimensions["period"].elem_id
+            return {"period": [self._get_label("period", payload[elem_id])]}
+        return {}
+
+    def _get_values(self, dim_id):
+        values = self.query.get(dim_id, [])
+        if not isinstance(values, list):
+            values = [values]
+        return values
+
+    def _get_label(self, dim_id, value):
+        """ Get the label of an option of a form field, by id or label
+        """
+        for (_id, label, selected) in self.dataset.dimensions[dim_id].options:
+            if value in [_id, label]:
+                return label
+        raise KeyError(u"{} is not a valid value of {}".format(value, dim_id))
+
+    def __len__(self):
+        return len(self.requests)
+
+    def report(self):
+        """ Compare planned requests with naive requests, without making
+            any of them
+        """
+        return {
+            "dataset": self.dataset.id,
+            "layout": self.layout,
+            "collapsed": sorted(self.collapsed.keys()),
+            "naive_requests": len(self.naive_requests),
+            "planned_requests": len(self.requests),
+        }
+
+    def _keep_row(self, request, row):
+        if not self.include_units and row["unit"] is not None:
+            return False
+        for dim_id, labels in request.keep.items():
+            if row[dim_id] not in labels:
+                return False
+        return True
+
+    def iter_results(self, request, get_page, retry=None):
+        """ Get the Results of a planned request, and of the requests for
+            queried values that were missing from its page
+
+            :param get_page: a function taking url and payload, and
+                returning the Results of a result page
+            :param retry: a list to add the requests of pages that the
+                server fails to render (get_page raises an HTTPError with
+                status 500) to, to retry later. By default get_page is
+                expected to skip such pages.
+        """
+        found = dict((dim_id, set()) for dim_id in request.keep)
+        try:
+            for result in self.filter_results(
+                    request, get_page(request.url, request.payload), found):
+                yield result
+        except HTTPError as e:
+            if retry is None or not is_server_error(e):
+                raise
+            if not request.keep:
+                retry.append(request)
+                return
+            # The values of the collapsed request are requested one by
+            # one below
+
+        for missing in self.get_missing_requests(request, found):
+            for result in self.iter_page(missing, get_page, retry=retry):
+                yield result
+
+    def iter_page(self, request, get_page, retry=None):
+        """ Get the Results of the page of a planned request, without
+            requesting missing values, eg to retry it
+            :param retry: see iter_results
+        """
+        try:
+            for result in self.filter_results(
+                    request, get_page(request.url, request.payload)):
+                yield result
+        except HTTPError as e:
+            if retry is None or not is_server_error(e):
+                raise
+            retry.append(request)
+
+    def filter_results(self, request, results, found=None):
+        """ Keep the Results of a page that a planned request asks for
+            :param found: {dim_id: set()} to add the labels of the kept
+                rows to, see get_missing_requests
+        """
+        for result in results:
+            row = result.raw_dimensions
+            if self._keep_row(request, row):
+                if found is not None:
+                    for dim_id in found:
+                        found[dim_id].add(row[dim_id])
+                yield result
+
+    def get_missing_requests(self, request, found):
+        """ Get requests for the queried values that were missing from the
+            page of a planned request
+            :param found: {dim_id: labels found on the page}, as filled in
+                by filter_results
+        """
+        for dim_id in self.collapsed:
+            for missing in self._split(request, dim_id, skip=found[dim_id]):
+                yield missing
+
+    def split(self, request):
+        """ Get the requests that a planned request stands for, one per
+            combination of its collapsed values, like the requests of a
+            query that is not collapsed
+        """
+        requests = [request]
+        for dim_id in self.collapsed:
+            requests = [x for r in requests for x in self._split(r, dim_id)]
+        return requests
+
+    def _split(self, request, dim_id, skip=()):
+        """ Get a request for each value of a collapsed dimension
+            :param skip: labels of values to leave out
+        """
+        labels = request.keep[dim_id]
+        for value, label in zip(self._get_values(dim_id), labels):
+            if label in skip:
+                continue
+            elem_id = self.dataset.dimensions[dim_id].elem_id
+            payload = dict(request.payload)
+            payload[elem_id] = value
+            if dim_id == "region":
+                url = self.dataset.get_url(value)
+            else:
+                url = request.url
+            yield PlannedRequest(url, payload,
+                                 dict(request.keep, **{dim_id: [label]}))
+
+
+def is_server_error(e):
+    """ Check if an HTTPError is a result page that the server failed to
+        render. Vantetider.se responds with 500 on some queries.
+    """
+    return e.response is not None and e.response.status_code == 500
@@ -1,15 +1,40 @@
 # encoding: utf-8
-import requests
-from bs4 import BeautifulSoup
-import requests_cache
+from bs4 import BeautifulSoup, SoupStrainer
+from collections import namedtuple
 from itertools import product
+import json
 import re
-from requests.exceptions import HTTPError
-
-requests_cache.install_cache()
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from requests.exceptions import HTTPError, RequestException
+
+from .concurrency import (RateLimiter, AdaptiveRateLimiter, SingleFlight,
+                          OVERLOAD_STATUSES, imap_bounded)
+from .session import (make_session, reset_connect_time, get_connect_time,
+                      RETRY_ERRORS)
+from .logs import logger, new_timing, log_timing, ProgressLog
+from .stats import Stats
+from .extract import ExtractedPage, ExtractError, extract_page
+from .cache import (HttpCache, make_cache, canonical_payload, DEFAULT_TTL,
+                    DEFAULT_MAX_SIZE)
+from .columnar import ColumnarResult
+from .parsing import (Sheet, parse_value, parse_values, parse_value_table,
+                      parse_text, parse_landsting)
+from .export import ExportWriter
+from .planner import QueryPlan
+from .metadata import load_metadata, export_metadata, DEFAULT_METADATA_TTL
+
+try:
+    import lxml
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
 
 from statscraper import (BaseScraper, Collection, DimensionValue,
-                         Dataset, Dimension, Result)
+                         Dataset, Dimension, Result, ValueList)
 
 BASE_URL = u"https://www.vantetider.se/Kontaktkort/"
 NOT_IMPLEMENTED_DATASETS = [
@@ -28,7 +53,125 @@ NOT_IMPLEMENTED_DATASETS = [
 
 class VantetiderScraper(BaseScraper):
 
+    def __init__(self, workers=1, ordered=True, rate_limit=None,
+                 pool_size=None, timeout=30, retries=3, backoff_factor=0.5,
+                 gzip=True, cache="memory", cache_path=None,
+                 cache_ttl=DEFAULT_TTL, cache_max_size=DEFAULT_MAX_SIZE,
+                 metadata=None, metadata_ttl=DEFAULT_METADATA_TTL,
+                 coalesce=True, logger=None, progress_interval=10,
+                 stats=None, extractor="stream", retry_passes=0,
+                 retry_delay=10, *args, **kwargs):
+        """
+            :param workers: number of queries to run concurrently in `fetch`.
+                Can be overridden per query: `dataset.fetch(query, workers=4)`
+            :param ordered: when running concurrently, yield rows in the order
+                of the queries rather than as they complete
+            :param rate_limit: max number of requests per second to
+                vantetider.se, across all workers. None means no limit.
+                "adaptive" adapts the rate, and the number of requests in
+                flight, to the response times and errors of the server (see
+                vantetider.concurrency.AdaptiveRateLimiter). Requests in
+                flight start at `workers`, and with more than one worker may
+                grow up to `pool_size`. A rate limiter
+                object, such as a ProcessRateLimiter shared with other
+                processes, can be passed too.
+            :param pool_size: number of kept-alive connections, defaults to
+                at least the number of workers
+            :param timeout: seconds to wait for the server, as (connect, read)
+                tuple or a single number
+            :param retries: number of retries on connection errors and
+                502-504 responses. With an adaptive rate limiter 429
+                responses are retried too, by the scraper rather than the
+                session, so that the limiter sees every attempt.
+            :param backoff_factor: backoff between retries, in seconds
+            :param gzip: ask for compressed responses
+            :param cache: "memory"|"sqlite"|"filesystem", a HttpCache or None
+                to disable caching
+            :param cache_path: file or directory for the sqlite and
+                filesystem caches
+            :param cache_ttl: seconds to keep responses, or a list of
+                (url regex, seconds). See vantetider.cache.HttpCache
+            :param cache_max_size: max size of the cache in bytes
+            :param metadata: a metadata snapshot, or the path to one, to
+                start from instead of the site. See vantetider.metadata
+            :param metadata_ttl: max age of the snapshot in seconds
+            :param coalesce: let concurrent identical requests, eg from
+                overlapping fetches in different threads, share one request
+                and parsed result page
+            :param logger: a logger to use instead of the "vantetider"
+                logger, see vantetider.logs
+            :param progress_interval: seconds between progress messages of
+                `fetch`. Progress of each query is logged at DEBUG level.
+            :param stats: a Stats to collect counters and histograms in,
+                eg to share between scrapers. See vantetider.stats
+            :param extractor: "stream" to read result pages in one pass,
+                with BeautifulSoup as fallback for pages that the stream
+                extractor fails on, or "soup" to always use BeautifulSoup.
+                See vantetider.extract
+            :param retry_passes: number of times to retry the result pages
+                of a fetch that the server failed to render (HTTP 500), once
+                all other pages are fetched. 0, the default, skips them at
+                once.
+            :param retry_delay: seconds to wait before a retry pass
+        """
+        self.workers = workers
+        self.ordered = ordered
+        if pool_size is None:
+            pool_size = max(10, workers)
+        if hasattr(rate_limit, "wait"):
+            self.rate_limiter = rate_limit
+        elif rate_limit == "adaptive":
+            self.rate_limiter = AdaptiveRateLimiter(
+                concurrency=max(1, workers), max_concurrency=pool_size)
+        else:
+            self.rate_limiter = RateLimiter(rate_limit)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        adaptive = isinstance(self.rate_limiter, AdaptiveRateLimiter)
+        self.session = make_session(pool_size=pool_size,
+                                    retries=0 if adaptive else retries,
+                                    backoff_factor=backoff_factor, gzip=gzip)
+        if not cache:
+            self.cache = None
+        elif isinstance(cache, HttpCache):
+            self.cache = cache
+        else:
+            self.cache = make_cache(cache, path=cache_path, ttl=cache_ttl,
+                                    max_size=cache_max_size)
+        self.flights = SingleFlight() if coalesce else None
+        if logger is not None:
+            self._logger = logger
+        self.progress_interval = progress_interval
+        self.stats = Stats() if stats is None else stats
+        if extractor not in ["stream", "soup"]:
+            raise ValueError(u"Unknown extractor: {}".format(extractor))
+        self.extractor = extractor
+        self.retry_passes = retry_passes
+        self.retry_delay = retry_delay
+        self.metadata = None
+        # Held while a dataset checks its metadata snapshot
+        self._metadata_lock = threading.Lock()
+        if metadata is not None:
+            self.metadata = load_metadata(metadata, ttl=metadata_ttl)
+            if self.metadata is None:
+                self.log.info(u"Metadata snapshot has expired, using the site")
+        super(VantetiderScraper, self).__init__(*args, **kwargs)
+
+    def export_metadata(self, path=None, datasets=None):
+        """ Save a snapshot of datasets and dimensions, see
+            vantetider.metadata.export_metadata
+        """
+        return export_metadata(self, path=path, datasets=datasets)
+
     def _fetch_itemslist(self, current_item):
+        if self.metadata is not None:
+            for meta in self.metadata["datasets"]:
+                dataset = VantetiderDataset(meta["id"], label=meta["label"])
+                dataset._metadata = meta
+                yield dataset
+            return
+
         # Get start page
         html = self._get_html(BASE_URL + "Sveriges")
         soup = BeautifulSoup(html, 'html.parser')
@@ -48,14 +191,18 @@ class VantetiderScraper(BaseScraper):
                 yield VantetiderDataset(id_, label=label)
 
     def _fetch_dimensions(self, dataset):
-        try:
-            form = [x for x in dataset.soup.find_all("form")
-                if "/Kontaktkort/" in x.get("action")][0]
-        except IndexError:
-            # http://www.vantetider.se/Kontaktkort/Sveriges/Aterbesok
-            # does not have form element
-            form = dataset.soup.find("div", {"class": "container_12 filter_section specialised_operation"})
-        self._form = form
+        """ Dimensions are read from the filter form of the landing page.
+            Only plain data is kept on the dimensions (`elem_type` and
+            `options`), so that the parsed page can be released.
+            Datasets from a metadata snapshot get their dimensions from it.
+        """
+        meta = getattr(dataset, "_metadata", None)
+        if meta is not None:
+            for dim_meta in meta["dimensions"]:
+                yield VantetiderDimension.from_dict(dim_meta)
+            return
+
+        form = dataset._get_filter_form()
 
         # 1. Get select elements (dropdowns)
         select_elems = form.find_all("select")
@@ -64,7 +211,8 @@ class VantetiderScraper(BaseScraper):
             dim_id = elem_id.replace("select_", "").replace("revisits_", "")
             dim = VantetiderDimension(dim_id)
             dim.elem_id = elem_id
-            dim.elem = elem
+            dim.elem_type = "select"
+            dim.options = parse_select_options(elem)
             yield dim
 
         # 2. Get checkboxes (gender, ownership)
@@ -76,7 +224,9 @@ class VantetiderScraper(BaseScraper):
 
             dim = VantetiderDimension(dim_id)
             dim.elem_id = elem_id
-            dim.elem = elem
+            dim.elem_type = "checkbox"
+            dim.options = [(elem.get("value"), parse_text(label),
+                            elem.has_attr("checked"))]
             yield dim
 
 
@@ -90,7 +240,8 @@ class VantetiderScraper(BaseScraper):
 
             dim = VantetiderDimension(dim_id)
             dim.elem_id = elem_id
-            dim.elem = elems
+            dim.elem_type = "radio"
+            dim.options = parse_radio_inputs(elems)
             yield dim
 
 
@@ -101,44 +252,163 @@ class VantetiderScraper(BaseScraper):
         yield VantetiderDimension("unit_id")
 
     def _fetch_allowed_values(self, dimension):
-        """Allowed values are only implemented for regions.
-        Ie units would need to be fetched trough an json api.
+        """Allowed values are implemented for regions, years and radio
+        buttons. Units are listed by `dataset.get_units(region)`.
         """
         if dimension.id == "region":
-            for option in dimension.elem.find_all("option"):
-                _id = option.attrs["value"]
-                label = option.text
+            for (_id, label, selected) in dimension.options:
                 yield DimensionValue(_id, dimension, label=label)
 
         elif dimension.id == "year":
-            for option in dimension.elem.find_all("option"):
-                year = option.text
+            for (_id, year, selected) in dimension.options:
                 yield DimensionValue(year, dimension)
         elif dimension.elem_type == "radio":
-            input_tags = parse_radio_inputs(dimension.elem)
-            for (_id, label, checked) in input_tags:
+            for (_id, label, checked) in dimension.options:
                 yield DimensionValue(_id, dimension, label=label)
 
         else:
             pass
 
 
-    def _fetch_data(self, dataset, query):
+    def _fetch_data(self, dataset, query, workers=None, ordered=None,
+                    plan=True, include_units=True, retry_passes=None):
+        """
+            :param workers: number of concurrent queries, defaults to
+                `self.workers`
+            :param ordered: yield rows in query order, defaults to
+                `self.ordered`
+            :param plan: make as few requests as possible, see
+                vantetider.planner. Rows then come in page order.
+            :param include_units: see vantetider.planner.QueryPlan
+            :param retry_passes: defaults to `self.retry_passes`. Rows of
+                retried pages come last.
+        """
+        if workers is None:
+            workers = self.workers
+        if ordered is None:
+            ordered = self.ordered
+        if retry_passes is None:
+            retry_passes = self.retry_passes
+        limiter = self.rate_limiter
+        if workers > 1 and isinstance(limiter, AdaptiveRateLimiter):
+            # Threads for as many requests as the limiter may let be in
+            # flight. It keeps them to its current concurrency.
+            workers = max(workers, limiter.max_concurrency)
+
+        query_plan, units, only_region = self._plan_fetch(
+            dataset, query, plan=plan, include_units=include_units)
+        jobs = query_plan.requests
+
+        n_queries = len(jobs)
+        self.log.info(u"Making a total of %s queries (%s without a plan)",
+                      n_queries, len(query_plan.naive_requests))
+
+        # Requests of pages that the server failed to render, to retry
+        # once all other pages are fetched
+        retry = [] if retry_passes else None
+        skip_errors = retry is None
+
+        def _get_page(url, payload):
+            return dataset._parse_result_page(url, payload,
+                                              only_region=only_region,
+                                              region=payload["select_region"],
+                                              skip_errors=skip_errors)
+
+        def _iter_page(url, payload):
+            return dataset._iter_result_page(url, payload,
+                                             only_region=only_region,
+                                             region=payload["select_region"],
+                                             skip_errors=skip_errors)
+
+        def _iter_jobs(jobs, iter_job):
+            """ Results of each job
+                :param iter_job: QueryPlan.iter_results or iter_page
+            """
+            if workers is None or workers <= 1:
+                # Stream rows straight from the parser
+                return (iter_job(job, _iter_page, retry=retry) for job in jobs)
+
+            def _run(job):
+                return list(iter_job(job, _get_page, retry=retry))
+            return imap_bounded(_run, jobs, workers=workers, ordered=ordered)
+
+        progress = ProgressLog(self.log, self.progress_interval)
+        n_rows = 0
+        for i, rows in enumerate(_iter_jobs(jobs, query_plan.iter_results)):
+            self.log.debug(u"Query %s/%s", i + 1, n_queries)
+            for row in rows:
+                if units is not None and not is_unit_row(row, units):
+                    continue
+                n_rows += 1
+                yield row
+            progress.update(u"Query %s/%s of %s, %s rows", i + 1, n_queries,
+                            dataset.id, n_rows)
+
+        for n in range(retry_passes):
+            if not retry:
+                break
+            failed = list(retry)
+            del retry[:]
+            self.log.info(u"Retrying %s pages of %s that failed, in %s s",
+                          len(failed), dataset.id, self.retry_delay)
+            self.stats.incr("retried_pages_total", len(failed))
+            time.sleep(self.retry_delay)
+            for rows in _iter_jobs(failed, query_plan.iter_page):
+                for row in rows:
+                    if units is not None and not is_unit_row(row, units):
+                        continue
+                    n_rows += 1
+                    yield row
+
+        for request in retry or []:
+            self.log.warning(u"Unable to get %s with %s", request.url,
+                             request.payload)
+            self.stats.incr("skipped_pages_total")
+
+        progress.update(u"Done with %s queries of %s, %s rows", n_queries,
+                        dataset.id, n_rows, force=True)
+
+        if self.cache is not None:
+            self.log.info(u"Result page cache: %s", self.cache.page_stats)
+
+
+    def _plan_fetch(self, dataset, query, plan=True, include_units=True):
+        """ Plan the requests of a fetch
+            :returns: (a QueryPlan, the queried units or None, only_region)
+        """
         if query is None:
             query = {}
         only_region = query.keys() == ["region"]
+
+        # Units are not a form field. Their region pages are queried, and
+        # the rows filtered by the caller, see is_unit_row.
+        units = None
+        if "unit" in query:
+            query = dict(query)
+            units = query.pop("unit")
+            if not isinstance(units, list):
+                units = [units]
+            if "region" not in query:
+                query["region"] = self._get_unit_regions(dataset, units)
+
+        query_plan = QueryPlan(dataset, query, include_units=include_units,
+                               collapse=plan)
+        return query_plan, units, only_region
+
+    def _get_queries(self, dataset, query):
+        """ Expand a query to one (url, payload) per result page to request
+        """
         NO_QUERY_DIMS = ["measure", "unit_id"]
-        #
-        NOT_IMPLEMENTED_DIMS = ["unit", "services"]
 
-        for dim_id in NOT_IMPLEMENTED_DIMS:
-            if dim_id in query.keys():
-                msg = "Querying by {} is not implemented.".format(dim_id)
-                raise NotImplementedError(msg)
+        if "unit" in query:
+            msg = "Units are filtered by _fetch_data, not queried."
+            raise NotImplementedError(msg)
 
-        form_keys = [x.elem_id for x in dataset.dimensions if x.id not in NO_QUERY_DIMS]
+        if "services" in query and "services" not in dataset.dimensions:
+            msg = "Querying by services is not implemented for {}.".format(dataset.id)
+            raise NotImplementedError(msg)
 
-        queries = []
+        form_keys = [x.elem_id for x in dataset.dimensions if x.id not in NO_QUERY_DIMS]
 
         # Create payload for post request
         # Get a list of values to query by
@@ -159,62 +429,160 @@ class VantetiderScraper(BaseScraper):
 
             query_values.append(values)
 
-        queries = list(product(*query_values))
-
-        n_queries = len(queries)
-        self.log.info(u"Making a total of {} queries".format(n_queries))
-
-        for i, _query in enumerate(queries):
-            self.log.info("Query {}/{}".format(i+1, n_queries))
+        jobs = []
+        for _query in product(*query_values):
             payload = dict(zip(form_keys, _query))
             url = dataset.get_url(payload["select_region"])
+            jobs.append((url, payload))
 
-            for row in dataset._parse_result_page(url, payload,
-                                                  only_region=only_region,
-                                                  region=payload["select_region"]):
-                yield row
+        return jobs
 
+    def _get_unit_regions(self, dataset, units):
+        """ Get the regions to query for some units, when the query has no
+            region. The site has no list of all units, so that is every
+            region but the national one (that has no units).
+            :param units: unit ids or labels
+        """
+        self.log.info(u"Querying all regions of %s for units %s, pass a "
+                      u"region to make fewer requests", dataset.id, units)
+        return [x.label for x in dataset.regions
+                if dataset._get_region_slug(x.value) != "Sveriges"]
 
     # HELPER METHODS
-    def _get_html(self, url):
+    def _get_html(self, url, refresh=False, timing=None):
         """ Get html from url
+            :param refresh: bypass the cache (the response is still stored)
+            :param timing: see _request
         """
-        self.log.info(u"/GET {}".format(url))
-        r = requests.get(url)
-
-        if hasattr(r, 'from_cache'):
-            if r.from_cache:
-                self.log.info("(from cache)")
-
-        r.raise_for_status()
-
-        return r.content
-
-    def _post_html(self, url, payload):
-        self.log.info(u"/POST {} with {}".format(url, payload))
-        r = requests.post(url, payload)
-        r.raise_for_status()
-
-        return r.content
+        self.log.debug(u"/GET %s", url)
+        return self._request("GET", url, refresh=refresh, timing=timing)
+
+    def _post_html(self, url, payload, page_key=None, refresh=False,
+                   timing=None):
+        """ Post a query
+            :param page_key: (dataset id, region slug, normalized payload)
+                to store the result page under in the cache
+            :param refresh: bypass the cache (the response is still stored)
+            :param timing: see _request
+        """
+        self.log.debug(u"/POST %s with %s", url, payload)
+        return self._request("POST", url, payload, page_key=page_key,
+                             refresh=refresh, timing=timing)
 
     def _get_json(self, url):
         """ Get json from url
         """
-        self.log.info(u"/GET " + url)
-        r = requests.get(url)
-        if hasattr(r, 'from_cache'):
-            if r.from_cache:
-                self.log.info("(from cache)")
-        r.raise_for_status()
+        self.log.debug(u"/GET %s", url)
+        return json.loads(self._request("GET", url))
+
+    def _request(self, method, url, payload=None, page_key=None,
+                 refresh=False, timing=None):
+        """ Make a request through the cache, rate limiter and session.
+            Concurrent identical requests share one request.
+            :param timing: a dict to fill with the timing event of the
+                request, for the caller to log. By default it is logged
+                here. See vantetider.logs
+            :returns: content of the response
+        """
+        _timing = new_timing(method, url)
+        start = time.time()
+        try:
+            if self.flights is None:
+                return self._make_request(method, url, payload,
+                                          page_key=page_key, refresh=refresh,
+                                          timing=_timing)
+            key = get_request_key(method, url, payload, page_key, refresh)
+            content, shared = self.flights.do(key, self._make_request, method,
+                                              url, payload, page_key=page_key,
+                                              refresh=refresh, timing=_timing)
+            _timing["shared"] = shared
+            return content
+        finally:
+            _timing["total"] = time.time() - start
+            self.stats.record_request(_timing)
+            if timing is None:
+                log_timing(_timing)
+            else:
+                timing.update(_timing)
 
-        return r.json()
+    def _make_request(self, method, url, payload=None, page_key=None,
+                      refresh=False, timing=None):
+        """ Make a request through the cache, rate limiter and session
+            :param timing: a timing event to fill in
+            :returns: content of the response
+        """
+        if timing is None:
+            timing = new_timing(method, url)
+        if self.cache is not None and not refresh:
+            if page_key is None:
+                content = self.cache.get(method, url, payload)
+            else:
+                content = self.cache.get_page(*page_key)
+            if content is not None:
+                timing["cache_hit"] = True
+                timing["bytes"] = len(content)
+                return content
+
+        limiter = self.rate_limiter
+        adaptive = isinstance(limiter, AdaptiveRateLimiter)
+        # The session of a scraper with an adaptive rate limiter does not
+        # retry. Requests are retried here, so that the limiter paces and
+        # records every attempt.
+        attempts = self.retries + 1 if adaptive else 1
+        for attempt in range(attempts):
+            if attempt > 0:
+                time.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            if adaptive:
+                limiter.acquire()
+            start = time.time()
+            try:
+                limiter.wait(url)
+                reset_connect_time()
+                start = time.time()
+                r = self.session.request(method, url, data=payload,
+                                         timeout=self.timeout)
+            except RequestException as e:
+                if not adaptive:
+                    raise
+                limiter.record(None, time.time() - start)
+                if isinstance(e, RETRY_ERRORS) and attempt < attempts - 1:
+                    continue
+                raise
+            finally:
+                if adaptive:
+                    limiter.release()
+            # Time to the response headers, including connecting
+            elapsed = r.elapsed.total_seconds()
+            if adaptive:
+                limiter.record(r.status_code, elapsed,
+                               r.headers.get("Retry-After"))
+                if r.status_code in OVERLOAD_STATUSES and \
+                        attempt < attempts - 1:
+                    continue
+            break
+
+        timing["status"] = r.status_code
+        timing["bytes"] = len(r.content)
+        timing["connect"] = get_connect_time()
+        timing["wait"] = max(elapsed - timing["connect"], 0.0)
+        timing["transfer"] = max(time.time() - start - elapsed, 0.0)
+        r.raise_for_status()
 
+        if self.cache is None:
+            pass
+        elif page_key is None:
+            self.cache.set(method, url, payload, r.content)
+        else:
+            dataset_id, region_slug, normalized_payload = page_key
+            self.cache.set_page(dataset_id, region_slug, url,
+                                normalized_payload, r.content)
 
+        return r.content
 
     @property
     def log(self):
         if not hasattr(self, "_logger"):
-            self._logger = PrintLogger()
+            self._logger = logger
         return self._logger
 
 
@@ -238,7 +606,49 @@ class VantetiderDataset(Dataset):
 
     @property
     def soup(self):
-        return BeautifulSoup(self.html, 'html.parser')
+        """ The parsed landing page
+        """
+        if not hasattr(self, "_soup"):
+            self._soup = BeautifulSoup(self.html, HTML_PARSER)
+        return self._soup
+
+    def _get_filter_form(self):
+        """ Get the filter form of the landing page, without parsing the
+            rest of the page
+        """
+        forms = BeautifulSoup(self.html, HTML_PARSER,
+                              parse_only=SoupStrainer("form"))
+        try:
+            return [x for x in forms.find_all("form")
+                    if "/Kontaktkort/" in x.get("action", "")][0]
+        except IndexError:
+            # http://www.vantetider.se/Kontaktkort/Sveriges/Aterbesok
+            # does not have form element
+            return self.soup.find("div", {"class": "container_12 filter_section specialised_operation"})
+
+    @property
+    def layout(self):
+        """ Layout of the result pages of this dataset, as of the landing
+            page. See ResultPage.layout
+        """
+        if not hasattr(self, "_layout"):
+            meta = getattr(self, "_metadata", None)
+            if meta is not None and meta.get("layout"):
+                self._layout = meta["layout"]
+            else:
+                self._layout = ResultPage(self.html).layout
+        return self._layout
+
+    def plan(self, query=None, include_units=True):
+        """ Plan the requests of a query, without making them
+
+            dataset.plan({"period": PERIODS}).report()
+
+            :returns: a vantetider.planner.QueryPlan
+        """
+        if self.scraper.current_item is not self:
+            self._move_here()
+        return QueryPlan(self, query, include_units=include_units)
 
     @property
     def regions(self):
@@ -258,72 +668,245 @@ class VantetiderDataset(Dataset):
 
         This method will have to be re-written to support pages with ajax load
         """
-        return {
-            "year": self.dimensions["year"].default_value,
-            "period": self.dimensions["period"].default_value,
-        }
+        self._check_metadata()
+        latest = {"year": self.dimensions["year"].default_value}
+        # Some datasets are by year only
+        if "period" in self.dimensions:
+            latest["period"] = self.dimensions["period"].default_value
+        return latest
 
 
+    def _get_region_index(self):
+        """ Get dicts to look up regions by label and by id, and url slugs
+            by region id. Built once, the first time regions are looked up.
+        """
+        if not hasattr(self, "_region_index"):
+            by_label = {}
+            by_id = {}
+            slugs = {}
+            meta = getattr(self, "_metadata", None)
+            if meta is not None:
+                slugs.update(meta["region_slugs"])
+            for region in self.regions:
+                # First match wins, like ValueList.get_by_label
+                by_label.setdefault(region.label, region)
+                by_id.setdefault(region.value, region)
+                slugs.setdefault(region.value, get_region_slug(region.label))
+            self._region_index = (by_label, by_id, slugs)
+        return self._region_index
+
+    def _get_region(self, id_or_label):
+        """ Get a region by id or label
+            :param id_or_label: Id or label of region
+        """
+        by_label, by_id, _ = self._get_region_index()
+        region = by_label.get(id_or_label)
+        if region is None:
+            region = by_id.get(id_or_label)
+        if region is None:
+            raise KeyError(u"{} is not a valid region id or label".format(id_or_label))
+        return region
+
     def _get_region_slug(self, id_or_label):
         """ Get the regional slug to be used in url
             "Norrbotten" => "Norrbottens"
 
             :param id_or_label: Id or label of region
         """
-        region = self.regions.get_by_label(id_or_label)
-        if region is None:
-            try:
-                region = self.regions[id_or_label]
-            except StopIteration:
-                # this is a strange error thrown by statscraper
-                raise KeyError(u"{} is not a valid region id or label".format(id_or_label))
-
-        slug = region.label\
-            .replace(u" ","-")\
-            .replace(u"ö","o")\
-            .replace(u"Ö","O")\
-            .replace(u"ä","a")\
-            .replace(u"å","a")
-
-        if not "region" in slug:
-            slug = slug + "s"
-
-        EXCEPTIONS = {
-            "Jamtland-Harjedalens": "Jamtlands",
-            "Rikets": "Sveriges",
-            "Alla-landstings": "Sveriges",
-            "Alla-regioner": "Sveriges",
-        }
-        if slug in EXCEPTIONS:
-            slug = EXCEPTIONS[slug]
-
-        return slug
-
-    def _parse_result_page(self, url, payload, only_region=False, region=None):
+        region = self._get_region(id_or_label)
+        return self._get_region_index()[2][region.value]
+
+    def iter_fetch(self, query=None, chunk_size=None, **kwargs):
+        """ Fetch data, yielding rows as they are parsed. Unlike `fetch`
+            nothing is kept in memory.
+
+            for chunk in dataset.iter_fetch(query, chunk_size=1000):
+                table.insert_many(chunk)
+
+            :param query: a query, as passed to `fetch`
+            :param chunk_size: yield lists of this many rows instead of
+                single rows
+            :returns: dicts like {"value": 12.0, "region": "Blekinge", ...}
+        """
+        if self.scraper.current_item is not self:
+            self._move_here()
+        rows = (dict(result.raw_dimensions, value=result.value)
+                for result in self.scraper._fetch_data(self, query=query,
+                                                       **kwargs))
+        if chunk_size is None:
+            return rows
+        return chunked(rows, chunk_size)
+
+    def fetch_columnar(self, query=None, **kwargs):
+        """ Fetch data into a ColumnarResult, that stores dimensions as
+            categorical columns and values as a float array. Uses a fraction
+            of the memory of `fetch` on large queries.
+
+            df = dataset.fetch_columnar(query).pandas
+
+            :param query: a query, as passed to `fetch`
+        """
+        if self.scraper.current_item is not self:
+            self._move_here()
+        return ColumnarResult.from_rows(
+            self.scraper._fetch_data(self, query=query, **kwargs))
+
+    def export(self, path, query=None, format=None,
+               partition_by=("year", "period"), batch_size=100000,
+               max_rows=500000, **kwargs):
+        """ Fetch data straight to Parquet, Arrow or csv files, partitioned
+            by dataset, year and period. Rows are written in batches, so
+            memory use does not grow with the size of the query.
+
+            dataset.export("vantetider", {"region": "*", "year": "*"})
+            df = read_export("vantetider", dataset="Overbelaggning")
+
+            :param path: directory to write to. Partitions that are written
+                to replace those of an earlier export, other partitions are
+                kept.
+            :param query: a query, as passed to `fetch`
+            :param format: "parquet", "arrow" or "csv", see
+                vantetider.export.ExportWriter
+            :returns: the ExportWriter, with the paths of the written files
+                in `files`
+        """
+        if self.scraper.current_item is not self:
+            self._move_here()
+        writer = ExportWriter(path, format=format, partition_by=partition_by,
+                              batch_size=batch_size, max_rows=max_rows)
+        with writer:
+            writer.write(self.id, self.scraper._fetch_data(self, query=query,
+                                                           **kwargs))
+        self.scraper.log.info(u"Exported %s rows of %s to %s files in %s",
+                              writer.rows, self.id, len(writer.files), path)
+        return writer
+
+    def _parse_result_page(self, url, payload, only_region=False, region=None,
+                           skip_errors=True, refresh=False):
         """ Get data from a result page
             :param url: url to query
             :param payload: payload to pass
-            :return: a dictlist with data
+            :param skip_errors: log and skip pages that the server fails
+                to render (HTTP 500) rather than raising
+            :param refresh: fetch the page even if it is cached
+            :return: a list of Results
+        """
+        def _parse():
+            return list(self._iter_result_page(url, payload,
+                                               only_region=only_region,
+                                               region=region,
+                                               skip_errors=skip_errors,
+                                               refresh=refresh))
+
+        flights = self.scraper.flights
+        if flights is None:
+            return _parse()
+
+        # Concurrent identical queries share the parsed page
+        _, region_slug, normalized = self._get_result_page_key(url, payload)
+        key = ("parsed", self.id, region_slug, canonical_payload(normalized),
+               only_region, skip_errors, refresh)
+        results, shared = flights.do(key, _parse)
+        if shared:
+            # Results are tied to the ResultSet they are added to
+            results = [Result(x.value, dict(x.raw_dimensions)) for x in results]
+        return results
+
+    def _iter_result_page(self, url, payload, only_region=False, region=None,
+                          skip_errors=True, refresh=False):
+        """ Get data from a result page, one Result at a time
+            :param url: url to query
+            :param payload: payload to pass
+            :param skip_errors: see _parse_result_page
+            :param refresh: see _parse_result_page
         """
-        data = []
+        # The timing event of the html request, logged with the time spent
+        # parsing the page once it has been read
+        timing = {}
         if only_region:
-            html = self.scraper._get_html(url)
+            html = self.scraper._get_html(url, refresh=refresh, timing=timing)
         else:
             try:
-                html = self.scraper._post_html(url, payload=payload)
+                html = self.scraper._post_html(
+                    url, payload=payload,
+                    page_key=self._get_result_page_key(url, payload),
+                    refresh=refresh, timing=timing)
             except HTTPError as e:
-                if e.response.status_code == 500:
-                    self.scraper.log.warning(u"Unable to get {} with {}".format(url, payload))
-                    return []
-
-        current_selection = self._get_current_selection(html)
-
-        table = Datatable(html)
-        data = []
-        _region = None
-        for row in table.data:
+                log_timing(timing)
+                if skip_errors and e.response.status_code == 500:
+                    self.scraper.log.warning(u"Unable to get %s with %s",
+                                             url, payload)
+                    self.scraper.stats.incr("skipped_pages_total")
+                    return
+                raise
+
+        for result in self._iter_page_results(html, timing):
+            yield result
+
+    def _iter_page_results(self, html, timing=None):
+        """ Parse a result page, one Result at a time
+            :param html: the html of the page
+            :param timing: the timing event of the request of the page, to
+                log with the time spent parsing it
+        """
+        stats = self.scraper.stats
+        n_rows = 0
+        parse_time = 0.0
+        started = time.time()
+        try:
+            page, current_selection, table = self._read_result_page(html)
+            layout = page.layout
+
+            # Time spent parsing, without the time spent by the consumer
+            for result in self._iter_rows(table, current_selection):
+                parse_time += time.time() - started
+                n_rows += 1
+                yield result
+                started = time.time()
+            parse_time += time.time() - started
+            stats.observe("parse_seconds", parse_time, layout=layout)
+            stats.observe("rows_per_page", n_rows, layout=layout)
+        finally:
+            if timing:
+                timing["parse"] = parse_time
+                log_timing(timing)
+
+    def _read_result_page(self, html):
+        """ Parse a result page, with the stream extractor if the scraper
+            uses it, else (or if it fails) with BeautifulSoup
+            :returns: (page, current selection, table), where page is an
+                ExtractedPage or ResultPage, and table an ExtractedPage or
+                Datatable
+        """
+        stats = self.scraper.stats
+        if self.scraper.extractor == "stream":
+            try:
+                page = extract_page(html)
+                with stats.timer("selection_seconds"):
+                    current_selection = self._get_current_selection(page)
+                return page, current_selection, page
+            except ExtractError as e:
+                self.scraper.log.debug(u"Unable to extract page, using "
+                                       u"BeautifulSoup: %s", e)
+                stats.incr("extract_fallbacks_total")
+
+        page = ResultPage(html)
+        with stats.timer("selection_seconds"):
+            current_selection = self._get_current_selection(page)
+        return page, current_selection, Datatable(page)
+
+    def _iter_rows(self, table, current_selection):
+        """ Get the Results of a result page
+            :param table: a Datatable, or rows like the rows of a Datatable
+            :param current_selection: the selected values of the table
+        """
+        regions_by_label = self._get_region_index()[0]
+        # Units are listed after their region, start with the selected
+        # region in case the table has no region row
+        _region = current_selection["region"][1]
+        for row in table:
             region_or_unit_id, region_or_unit_label = row["region_or_unit"]
-            region = self.regions.get_by_label(region_or_unit_label)
+            region = regions_by_label.get(region_or_unit_label)
             if region:
                 row["region"] = region.label
                 row["unit"] = None
@@ -344,24 +927,128 @@ class VantetiderDataset(Dataset):
             for dim in self.dimensions:
                 if dim.id not in row:
                     row[dim.id] = current_selection[dim.id][1] # gets label
-            data.append(Result(value, row))
+            yield Result(value, row)
 
-        return data
+    def _check_metadata(self):
+        """ Check the metadata snapshot of this dataset against the landing
+            page, once. If the page has options or default values (eg a new
+            latest period) that differ from the snapshot, the snapshot is
+            dropped and the metadata is read from the page.
+
+            Called before a query is planned, never while its pages are
+            fetched, as the dimensions may be replaced.
+        """
+        with self.scraper._metadata_lock:
+            meta = getattr(self, "_metadata", None)
+            if meta is None or meta.get("checked") or \
+                    getattr(self, "_metadata_checked", False):
+                return
+            page = ResultPage(self.html)
+            changes = []
+            for dim_meta in meta["dimensions"]:
+                if dim_meta.get("elem_type") not in ["select", "radio"]:
+                    continue
+                dim = VantetiderDimension(dim_meta["id"])
+                dim.elem_type = dim_meta["elem_type"]
+                dim.options = page.get_options(dim_meta["elem_id"],
+                                               dim_meta["elem_type"])
+                new_options = set(x[0] for x in dim.options) - \
+                    set(x[0] for x in dim_meta["options"])
+                if new_options:
+                    changes.append(u"{} has new values: {}".format(
+                        dim.id, sorted(new_options)))
+                try:
+                    default_value = dim.default_value
+                except (ValueError, IndexError):
+                    default_value = None
+                if default_value != dim_meta["default_value"]:
+                    changes.append(u"{} defaults to {}, not {}".format(
+                        dim.id, default_value, dim_meta["default_value"]))
+
+            if changes:
+                self.scraper.log.warning(
+                    u"Metadata snapshot of %s is outdated, %s", self.id,
+                    u", ".join(changes))
+                self._metadata = None
+                self._dimensions = None
+                if hasattr(self, "_region_index"):
+                    del self._region_index
+                # Read the new metadata here, not in the threads of a fetch
+                self.dimensions
+                self._get_region_index()
+            self._metadata_checked = True
+
+    def get_units(self, region):
+        """ Get the units of a region, from the region's result page
+
+            :param region: id or label of region
+            :returns: a list of Units
+        """
+        region = self._get_region(region)
+        units = []
+        url = self.get_url(region.value)
+        for result in self._iter_result_page(url, {"select_region": region.value}):
+            row = result.raw_dimensions
+            unit = Unit(row["unit_id"], row["unit"], row["region"])
+            if row["unit_id"] is not None and unit not in units:
+                units.append(unit)
+        return units
+
+    def _normalize_payload(self, payload):
+        """ Make semantically equal payloads equal: fill in default values
+            of missing form fields, use region ids rather than labels and
+            make all values strings.
+
+            Missing fields are filled in rather than default values
+            dropped, because the default year and period change as new
+            data is published.
+        """
+        normalized = {}
+        for dim in self.dimensions:
+            if dim.id in ["measure", "unit_id"]:
+                continue
+            value = payload.get(dim.elem_id, dim.default_value)
+            if dim.id == "region":
+                try:
+                    value = self._get_region(value).value
+                except KeyError:
+                    pass
+            normalized[dim.elem_id] = u"{}".format(value)
+        return normalized
+
+    def _get_result_page_key(self, url, payload):
+        """ Get the key a result page is cached under:
+            (dataset id, region slug, normalized payload)
+        """
+        # url is BASE_URL + region_slug + "/" + dataset_id + "/"
+        region_slug = url.rstrip("/").split("/")[-2]
+        return (self.id, region_slug, self._normalize_payload(payload))
 
     def _get_current_selection(self, html):
-        if isinstance(html, str) or isinstance(html, bytes):
-            html = BeautifulSoup(html, "html.parser")
+        """ Get the selected form values of a result page
+            :param html: html, a soup, a ResultPage or an ExtractedPage
+            :returns: {dim_id: (selected_id, selected_label)}
+        """
+        if isinstance(html, ExtractedPage):
+            return html.get_current_selection(self.dimensions)
+        if isinstance(html, ResultPage):
+            html = html.soup
+        elif isinstance(html, str) or isinstance(html, bytes):
+            html = BeautifulSoup(html, HTML_PARSER)
         current_selection = {}
         for dim in self.dimensions:
             if dim.id in ["measure", "unit_id"]:
                 continue
 
-            elem = html.select("[name={}]".format(dim.elem_id))
+            elems = html.select("[name={}]".format(dim.elem_id))
 
-            if len(elem) == 0:
+            if len(elems) == 0:
                 raise Exception("DEBUG!")
+            elif dim.elem_type == "radio":
+                # All radio inputs are needed to find the checked one
+                elem = elems
             else:
-                elem = elem[0]
+                elem = elems[0]
 
             if dim.elem_type == "select":
                 try:
@@ -396,6 +1083,41 @@ class VantetiderDataset(Dataset):
 class VantetiderDimension(Dimension):
     """docstring for VantetiderDimension"""
 
+    def to_dict(self):
+        """ Get the dimension as plain data, for a metadata snapshot
+        """
+        data = {"id": self.id, "label": self.label}
+        if hasattr(self, "elem_id"):
+            try:
+                default_value = self.default_value
+            except ValueError:
+                default_value = None
+            data.update({
+                "elem_id": self.elem_id,
+                "elem_type": self.elem_type,
+                "options": [list(x) for x in self.options],
+                "default_value": default_value,
+                "allowed_values": [[x.value, x.label]
+                                   for x in self.allowed_values],
+            })
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Create a dimension from `to_dict` data
+        """
+        dim = cls(data["id"], label=data["label"])
+        if "elem_id" in data:
+            dim.elem_id = data["elem_id"]
+            dim.elem_type = data["elem_type"]
+            dim.options = [tuple(x) for x in data["options"]]
+            if data["default_value"] is not None:
+                dim._default_value = data["default_value"]
+            dim._allowed_values = ValueList(
+                DimensionValue(value, dim, label=label)
+                for value, label in data["allowed_values"])
+        return dim
+
     @property
     def elem_type(self):
         """ :returns: "select"|"radio"|"checkbox"
@@ -404,6 +1126,9 @@ class VantetiderDimension(Dimension):
             self._elem_type = get_elem_type(self.elem)
         return self._elem_type
 
+    @elem_type.setter
+    def elem_type(self, value):
+        self._elem_type = value
 
     @property
     def default_value(self):
@@ -411,19 +1136,21 @@ class VantetiderDimension(Dimension):
         """
         if not hasattr(self, "_default_value"):
             if self.elem_type == "select":
-                try:
-                    # Get option marked "selected"
-                    def_value = get_option_value(self.elem.select_one("[selected]"))
-                except AttributeError:
+                # Get option marked "selected"...
+                selected = [x for x in self.options if x[2]]
+                if len(selected) == 0:
                     # ...or if that one doesen't exist get the first option
-                    def_value = get_option_value(self.elem.select_one("option"))
-
+                    selected = self.options
+                def_value = selected[0][0]
+                if def_value == "":
+                    raise ValueError(u"Error parsing default value of {}."
+                                     .format(self.id))
 
             elif self.elem_type == "checkbox":
-                def_value = self.elem.get("value")
+                def_value = self.options[0][0]
 
             elif self.elem_type == "radio":
-                def_value = [x for x in self.elem if x.has_attr("checked")][0].get("value")
+                def_value = [x for x in self.options if x[2]][0][0]
 
             self._default_value = def_value
 
@@ -432,59 +1159,123 @@ class VantetiderDimension(Dimension):
         return self._default_value
 
 class PrintLogger():
-    """ Empyt "fake" logger
+    """ Empyt "fake" logger, that prints every message. Pass it as `logger`
+        to the scraper to print instead of using the logging module.
     """
 
-    def log(self, msg, *args, **kwargs):
-        print(msg)
+    def _print(self, msg, args):
+        print(msg % args if args else msg)
+
+    def log(self, level, msg, *args, **kwargs):
+        self._print(msg, args)
 
     def debug(self, msg, *args, **kwargs):
-        print(msg)
+        self._print(msg, args)
 
     def info(self, msg, *args, **kwargs):
-        print(msg)
+        self._print(msg, args)
 
     def warning(self, msg, *args, **kwargs):
-        print(msg)
+        self._print(msg, args)
 
     def error(self, msg, *args, **kwargs):
-        print(msg)
+        self._print(msg, args)
 
     def critical(self, msg, *args, **kwargs):
-        print(msg)
+        self._print(msg, args)
 
 
 # UTILS
+class ResultPage(object):
+    """ A result page, parsed once and shared by VantetiderDataset and
+        Datatable. The table layout is detected when the page is parsed.
+    """
+    def __init__(self, html):
+        """
+            :param html: html of the page, or a soup
+        """
+        if isinstance(html, BeautifulSoup):
+            self.soup = html
+        else:
+            self.soup = BeautifulSoup(html, HTML_PARSER)
+
+        self.has_tabs = self.soup.select_one(".table_switch") is not None
+        self.has_horizontal_scroll = \
+            self.soup.select_one(".DTFC_ScrollWrapper") is not None
+        self.has_vertical_scroll = \
+            self.soup.select_one("#DataTables_Table_0_wrapper") is not None
+
+    @property
+    def layout(self):
+        """ :returns: "tabs"|"vertical_scroll"|"regular"
+        """
+        if self.has_tabs:
+            return "tabs"
+        elif self.has_vertical_scroll:
+            return "vertical_scroll"
+        else:
+            return "regular"
+
+    def get_options(self, elem_id, elem_type):
+        """ Get the options of all form fields with a name
+            :param elem_type: "select" or "radio"
+            :returns: [(value, label, selected)]
+        """
+        elems = self.soup.select("[name={}]".format(elem_id))
+        if elem_type == "select":
+            return [x for elem in elems for x in parse_select_options(elem)]
+        return parse_radio_inputs(elems)
+
+
 class Datatable(object):
     def __init__(self, html):
-        self.soup = BeautifulSoup(html, 'html.parser')
-        self.data = self._parse_values()
+        """
+            :param html: html of a result page, or a ResultPage
+        """
+        if isinstance(html, ResultPage):
+            self.page = html
+        else:
+            self.page = ResultPage(html)
+        self.soup = self.page.soup
+        self._data = None
         self._measures = None
         # Assumption: the data table is the last table on the page
 
-
     @property
     def has_tabs(self):
         """ Does the table have tabs?
             Like http://www.vantetider.se/Kontaktkort/Sveriges/VantatKortareAn60Dagar/
         """
-        return len(self.soup.select(".table_switch")) > 0
+        return self.page.has_tabs
 
     @property
     def has_horizontal_scroll(self):
         """ Does the table have horizontal scroll?
             Like http://www.vantetider.se/Kontaktkort/Sveriges/VantatKortareAn60Dagar/
         """
-        return len(self.soup.select(".DTFC_ScrollWrapper")) > 0
+        return self.page.has_horizontal_scroll
 
     @property
     def has_vertical_scroll(self):
         """ Does the table have vertical scroll?
             Like http://www.vantetider.se/Kontaktkort/Sveriges/PrimarvardTelefon/
         """
-        return bool(self.soup.select_one("#DataTables_Table_0_wrapper"))
+        return self.page.has_vertical_scroll
 
+    @property
+    def data(self):
+        """ All rows of the table as a list of dicts
+        """
+        if self._data is None:
+            self._data = self._parse_values()
+        return self._data
 
+    def __iter__(self):
+        """ Iterate over rows without keeping them
+        """
+        if self._data is not None:
+            return iter(self._data)
+        return self._iter_values()
 
     @property
     def measures(self):
@@ -500,7 +1291,11 @@ class Datatable(object):
     def _parse_values(self):
         """ Get values
         """
-        data = []
+        return list(self._iter_values())
+
+    def _iter_values(self):
+        """ Get values, one row at a time
+        """
         if self.has_tabs:
             def _parse_tab_text(tab):
                 # Annoying html in tabs
@@ -518,11 +1313,13 @@ class Datatable(object):
                 if self.has_horizontal_scroll:
                     _data = self._parse_horizontal_scroll_table(table)
                     for region, col, value in _data:
-                        data.append({
+                        yield {
                             "region_or_unit": region,
-                            "select_period": col, # Hardcode warning!
+                            # Tabs have a column per period
+                            "period": col,
                             "measure": measure,
-                            })
+                            "value": value,
+                            }
 
         else:
             if self.has_horizontal_scroll:
@@ -536,28 +1333,25 @@ class Datatable(object):
                 _data = self._parse_regular_table(table)
 
             for region, measure, value in _data:
-                data.append({
+                yield {
                     "region_or_unit": region,
                     "measure": measure,
                     "value": value
-                })
-
-        return data
+                }
 
     def _parse_horizontal_scroll_table(self, table_html):
         """ Get list of dicts from horizontally scrollable table
         """
-        row_labels = [parse_text(x.text) for x  in table_html.select(".DTFC_LeftBodyWrapper tbody tr")]
+        label_rows = table_html.select(".DTFC_LeftBodyWrapper tbody tr")
+        row_labels = [parse_text(x.text) for x in label_rows]
         row_label_ids = [None] * len(row_labels)
+        if table_html.select_one(".DTFC_LeftBodyWrapper td .clickable"):
+            row_label_ids = [parse_landsting(x.select_one("td .clickable").get("onclick")) for x in label_rows]
         cols = [parse_text(x.text) for x in table_html.select(".dataTables_scrollHead th")]
         value_rows = table_html.select(".dataTables_scrollBody tbody tr")
+        values, missing = parse_value_table([x.select("td") for x in value_rows])
 
-        values = []
-        for row_i, value_row in enumerate(value_rows):
-            row_values = [parse_value(x.text) for x in value_row.select("td")]
-            values.append(row_values)
-
-        sheet = Sheet(zip(row_label_ids, row_labels), cols, values)
+        sheet = Sheet(zip(row_label_ids, row_labels), cols, values, missing)
 
         return sheet.long_format
 
@@ -569,12 +1363,9 @@ class Datatable(object):
             row_label_ids = [parse_landsting(x.select_one("td .clickable").get("onclick")) for x in value_rows]
 
         cols = [parse_text(x.text) for x in table_html.select(".dataTables_scrollHead th")][1:]
-        values = []
-        for row in value_rows:
-            row_values = [ parse_value(x.text) for x in row.select("td")[1:] ]
-            values.append(row_values)
+        values, missing = parse_value_table([x.select("td")[1:] for x in value_rows])
 
-        sheet = Sheet(zip(row_label_ids, row_labels), cols, values)
+        sheet = Sheet(zip(row_label_ids, row_labels), cols, values, missing)
 
         return sheet.long_format
 
@@ -585,71 +1376,37 @@ class Datatable(object):
         if table_html.select_one("td .clickable"):
             row_label_ids = [parse_landsting(x.select_one("td .clickable").get("onclick")) for x in value_rows]
         cols = [parse_text(x.text) for x in table_html.select("th")][1:]
-        values = []
-        for row in value_rows:
-            row_values = [ parse_value(x.text) for x in row.select("td")[1:] ]
-            values.append(row_values)
+        values, missing = parse_value_table([x.select("td")[1:] for x in value_rows])
 
-        sheet = Sheet(zip(row_label_ids, row_labels), cols, values)
+        sheet = Sheet(zip(row_label_ids, row_labels), cols, values, missing)
 
         return sheet.long_format
 
 
 
-class Sheet(object):
-    """ Represents a two-dimensional sheet/table with data
+def get_request_key(method, url, payload=None, page_key=None, refresh=False):
+    """ Get the key that identical requests share, see SingleFlight.
+        Result pages are identified by their page key, see
+        VantetiderDataset._get_result_page_key
     """
-    def __init__(self, rows, cols, values):
-        """
-            :param rows: a list with row values
-            :param cols: a list with column headers
-            :param values: a list of lists with row values
-        """
-        self.values_by_row = values
-        self.values = flatten(values)
-        rows = list(rows)
-        cols = list(cols)
+    if page_key is None:
+        return (method, url, canonical_payload(payload), refresh)
+    dataset_id, region_slug, normalized_payload = page_key
+    return (dataset_id, region_slug, canonical_payload(normalized_payload),
+            refresh)
 
-        if len(rows) * len(cols) == len(self.values):
-            msg = ("Error initing sheet. Factor of n rows ({})",
-                "and cols ({}) don't add up. Got {}, expected {}."\
-                .format(len(rows), len(cols), len(rows) * len(cols), len(self.values)))
 
-        assert len(rows) == len(values)
-        assert len(cols) == len(values[0])
+# A unit of a region, see VantetiderDataset.get_units
+Unit = namedtuple("Unit", ["id", "label", "region"])
 
-        self.row_index = rows
-        self.col_index = cols
 
-    @property
-    def as_dictlist(self):
-        """ Returns a dictlist with values
-            [
-                {
-                    "row": "row_a",
-                    "col": "col_a",
-                    "value": 1,
-                }
-            ]
-        """
-        data = []
-        for row_i, row in enumerate(self.row_index):
-            for col_i, col in enumerate(self.col_index):
-                value = self.values_by_row[row_i][col_i]
-                data.append({
-                    "row": row,
-                    "col": col,
-                    "value": value,
-                    })
-        return data
+def is_unit_row(result, units):
+    """ Check if a Result is a row of one of some units
+        :param units: unit ids or labels
+    """
+    dims = result.raw_dimensions
+    return dims["unit"] in units or dims["unit_id"] in units
 
-    @property
-    def long_format(self):
-        return zip(
-            repeat(self.row_index, len(self.col_index)),
-            self.col_index * len(self.row_index),
-            self.values
-            )
 
 def get_unique(l):
     """ Get unique values from list
@@ -658,6 +1415,60 @@ def get_unique(l):
     """
     return list(set(l))
 
+def parse_select_options(elem):
+    """ Get value, label and selected state of the options in a select
+        <select><option value="27" selected>Blekinge</option></select>
+        => [("27", "Blekinge", True)]
+        :param elem: a soup element
+    """
+    data = []
+    for option in elem.find_all("option"):
+        value = option.get("value")
+        if value is None:
+            value = option.text.strip()
+        data.append((value, get_option_text(option), option.has_attr("selected")))
+    return data
+
+def get_region_slug(label):
+    """ Get the regional slug to be used in url
+        "Norrbotten" => "Norrbottens"
+
+        :param label: label of region
+    """
+    slug = label\
+        .replace(u" ","-")\
+        .replace(u"ö","o")\
+        .replace(u"Ö","O")\
+        .replace(u"ä","a")\
+        .replace(u"å","a")
+
+    if not "region" in slug:
+        slug = slug + "s"
+
+    EXCEPTIONS = {
+        "Jamtland-Harjedalens": "Jamtlands",
+        "Rikets": "Sveriges",
+        "Alla-landstings": "Sveriges",
+        "Alla-regioner": "Sveriges",
+    }
+    if slug in EXCEPTIONS:
+        slug = EXCEPTIONS[slug]
+
+    return slug
+
+def chunked(iterable, n):
+    """ Yield lists of n items
+        chunked([1,2,3], 2) => [1,2], [3]
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == n:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
 def get_elem_type(elem):
     """ Get elem type of soup selection
         :param elem: a soup element
@@ -731,50 +1542,9 @@ def parse_radio_inputs(elem):
     return data
 
 
-def parse_value(val):
-    """ Parse values from html
-    """
-    val = val.replace("%", " ")\
-        .replace(" ","")\
-        .replace(",", ".")\
-        .replace("st","").strip()
-
-    missing = ["Ejdeltagit", "N/A", "-"]
-    if val in missing:
-        return val
-    elif val == "":
-        return None
-
-    return float(val)
-
-def parse_text(val):
-    """ Format strings fetched from html
-    """
-    return val.replace("\n", " ").strip()
-
-def parse_landsting(val):
-    """ Get region/unit id from "handle_click_event_landsting(this, 1)"
-    """
-    try:
-        return re.search("\(this, (\d+)", val).group(1)
-    except AttributeError:
-        return None
-
 def is_string(val):
     return isinstance(val, str) or isinstance(val, unicode)
 
-def flatten(l):
-    """Flatten list of lists
-    """
-    return [item for sublist in l for item in sublist]
-
-def repeat(l, n):
-    """ Repeat all items in list n times
-        repeat([1,2,3], 2) => [1,1,2,2,3,3]
-        http://stackoverflow.com/questions/24225072/repeating-elements-of-a-list-n-times
-    """
-    return [x for x in l for i in range(n)]
-
 def is_int(s):
     try:
         int(s)
@@ -0,0 +1,113 @@
+# encoding: utf-8
+"""A pooled, retrying http session shared by all requests of a scraper.
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+# Status codes that are worth retrying. Vantetider.se responds with 500
+# on some queries that never succeed, so 500 is not retried here: it is
+# returned at once, and the scraper retries the page after the rest of the
+# fetch, see `retry_passes`.
+RETRY_STATUSES = (502, 503, 504)
+
+# Errors of requests that are worth retrying
+RETRY_ERRORS = (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout)
+
+
+# Time spent opening connections (dns lookup, tcp and tls handshakes) by
+# the current thread since the last reset_connect_time()
+_timings = threading.local()
+
+
+def reset_connect_time():
+    _timings.connect = 0.0
+
+
+def get_connect_time():
+    """ Seconds spent opening connections since reset_connect_time(). 0 if
+        a kept-alive connection was used.
+    """
+    return getattr(_timings, "connect", 0.0)
+
+
+class _TimedConnectMixin(object):
+    def connect(self):
+        start = time.time()
+        try:
+            return super(_TimedConnectMixin, self).connect()
+        finally:
+            _timings.connect = get_connect_time() + time.time() - start
+
+
+class TimedHTTPConnection(_TimedConnectMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """ An adapter that records the time spent opening connections, see
+        get_connect_time()
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+def make_session(pool_size=10, retries=3, backoff_factor=0.5, gzip=True):
+    """ Create a requests session with a connection pool that keeps
+        connections to vantetider.se alive between queries.
+
+        :param pool_size: max number of connections kept open per host
+        :param retries: number of retries on connection errors and
+            RETRY_STATUSES responses. 0 disables retries.
+        :param backoff_factor: sleep backoff_factor * 2^(n-1) seconds
+            between retries
+        :param gzip: ask the server for compressed responses
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        # Result pages are fetched with POST, which is safe to repeat here
+        allowed_methods=None,
+        # Return the last response instead of raising, so that the
+        # scraper can handle the status code
+        raise_on_status=False,
+    )
+    adapter = TimedHTTPAdapter(pool_connections=pool_size,
+                               pool_maxsize=pool_size,
+                               max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    if gzip:
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+    else:
+        session.headers["Accept-Encoding"] = "identity"
+
+    return session
@@ -0,0 +1,275 @@
+# encoding: utf-8
+"""Counters and histograms of a scrape run.
+
+Every scraper collects stats in `scraper.stats`:
+
+    requests_total{method}          requests made, including cache hits
+    response_bytes_total            bytes of responses
+    cache_hits_total                responses from the http cache
+    shared_requests_total           requests shared with one in flight
+    http_errors_total{status}       responses with status 4xx/5xx
+    skipped_pages_total             result pages skipped on HTTP 500
+    retried_pages_total             result pages retried after HTTP 500, see
+                                    VantetiderScraper(retry_passes=..)
+    extract_fallbacks_total         result pages read with BeautifulSoup, as
+                                    the stream extractor failed
+    request_seconds{method}         time per request (histogram)
+    selection_seconds               time to read the form state of a page
+    parse_seconds{layout}           time to parse a result page, by layout
+                                    ("tabs", "vertical_scroll" or
+                                    "regular")
+    rows_per_page{layout}           rows of each result page
+
+    scraper.stats.get("cache_hits_total")
+    scraper.stats.get("parse_seconds", layout="tabs").mean
+    scraper.stats.dump("stats.prom")  # or .json
+
+Stats are kept per process. See harvest_all() for how the stats of worker
+processes are collected.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+ROWS_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Buckets of histograms, by name. Others get SECONDS_BUCKETS.
+BUCKETS = {
+    "rows_per_page": ROWS_BUCKETS,
+}
+
+HELP = {
+    "requests_total": u"Requests made, including cache hits",
+    "response_bytes_total": u"Bytes of responses",
+    "cache_hits_total": u"Responses from the http cache",
+    "shared_requests_total": u"Requests shared with an identical request in flight",
+    "http_errors_total": u"Responses with an error status",
+    "skipped_pages_total": u"Result pages skipped on HTTP 500",
+    "retried_pages_total": u"Result pages retried after HTTP 500",
+    "extract_fallbacks_total": u"Result pages read with BeautifulSoup, as the stream extractor failed",
+    "request_seconds": u"Time per request",
+    "selection_seconds": u"Time to read the form state of a result page",
+    "parse_seconds": u"Time to parse a result page",
+    "rows_per_page": u"Rows of each result page",
+}
+
+
+class Histogram(object):
+    """ Counts of observed values, in cumulative buckets
+    """
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.sum / self.count
+
+    def as_dict(self):
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+    def merge(self, other):
+        """ Add the counts of another histogram, or of its as_dict()
+        """
+        if isinstance(other, Histogram):
+            other = other.as_dict()
+        if tuple(other["buckets"]) != self.buckets:
+            raise ValueError(u"Histograms have different buckets")
+        self.counts = [a + b for a, b in zip(self.counts, other["counts"])]
+        self.count += other["count"]
+        self.sum += other["sum"]
+
+    def __repr__(self):
+        return u"<Histogram: count={} sum={:.3f}>".format(self.count, self.sum)
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class Stats(object):
+    """ Thread safe counters and histograms, by name and labels
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def incr(self, name, value=1, **labels):
+        """ Add to a counter
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """ Add a value to a histogram
+        """
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(
+                    BUCKETS.get(name, SECONDS_BUCKETS))
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """ Observe the time spent in a with block
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def get(self, name, **labels):
+        """ Get the value of a counter, or a histogram. Counters that have
+            not been incremented are 0, histograms None.
+        """
+        key = _key(name, labels)
+        if key in self.histograms:
+            return self.histograms[key]
+        return self.counters.get(key, 0)
+
+    def total(self, name):
+        """ Sum of a counter over all labels
+        """
+        return sum(value for (_name, labels), value in self.counters.items()
+                   if _name == name)
+
+    def record_request(self, timing):
+        """ Count a request, from its timing event (see vantetider.logs)
+        """
+        self.incr("requests_total", method=timing["method"])
+        self.incr("response_bytes_total", timing["bytes"])
+        if timing["cache_hit"]:
+            self.incr("cache_hits_total")
+        if timing["shared"]:
+            self.incr("shared_requests_total")
+        if timing["status"] is not None and timing["status"] >= 400:
+            self.incr("http_errors_total", status=str(timing["status"]))
+        self.observe("request_seconds", timing["total"],
+                     method=timing["method"])
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = {}
+            self.histograms = {}
+
+    def as_dict(self):
+        """ All stats, as json serializable dict
+        """
+        with self._lock:
+            return {
+                "elapsed": time.time() - self.started,
+                "counters": [{"name": name, "labels": dict(labels),
+                              "value": value}
+                             for (name, labels), value
+                             in sorted(self.counters.items())],
+                "histograms": [dict(hist.as_dict(), name=name,
+                                    labels=dict(labels))
+                               for (name, labels), hist
+                               in sorted(self.histograms.items())],
+            }
+
+    def merge(self, other):
+        """ Add the stats of another Stats, or of its as_dict(), eg from
+            another process
+        """
+        if isinstance(other, Stats):
+            other = other.as_dict()
+        for counter in other["counters"]:
+            self.incr(counter["name"], counter["value"], **counter["labels"])
+        for hist in other["histograms"]:
+            key = _key(hist["name"], hist["labels"])
+            with self._lock:
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(hist["buckets"])
+                self.histograms[key].merge(hist)
+
+    def to_json(self):
+        return json.dumps(self.as_dict())
+
+    def to_prometheus(self, prefix="vantetider"):
+        """ Stats in the Prometheus text format
+        """
+        def _labels(labels, **extra):
+            labels = list(labels) + sorted(extra.items())
+            if not labels:
+                return u""
+            return u"{" + u",".join(u'{}="{}"'.format(k, v)
+                                    for k, v in labels) + u"}"
+
+        def _header(name, kind):
+            lines.append(u"# HELP {}_{} {}".format(prefix, name,
+                                                   HELP.get(name, name)))
+            lines.append(u"# TYPE {}_{} {}".format(prefix, name, kind))
+
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+
+        last = None
+        for (name, labels), value in counters:
+            if name != last:
+                _header(name, "counter")
+                last = name
+            lines.append(u"{}_{}{} {}".format(prefix, name, _labels(labels),
+                                              value))
+        for (name, labels), hist in histograms:
+            if name != last:
+                _header(name, "histogram")
+                last = name
+            for bound, count in zip(hist.buckets, hist.counts):
+                lines.append(u"{}_{}_bucket{} {}".format(
+                    prefix, name, _labels(labels, le=bound), count))
+            lines.append(u"{}_{}_bucket{} {}".format(
+                prefix, name, _labels(labels, le="+Inf"), hist.count))
+            lines.append(u"{}_{}_sum{} {}".format(prefix, name,
+                                                  _labels(labels), hist.sum))
+            lines.append(u"{}_{}_count{} {}".format(prefix, name,
+                                                    _labels(labels), hist.count))
+        return u"\n".join(lines) + u"\n"
+
+    def dump(self, path, format=None):
+        """ Write stats to a file
+            :param format: "json" or "prometheus". By default "json" if
+                path ends with .json, else "prometheus"
+        """
+        if format is None:
+            format = "json" if path.endswith(".json") else "prometheus"
+        if format == "json":
+            content = self.to_json()
+        elif format == "prometheus":
+            content = self.to_prometheus()
+        else:
+            raise ValueError(u"Unknown format: {}".format(format))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def __repr__(self):
+        return u"<Stats: {} requests, {} cache hits, {} errors>".format(
+            self.total("requests_total"), self.total("cache_hits_total"),
+            self.total("http_errors_total"))